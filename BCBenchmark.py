@@ -0,0 +1,235 @@
+# This file measures how fast the behavioral cloning network trains, and more importantly why it's that fast. There was never a
+# way to tell if BCNeuralNetwork.py was waiting on the disk, on converting float64 data to float32, or on the actual math, so
+# this runs the same model and the same input pipeline and times each part separately:
+#   - input only: how fast the pipeline can hand out batches if nothing is training on them
+#   - compute only: how fast the model trains on a batch that's already in memory
+#   - full training: both together, with the time spent waiting on the next batch split out from the time spent training on it
+# Peak memory use (of each benchmark on its own) and the time taken by each epoch get recorded too, and everything is written
+# to a JSON file so that different batch sizes and data formats (or different machines) can be compared.
+#
+# By default it writes some synthetic data in each storage format to a temporary folder and benchmarks against that. Point
+# sample_directory at some real parsed data to benchmark that instead.
+
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import tempfile
+import multiprocessing
+import numpy
+import tensorflow as tf
+from tensorflow import keras
+from FeatureEncoder import X_FEATURES, Y_FEATURES
+from ShardedDataset import ShardWriter
+from CompactCodec import encode_x, encode_y
+from BCDataPipeline import find_games, make_blocks, count_frames, make_dataset
+from BCNeuralNetwork import build_model
+
+# Set this to a folder of parsed data to benchmark it rather than synthetic data.
+sample_directory = None
+# How much synthetic data to make, and in which formats. "float64" is the per-game file layout we originally trained on, "float32"
+# and "compact" are the sharded layouts (see ShardedDataset.py and CompactCodec.py).
+synthetic_games = 200
+synthetic_frames_per_game = 8000
+synthetic_formats = ("float64", "float32", "compact")
+# Batch sizes to try, and how many epochs to run each one for.
+batch_sizes = (512, 2048)
+epochs = 2
+# How many batches to time in the compute only test.
+compute_batches = 200
+# Input pipeline settings, same as in BCNeuralNetwork.py.
+block_frames = 1024
+buffer_blocks = 64
+reader_threads = 4
+# Where the results go. Each run adds its results to the end of the file.
+results_path = "bc_benchmark_results.json"
+
+
+# Peak memory use of this process so far, in megabytes. Every benchmark gets its own process (see run_benchmark), so this is the
+# peak for that one benchmark.
+def peak_rss_mb():
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux reports this in kilobytes, macOS in bytes.
+        return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+    except ImportError:
+        import psutil
+        return psutil.Process().memory_info().peak_wset / (1024 * 1024)
+
+
+# Makes up gamestate and controller data that looks like the real thing: positions and percents in a sensible range, whole
+# numbers of jumps and action IDs, and 0/1 flags and buttons. The values don't mean anything, but the sizes and types do.
+def synthetic_game(rng: numpy.random.Generator, frames: int):
+    x = numpy.empty((frames, len(X_FEATURES)), dtype=numpy.float32)
+    for column, name in enumerate(X_FEATURES):
+        if name == "stage":
+            x[:, column] = rng.integers(0, 27) / 26
+        elif name.endswith(("_x", "_y")):
+            x[:, column] = rng.uniform(-0.5, 0.5, frames)
+        elif name.endswith("_percent"):
+            x[:, column] = rng.integers(0, 300, frames) / 999
+        elif name.endswith("_action"):
+            x[:, column] = rng.integers(0, 397, frames) / 397
+        elif name.endswith("_action_frame"):
+            x[:, column] = rng.integers(0, 60, frames) / 250
+        elif name.endswith("_jumps"):
+            x[:, column] = rng.integers(0, 3, frames) / 2
+        elif name.endswith("_shield"):
+            x[:, column] = rng.integers(0, 11, frames) / 10
+        else:
+            x[:, column] = rng.integers(0, 2, frames)
+    y = numpy.empty((frames, len(Y_FEATURES)), dtype=numpy.float32)
+    y[:, :5] = rng.integers(0, 2, (frames, 5))
+    y[:, 5:] = rng.integers(0, 11, (frames, 4)) / 10
+    return x, y
+
+
+# Writes the synthetic data set in one storage format. Fox (1) is always player 1 so that every game gets used.
+def write_synthetic_data(path: str, data_format: str):
+    rng = numpy.random.default_rng(0)
+    if data_format == "float64":
+        os.makedirs(os.path.join(path, "0"), exist_ok=True)
+        for game in range(1, synthetic_games + 1):
+            x, y = synthetic_game(rng, synthetic_frames_per_game)
+            numpy.save(os.path.join(path, "0", f"{game}-1-15-x"), x.astype(numpy.float64))
+            numpy.save(os.path.join(path, "0", f"{game}-1-15-y0"), y.astype(numpy.float64))
+            numpy.save(os.path.join(path, "0", f"{game}-1-15-y1"), y.astype(numpy.float64))
+        return
+
+    compact = data_format == "compact"
+    writer = ShardWriter(path, compact=compact, stocks=False)
+    for game in range(1, synthetic_games + 1):
+        x, y = synthetic_game(rng, synthetic_frames_per_game)
+        if compact:
+            x, y = encode_x(x), encode_y(y)
+        writer.add(game, f"{game}.slp", 1, 15, 0, [1, 2], x, y, y)
+    writer.close()
+
+
+# One training step, written out rather than going through fit() so that it can be timed separately from fetching the batch.
+def make_train_step(bc_model: keras.Model):
+    @tf.function
+    def train_step(x, y):
+        with tf.GradientTape() as tape:
+            loss = tf.reduce_mean(keras.losses.mean_squared_error(y, bc_model(x, training=True)))
+        gradients = tape.gradient(loss, bc_model.trainable_variables)
+        bc_model.optimizer.apply_gradients(zip(gradients, bc_model.trainable_variables))
+        return loss
+    return train_step
+
+
+# Runs all three tests for one data set and batch size, and returns the results.
+def benchmark(data_path: str, data_format: str, batch_size: int):
+    games = find_games(data_path)
+    blocks = make_blocks(games, block_frames)
+    frames = count_frames(games, blocks, block_frames)
+
+    def dataset():
+        return make_dataset(games, blocks, batch_size, block_frames, buffer_blocks, reader_threads=reader_threads, seed=0)
+
+    # Input only.
+    start = time.perf_counter()
+    for x, y in dataset():
+        pass
+    input_seconds = time.perf_counter() - start
+
+    # Compute only. The first call traces the function, so it doesn't count.
+    bc_model = build_model()
+    train_step = make_train_step(bc_model)
+    x, y = next(iter(dataset()))
+    train_step(x, y).numpy()
+    start = time.perf_counter()
+    for batch in range(compute_batches):
+        train_step(x, y).numpy()
+    compute_seconds = time.perf_counter() - start
+    compute_samples = compute_batches * int(x.shape[0])
+
+    # Full training. Waiting on next() is input stall; everything from there until the loss comes back is compute.
+    epoch_seconds = []
+    waiting = 0.0
+    training = 0.0
+    samples = 0
+    for epoch in range(epochs):
+        epoch_start = time.perf_counter()
+        iterator = iter(dataset())
+        while True:
+            start = time.perf_counter()
+            try:
+                x, y = next(iterator)
+            except StopIteration:
+                break
+            fetched = time.perf_counter()
+            train_step(x, y).numpy()
+            waiting += fetched - start
+            training += time.perf_counter() - fetched
+            samples += int(x.shape[0])
+        epoch_seconds.append(time.perf_counter() - epoch_start)
+
+    total = sum(epoch_seconds)
+    return {
+        "data_format": data_format,
+        "data_path": data_path,
+        "batch_size": batch_size,
+        "frames": frames,
+        "input_only_samples_per_sec": frames / input_seconds,
+        "compute_only_samples_per_sec": compute_samples / compute_seconds,
+        "training_samples_per_sec": samples / total,
+        "input_wait_seconds": waiting,
+        "compute_seconds": training,
+        "input_wait_fraction": waiting / total,
+        "epoch_seconds": epoch_seconds,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+# Runs benchmark() in a brand new process, which goes away afterwards, so that no benchmark inherits another's peak memory use or
+# leftover TensorFlow state.
+def run_benchmark(data_path: str, data_format: str, batch_size: int):
+    with multiprocessing.get_context("spawn").Pool(1) as pool:
+        return pool.apply(benchmark, (data_path, data_format, batch_size))
+
+
+if __name__ == "__main__":
+    temp_directory = None
+    if sample_directory is not None:
+        data_sets = [(sample_directory, "sample")]
+    else:
+        temp_directory = tempfile.mkdtemp(prefix="bc_benchmark_")
+        data_sets = []
+        for data_format in synthetic_formats:
+            path = os.path.join(temp_directory, data_format)
+            print(f"Writing synthetic {data_format} data...")
+            write_synthetic_data(path, data_format)
+            data_sets.append((path, data_format))
+
+    results = []
+    try:
+        for data_path, data_format in data_sets:
+            for batch_size in batch_sizes:
+                result = run_benchmark(data_path, data_format, batch_size)
+                print(f"{data_format}, batch size {batch_size}: {result['training_samples_per_sec']:.0f} samples/sec training, "
+                      f"{result['input_only_samples_per_sec']:.0f} input only, {result['compute_only_samples_per_sec']:.0f} compute only, "
+                      f"{100 * result['input_wait_fraction']:.1f}% of the time waiting on input, peak RSS {result['peak_rss_mb']:.0f}MB")
+                results.append(result)
+    finally:
+        if temp_directory is not None:
+            shutil.rmtree(temp_directory, ignore_errors=True)
+
+    run = {
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "machine": {"platform": platform.platform(), "processor": platform.processor(), "cpu_count": os.cpu_count(),
+                    "tensorflow": tf.__version__},
+        "settings": {"epochs": epochs, "block_frames": block_frames, "buffer_blocks": buffer_blocks, "reader_threads": reader_threads},
+        "results": results,
+    }
+    runs = []
+    if os.path.isfile(results_path):
+        with open(results_path, "r") as results_file:
+            runs = json.load(results_file)
+    runs.append(run)
+    with open(results_path, "w") as results_file:
+        json.dump(runs, results_file, indent=4)
+    print(f"Results written to {results_path}.")
@@ -1,13 +1,16 @@
 # This file wires up the BC network's outputs to controller inputs, allowing it to actually try playing the game rather than predicting
 # static input/output matches.
 
-import tensorflow as tf
-from tensorflow import keras
 import melee
 import signal
 import sys
 import os
+import atexit
+import numpy
 from Stop import stop
+from FrameTimer import FrameTimer, NullFrameTimer
+from BCInference import load_policy, AsyncPolicy
+from FeatureEncoder import StateEncoder, send_simple_input
 
 # Tells the program where the emulator is located.
 homeDirectory = os.path.expanduser('~'+os.environ.get("USERNAME"))
@@ -17,8 +20,54 @@ controller = melee.Controller(console=console, port=1)
 # This controller will be used to select an in-game CPU opponent to play against.
 opponentController = melee.Controller(console=console, port=2)
 
-# Load in the model.
-bc_model = keras.models.load_model('saved_symmetric_melee_model')
+# Load in the model. Rather than going through Keras, this runs the network with numpy (see BCInference.py), which is fast enough
+# to make a move on every single frame. This can also be one of the .tflite files made by BCQuantize.py, like
+# 'saved_symmetric_melee_model_int8.tflite', but check quantization_report.json first to see if it still plays the same.
+model_path = 'saved_symmetric_melee_model'
+# When running lots of bots at once, set this to the address of a running BCInferenceServer.py, like ("127.0.0.1", 50051), and
+# the bot will ask it for every move instead of loading the model itself.
+inference_server = None
+if inference_server is not None:
+    from BCInferenceServer import RemotePolicy
+    bc_model = RemotePolicy(inference_server)
+else:
+    bc_model = load_policy(model_path)
+# Turns each gamestate into the network's input, the exact same way the training data was made (see FeatureEncoder.py). Our bot
+# is port 1 and the CPU is port 2.
+state_encoder = StateEncoder(ports=(1, 2))
+
+# Set this to True to run the model on a separate thread while the emulator works on the next frame, rather than doing everything
+# one step after another. The move for each frame is then sent on the frame after it, once the next console.step() comes back.
+# If the prediction still isn't done decision_wait_ms after that, the bot doesn't wait for it: it sends stale_action instead,
+# which is either "repeat" (send the last move again) or "neutral" (let go of everything). How often that happens gets printed
+# when the script exits.
+pipelined = False
+decision_wait_ms = 2
+stale_action = "repeat"
+# No buttons and both sticks in the middle.
+neutral_input = numpy.array([[0, 0, 0, 0, 0, 0.5, 0.5, 0.5, 0.5]], dtype=numpy.float32)
+
+# Set this to True to time every stage of every frame the bot plays (see FrameTimer.py). The results get printed and saved to
+# timings_path when the script exits, including with CTRL+C.
+time_frames = False
+timings_path = "bcbot_frame_times.json"
+timed_stages = ("step", "wait", "send", "encode", "submit") if pipelined else ("step", "encode", "predict", "send")
+frame_timer = FrameTimer(timed_stages) if time_frames else NullFrameTimer()
+atexit.register(frame_timer.dump, timings_path)
+
+if pipelined:
+    async_model = AsyncPolicy(bc_model)
+    # The last move that was sent, for when a prediction is late.
+    last_input = neutral_input.copy()
+    # Whether there's a prediction on its way for the previous frame, and how many came back too late.
+    awaiting_decision = False
+    stale_decisions = 0
+    decisions = 0
+
+    def report_stale_decisions():
+        print(f"{decisions} decisions, {stale_decisions} were late and replaced with the {stale_action} action, "
+              f"{async_model.dropped} frames were skipped because the model was still busy.")
+    atexit.register(report_stale_decisions)
 
 # This allows us to CTRL+C to close the emulator and kill the script rather than having to do those things separately.
 def close(sig, frame):
@@ -36,105 +85,50 @@ console.connect()
 controller.connect()
 opponentController.connect()
 
-# This function takes all of the gamestate data and converts it into the format of the data that was fed into our NN.
-def generate_state(gamestate: melee.GameState):
-    # We have to nest the actual inputs within another array because of a quirk in how the model training data was 
-    # formatted. Oops.
-    outer_list = []
-    inner_list = []
-
-    # Normalized stage.
-    inner_list.append(gamestate.stage.value/26)
-    # P1 XY coordinates.
-    inner_list.append(gamestate.players[1].x/500)
-    inner_list.append(gamestate.players[1].y/500)
-    # P2 XY coordinates.
-    inner_list.append(gamestate.players[2].x/500)
-    inner_list.append(gamestate.players[2].y/500)
-    # Percent
-    inner_list.append(gamestate.players[1].percent/999)
-    inner_list.append(gamestate.players[2].percent/999)
-    # Action
-    inner_list.append(gamestate.players[1].action.value/397)
-    inner_list.append(gamestate.players[2].action.value/397)
-    # Action Frame
-    inner_list.append(gamestate.players[1].action_frame/250)
-    inner_list.append(gamestate.players[2].action_frame/250)
-    # Facing
-    inner_list.append(int(gamestate.players[1].facing))
-    inner_list.append(int(gamestate.players[2].facing))
-    # Jumps
-    inner_list.append(gamestate.players[1].jumps_left/2)
-    inner_list.append(gamestate.players[2].jumps_left/2)
-    # Inv
-    inner_list.append(int(gamestate.players[1].invulnerable))
-    inner_list.append(int(gamestate.players[2].invulnerable))
-    # On Ground
-    inner_list.append(int(gamestate.players[1].on_ground))
-    inner_list.append(int(gamestate.players[2].on_ground))
-    # Offstage
-    inner_list.append(int(gamestate.players[1].off_stage))
-    inner_list.append(int(gamestate.players[2].off_stage))
-    # Shield
-    inner_list.append(round(gamestate.players[1].shield_strength/60, 1))
-    inner_list.append(round(gamestate.players[2].shield_strength/60, 1))
-    
-    outer_list.append(inner_list)
-    return outer_list
-
-# Since there's no way for the bot to convey holding or pressing buttons, we use a simplified input scheme where
-# the button it is most likely to press gets pressed on a given frame.
-def send_simple_input(input, controller: melee.Controller):
-    # Find most likely to be pressed button
-    score = 0
-    button = -1
-    it = 0
-    for x in input[0]:
-        # This means we've gotten into stick position territory. Stop looking.
-        if it > 4:
-            break
-        if score < x:
-            score = x
-            button = it
-        it += 1
-
-    # Conver the number to an actual button.
-    if button == 0:
-        button = melee.Button.BUTTON_A
-    elif button == 1:
-        button = melee.Button.BUTTON_B
-    elif button == 2:
-        button = melee.Button.BUTTON_X
-    elif button == 3:
-        button = melee.Button.BUTTON_L
-    elif button == 4:
-        button = melee.Button.BUTTON_Z
-    else:
-        button = None
-
-    # Sends to the emulator a controller position with the desired stick positions, rounded to the nearest tenth just like the
-    # training data was, as well as a button to be pressed.
-    controller.simple_press(round(input[0][5], 1), round(input[0][6], 1), button)
-    
 # This value helps us get around a bug with melee.MenuHelper selecting CPU players. You'll see it in action momentarily.
 cpu_select_counter = 100
-# This value helps us deal with the network timing out. You'll see it in action momentarily.
-frame_counter = 0
-
 # Game loop.
 while True:
-    # Increment our frame counter.
-    frame_counter += 1
     # Get next frame.
+    frame_timer.start()
     gamestate = console.step()
+    frame_timer.mark("step")
+    in_game = gamestate.menu_state in [melee.Menu.IN_GAME, melee.Menu.SUDDEN_DEATH]
+    # A prediction from the last frame of a game shouldn't get sent in the menus.
+    if pipelined and not in_game:
+        awaiting_decision = False
     
     # If the game is active, make a move.
-    if gamestate.menu_state in [melee.Menu.IN_GAME, melee.Menu.SUDDEN_DEATH]:
-        input = None
-        # Only send a move every other frame, since our model is too slow to manage an input every frame.
-        if frame_counter % 2 == 0:
-            input = bc_model.predict(generate_state(gamestate))
+    if in_game:
+        if pipelined:
+            # Send the move for the previous frame, or a stand-in if it isn't ready in time.
+            if awaiting_decision:
+                input = async_model.result(decision_wait_ms / 1000)
+                frame_timer.mark("wait")
+                decisions += 1
+                if input is None:
+                    stale_decisions += 1
+                    input = last_input if stale_action == "repeat" else neutral_input
+                else:
+                    last_input[:] = input
+                send_simple_input(input, controller)
+                frame_timer.mark("send")
+            # Then start working out the move for this one while the emulator moves on.
+            state = state_encoder.encode(gamestate)
+            frame_timer.mark("encode")
+            async_model.submit(state)
+            awaiting_decision = True
+            frame_timer.mark("submit")
+            frame_timer.end_frame()
+        else:
+            # Keras used to be too slow for this to keep up, so we only sent a move every other frame. Now we can send one every frame.
+            state = state_encoder.encode(gamestate)
+            frame_timer.mark("encode")
+            input = bc_model.predict(state)
+            frame_timer.mark("predict")
             send_simple_input(input, controller)
+            frame_timer.mark("send")
+            frame_timer.end_frame()
     
     # Select the right game mode.
     elif gamestate.menu_state == melee.Menu.MAIN_MENU:
@@ -0,0 +1,199 @@
+# This file feeds the parsed replay data to the behavioral cloning network without ever loading the whole thing into memory. The
+# training script used to memory map every game in a stage folder, then concatenate them all and cast them to float32, which made
+# a full in-memory copy of the stage anyway. That's why we had to train one stage directory at a time.
+#
+# Instead, every game is split up into blocks of consecutive frames. Each pass over the data visits the blocks in a random order,
+# reads a handful of them at a time from the memory mapped arrays into a fixed-size buffer, shuffles the frames within that
+# buffer, and hands them out in batches. Memory use depends only on the buffer size, not on how much data there is, and frames
+# from every stage get mixed together.
+
+import os
+import zlib
+import itertools
+import numpy
+import melee
+from FeatureEncoder import X_FEATURES, Y_FEATURES
+from CompactCodec import as_x_features, as_y_features
+from ShardedDataset import load_info, load_index, open_shards, open_stock_shards, game_segments, read_game
+
+
+# Finds every game in a parsed data set, in either the per-game file layout or the sharded layout from BCNetDataGenerator.py.
+# Returns a list of (game ID, x, y) tuples, where x and y are memory mapped arrays and y is the controller data of whichever
+# player was playing `character`. A game that's split across two shards shows up as two entries with the same ID.
+def find_games(load_directory: str, character: melee.Character = melee.Character.FOX):
+    if os.path.isfile(os.path.join(load_directory, "dataset.json")):
+        return _find_sharded_games(load_directory, character)
+    return _find_game_files(load_directory, character)
+
+
+def _find_sharded_games(load_directory: str, character: melee.Character):
+    shard_frames = load_info(load_directory)["shard_frames"]
+    shards = open_shards(load_directory)
+    games = []
+    for row in load_index(load_directory):
+        # If p1 is playing the character, use the Y0 data, otherwise if p2 is, use the Y1 data.
+        if row["p1_character"] == character.value:
+            player = 1
+        elif row["p2_character"] == character.value:
+            player = 2
+        else:
+            continue
+        for segment in game_segments(shards, row, shard_frames):
+            games.append((row["replay_id"], segment[0], segment[player]))
+    return games
+
+
+def _find_game_files(load_directory: str, character: melee.Character):
+    games = []
+    for game_id, p1_character, p2_character, x_path, y0_path, y1_path in _game_files(load_directory):
+        # If p1 is playing the character, load in the X data and the Y0 data. If p1 is not but p2 is, the Y1 data.
+        if p1_character == character.value:
+            y_path = y0_path
+        elif p2_character == character.value:
+            y_path = y1_path
+        else:
+            continue
+        # Note that we're loading these in memory mapped. Nothing gets read from disk until a batch needs it.
+        games.append((game_id, numpy.load(x_path, mmap_mode="r"), numpy.load(y_path, mmap_mode="r")))
+    return games
+
+
+# Walks the per-game file layout and yields (game ID, p1 character, p2 character, x path, y0 path, y1 path) for every game.
+def _game_files(load_directory: str):
+    for directory, subdirectory, data_files in os.walk(load_directory):
+        # There were three crashes throughout the course of the data writing process. That may mean incomplete data, so only games
+        # with all three of their files are used. A set makes checking that a lot quicker than searching the list.
+        data_files = set(data_files)
+        for file in sorted(data_files):
+            # Files are named "ID-P1 character-P2 character-data set.npy". Anything else (like the manifest) gets ignored.
+            file_breakdown = file.split("-")
+            if len(file_breakdown) != 4 or file_breakdown[3] != "x.npy" or not file_breakdown[0].isdigit():
+                continue
+            prefix = f"{file_breakdown[0]}-{file_breakdown[1]}-{file_breakdown[2]}-"
+            if f"{prefix}y0.npy" not in data_files or f"{prefix}y1.npy" not in data_files:
+                continue
+            yield (int(file_breakdown[0]), int(file_breakdown[1]), int(file_breakdown[2]), os.path.join(directory, file),
+                   os.path.join(directory, f"{prefix}y0.npy"), os.path.join(directory, f"{prefix}y1.npy"))
+
+
+# Like find_games, but returns every game whatever the characters, with both players' controller data and stock counts: a list
+# of (game ID, p1 character, p2 character, x, y0, y1, stocks) tuples of memory mapped arrays. stocks is None for games parsed
+# before the stock counts were being saved.
+def find_replays(load_directory: str):
+    if not os.path.isfile(os.path.join(load_directory, "dataset.json")):
+        replays = []
+        for game_id, p1_character, p2_character, x_path, y0_path, y1_path in _game_files(load_directory):
+            stocks_path = x_path[:-len("x.npy")] + "stocks.npy"
+            stocks = numpy.load(stocks_path, mmap_mode="r") if os.path.isfile(stocks_path) else None
+            replays.append((game_id, p1_character, p2_character, numpy.load(x_path, mmap_mode="r"),
+                            numpy.load(y0_path, mmap_mode="r"), numpy.load(y1_path, mmap_mode="r"), stocks))
+        return replays
+
+    shard_frames = load_info(load_directory)["shard_frames"]
+    shards = open_shards(load_directory)
+    stock_shards = open_stock_shards(load_directory)
+    return [(row["replay_id"], row["p1_character"], row["p2_character"]) + tuple(read_game(shards, row, shard_frames))
+            + (read_game(stock_shards, row, shard_frames)[0] if stock_shards is not None else None,)
+            for row in load_index(load_directory)]
+
+
+# Splits every game into blocks of up to block_frames consecutive frames. Returns two arrays: which game each block comes from,
+# and which frame it starts on. Blocks are the unit that gets shuffled, so there are a lot of them, hence arrays over a list.
+def make_blocks(games: list, block_frames: int = 1024):
+    block_games = []
+    block_starts = []
+    for game_number, (game_id, x, y) in enumerate(games):
+        # Ensure that every gamestate has a matching controller input. A game that doesn't line up is left out.
+        if len(x) != len(y):
+            print(f"Skipping game {game_id}, Y entries do not match X entries.")
+            continue
+        starts = numpy.arange(0, len(x), block_frames, dtype=numpy.int64)
+        block_games.append(numpy.full(len(starts), game_number, dtype=numpy.int32))
+        block_starts.append(starts)
+    if not block_games:
+        return numpy.empty(0, dtype=numpy.int32), numpy.empty(0, dtype=numpy.int64)
+    return numpy.concatenate(block_games), numpy.concatenate(block_starts)
+
+
+# Splits blocks into a training set and a testing set by game, so that neighbouring frames of the same game (which are nearly
+# identical) can never end up on both sides and make the test results look better than they are. Whether a game is held out
+# depends only on its ID and the seed, so it's the same every run, even after more games get added to the data set.
+def split_blocks(games: list, blocks: tuple, test_size: float = 0.2, seed: int = 20):
+    block_games, block_starts = blocks
+    is_test_game = numpy.array([zlib.crc32(f"{seed}-{game_id}".encode()) / 0xFFFFFFFF < test_size for game_id, x, y in games],
+                               dtype=bool)
+    is_test_block = is_test_game[block_games]
+    train_blocks = (block_games[~is_test_block], block_starts[~is_test_block])
+    test_blocks = (block_games[is_test_block], block_starts[is_test_block])
+    return train_blocks, test_blocks
+
+
+# Counts how many frames a set of blocks covers.
+def count_frames(games: list, blocks: tuple, block_frames: int = 1024):
+    block_games, block_starts = blocks
+    lengths = numpy.array([len(x) for game_id, x, y in games], dtype=numpy.int64)
+    if len(block_games) == 0:
+        return 0
+    return int(numpy.minimum(lengths[block_games] - block_starts, block_frames).sum())
+
+
+# Goes through the given blocks once, in a random order, and yields (x, y) float32 batches. Only buffer_blocks blocks are held in
+# memory at a time: those get read in, their frames get shuffled together, and then they're handed out batch by batch.
+def batch_generator(games: list, blocks: tuple, batch_size: int = 512, block_frames: int = 1024, buffer_blocks: int = 64,
+                    shuffle: bool = True, seed: int = None):
+    block_games, block_starts = blocks
+    rng = numpy.random.default_rng(seed)
+    order = rng.permutation(len(block_games)) if shuffle else numpy.arange(len(block_games))
+
+    # Allocated once and reused for every buffer's worth of blocks.
+    buffer_x = numpy.empty((buffer_blocks * block_frames, len(X_FEATURES)), dtype=numpy.float32)
+    buffer_y = numpy.empty((buffer_blocks * block_frames, len(Y_FEATURES)), dtype=numpy.float32)
+
+    for first in range(0, len(order), buffer_blocks):
+        # Read the next few blocks straight into the buffer. Old float64 data gets cast and compact data gets decoded on the way.
+        filled = 0
+        for block in order[first:first + buffer_blocks]:
+            game_id, x, y = games[block_games[block]]
+            start = block_starts[block]
+            stop = min(start + block_frames, len(x))
+            as_x_features(x[start:stop], out=buffer_x[filled:filled + stop - start])
+            as_y_features(y[start:stop], out=buffer_y[filled:filled + stop - start])
+            filled += stop - start
+
+        rows = rng.permutation(filled) if shuffle else numpy.arange(filled)
+        for batch in range(0, filled, batch_size):
+            # Fancy indexing makes a copy, so the buffer is free to be overwritten once these have been handed out.
+            batch_rows = rows[batch:batch + batch_size]
+            yield buffer_x[batch_rows], buffer_y[batch_rows]
+
+
+# Wraps batch_generator in a tf.data pipeline. The blocks are dealt out round-robin between reader_threads generators, which
+# tf.data runs on background threads and interleaves, and finished batches are prefetched so the next one is ready as soon as
+# the model wants it. Every time the dataset is iterated (so, every epoch), it's reshuffled.
+def make_dataset(games: list, blocks: tuple, batch_size: int = 512, block_frames: int = 1024, buffer_blocks: int = 64,
+                 shuffle: bool = True, reader_threads: int = 4, seed: int = None):
+    # Importing TensorFlow here rather than at the top keeps it out of things that only need the numpy side of this file.
+    import tensorflow as tf
+
+    block_games, block_starts = blocks
+    reader_threads = max(1, min(reader_threads, len(block_games)))
+    # A fresh seed every time a reader starts up, so every epoch sees a different order (but the same ones from run to run if a
+    # seed was given).
+    passes = itertools.count()
+
+    def reader(thread: int):
+        thread = int(thread)
+        pass_seed = None if seed is None else seed + 1000 * next(passes) + thread
+        reader_blocks = (block_games[thread::reader_threads], block_starts[thread::reader_threads])
+        yield from batch_generator(games, reader_blocks, batch_size, block_frames, max(1, buffer_blocks // reader_threads),
+                                   shuffle, pass_seed)
+
+    signature = (tf.TensorSpec(shape=(None, len(X_FEATURES)), dtype=tf.float32),
+                 tf.TensorSpec(shape=(None, len(Y_FEATURES)), dtype=tf.float32))
+    dataset = tf.data.Dataset.range(reader_threads).interleave(
+        lambda thread: tf.data.Dataset.from_generator(reader, args=(thread,), output_signature=signature),
+        cycle_length=reader_threads,
+        num_parallel_calls=reader_threads,
+        deterministic=not shuffle,
+    )
+    return dataset.prefetch(tf.data.AUTOTUNE)
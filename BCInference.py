@@ -0,0 +1,243 @@
+# Keras' predict() has so much overhead per call that BCBot.py could only afford to make a move every other frame. The network
+# itself is tiny, just a few Dense layers, so this file pulls the weights out of the saved model and runs the same math with
+# numpy, writing every layer's output into arrays that are allocated once up front. A single prediction takes microseconds
+# instead of milliseconds.
+#
+# The weights are cached next to the saved model as a .npz file the first time it's loaded, so after that the bot doesn't even need
+# TensorFlow installed. The cache remembers a hash of the saved model's files, and gets rebuilt if the model is retrained.
+
+import os
+import hashlib
+import threading
+import numpy
+
+# The activations our models use, applied in place.
+def _relu(values: numpy.ndarray):
+    numpy.maximum(values, 0, out=values)
+
+
+def _sigmoid(values: numpy.ndarray):
+    # Anything past +-80 is already 0 or 1 in float32, and clipping keeps exp() from overflowing and warning about it.
+    numpy.clip(values, -80, 80, out=values)
+    numpy.negative(values, out=values)
+    numpy.exp(values, out=values)
+    values += 1
+    numpy.reciprocal(values, out=values)
+
+
+def _tanh(values: numpy.ndarray):
+    numpy.tanh(values, out=values)
+
+
+def _linear(values: numpy.ndarray):
+    pass
+
+
+ACTIVATIONS = {"relu": _relu, "sigmoid": _sigmoid, "tanh": _tanh, "linear": _linear}
+
+
+# Pulls the weights, biases and activation of every Dense layer out of a saved Keras model.
+def extract_layers(model_directory: str):
+    # Only needed the first time a model is loaded, so TensorFlow is imported here rather than at the top.
+    from tensorflow import keras
+    bc_model = keras.models.load_model(model_directory, compile=False)
+    layers = []
+    for layer in bc_model.layers:
+        if not isinstance(layer, keras.layers.Dense):
+            continue
+        weights, biases = layer.get_weights()
+        layers.append((weights, biases, layer.activation.__name__))
+    return layers
+
+
+# A hash of every file in a saved model directory. Content rather than modification times, since git checkouts change those.
+def model_fingerprint(model_directory: str):
+    digest = hashlib.sha1()
+    for root, directories, files in sorted(os.walk(model_directory)):
+        directories.sort()
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            digest.update(os.path.relpath(path, model_directory).replace(os.sep, "/").encode())
+            with open(path, "rb") as model_file:
+                digest.update(model_file.read())
+    return digest.hexdigest()
+
+
+# Runs the behavioral cloning network with numpy. Takes a list of (weights, biases, activation name) tuples, one per Dense layer.
+class NumpyPolicy:
+    def __init__(self, layers: list, max_batch: int = 1):
+        self.weights = [numpy.ascontiguousarray(weights, dtype=numpy.float32) for weights, biases, activation in layers]
+        self.biases = [numpy.ascontiguousarray(biases, dtype=numpy.float32) for weights, biases, activation in layers]
+        self.activation_names = [activation for weights, biases, activation in layers]
+        self.activations = [ACTIVATIONS[activation] for activation in self.activation_names]
+        self.input_size = self.weights[0].shape[0]
+        self.output_size = self.weights[-1].shape[1]
+        self.max_batch = 0
+        self._allocate(max_batch)
+
+    # Allocates the array each layer writes its output into, big enough for max_batch samples at once.
+    def _allocate(self, max_batch: int):
+        self.max_batch = max_batch
+        self._outputs = [numpy.empty((max_batch, weights.shape[1]), dtype=numpy.float32) for weights in self.weights]
+
+    # Loads a saved model, using the cached .npz weights next to it if they were made from the model as it is now, and making
+    # them if not. If only the .npz is there (say, on a machine without TensorFlow), it gets used as is.
+    @classmethod
+    def load(cls, model_directory: str, max_batch: int = 1):
+        weights_path = os.path.normpath(model_directory) + ".npz"
+        fingerprint = model_fingerprint(model_directory) if os.path.isdir(model_directory) else None
+        if os.path.isfile(weights_path):
+            with numpy.load(weights_path) as saved:
+                cached = str(saved["fingerprint"]) if "fingerprint" in saved.files else None
+            if fingerprint is None or cached == fingerprint:
+                return cls.from_npz(weights_path, max_batch)
+            print(f"{model_directory} has changed since {weights_path} was made, rebuilding it.")
+        policy = cls(extract_layers(model_directory), max_batch)
+        policy.save_npz(weights_path, fingerprint)
+        return policy
+
+    @classmethod
+    def from_npz(cls, weights_path: str, max_batch: int = 1):
+        with numpy.load(weights_path) as saved:
+            layers = [(saved[f"weights_{layer}"], saved[f"biases_{layer}"], str(saved[f"activation_{layer}"]))
+                      for layer in range(int(saved["layers"]))]
+        return cls(layers, max_batch)
+
+    def save_npz(self, weights_path: str, fingerprint: str = None):
+        arrays = {"layers": len(self.weights)}
+        if fingerprint is not None:
+            arrays["fingerprint"] = fingerprint
+        for layer, (weights, biases, activation) in enumerate(zip(self.weights, self.biases, self.activation_names)):
+            arrays[f"weights_{layer}"] = weights
+            arrays[f"biases_{layer}"] = biases
+            arrays[f"activation_{layer}"] = activation
+        numpy.savez(weights_path, **arrays)
+
+    # Runs the network on an (n, 23) array and returns the (n, 9) outputs, just like Keras' predict(). The returned array is reused
+    # by the next call, so copy it if it needs to stick around.
+    def predict(self, x: numpy.ndarray):
+        samples = len(x)
+        if samples > self.max_batch:
+            self._allocate(samples)
+        values = numpy.asarray(x, dtype=numpy.float32)
+        for weights, biases, activation, output in zip(self.weights, self.biases, self.activations, self._outputs):
+            output = output[:samples]
+            numpy.dot(values, weights, out=output)
+            output += biases
+            activation(output)
+            values = output
+        return values
+
+
+# Runs a TensorFlow Lite model made by BCQuantize.py, which is how the int8 and float16 versions of the network are run. It has the
+# same predict() as NumpyPolicy so the bot doesn't care which one it's using. The small tflite_runtime package is enough for this,
+# but the one that comes with TensorFlow works too.
+class TFLitePolicy:
+    def __init__(self, model_path: str, threads: int = 1):
+        try:
+            from tflite_runtime.interpreter import Interpreter
+        except ImportError:
+            from tensorflow.lite import Interpreter
+        self.interpreter = Interpreter(model_path=model_path, num_threads=threads)
+        self.interpreter.allocate_tensors()
+        input_details = self.interpreter.get_input_details()[0]
+        output_details = self.interpreter.get_output_details()[0]
+        self._input = input_details["index"]
+        self._output = output_details["index"]
+        self.input_size = int(input_details["shape"][1])
+        self.output_size = int(output_details["shape"][1])
+        self.max_batch = int(input_details["shape"][0])
+
+    def predict(self, x: numpy.ndarray):
+        samples = len(x)
+        if samples != self.max_batch:
+            self.interpreter.resize_tensor_input(self._input, [samples, self.input_size])
+            self.interpreter.allocate_tensors()
+            self.max_batch = samples
+        self.interpreter.set_tensor(self._input, numpy.asarray(x, dtype=numpy.float32))
+        self.interpreter.invoke()
+        return self.interpreter.get_tensor(self._output)
+
+
+# Runs another policy on a background thread, so the bot can hand it a frame and go back to waiting on the emulator while the
+# prediction happens. numpy and TensorFlow Lite both let go of the GIL while they do the math, so this really does overlap with
+# console.step(). Only the latest frame matters: if a new one is submitted before the last one was picked up, the old one is
+# dropped rather than queued up behind it.
+class AsyncPolicy:
+    def __init__(self, policy):
+        self.policy = policy
+        self._input = numpy.empty((1, policy.input_size), dtype=numpy.float32)
+        self._output = numpy.empty((1, policy.output_size), dtype=numpy.float32)
+        self._condition = threading.Condition()
+        self._waiting = False
+        self._submitted = 0
+        self._finished = 0
+        # How many frames were submitted, and how many were replaced by a newer one before the worker got to them.
+        self.submitted = 0
+        self.dropped = 0
+        self._worker = threading.Thread(target=self._run, name="AsyncPolicy", daemon=True)
+        self._worker.start()
+
+    # Hands a (1, 23) frame to the worker thread and returns straight away.
+    def submit(self, x: numpy.ndarray):
+        with self._condition:
+            if self._waiting:
+                self.dropped += 1
+            self._input[:] = x
+            self._waiting = True
+            self._submitted += 1
+            self.submitted += 1
+            self._condition.notify_all()
+
+    # Waits up to timeout seconds for the prediction for the latest submitted frame. Returns None if it isn't done by then. The
+    # returned array gets overwritten once the next frame is finished, so copy it if it needs to stick around.
+    def result(self, timeout: float):
+        with self._condition:
+            if self._condition.wait_for(lambda: self._finished == self._submitted, timeout):
+                return self._output
+        return None
+
+    def _run(self):
+        x = numpy.empty_like(self._input)
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._waiting)
+                x[:] = self._input
+                frame = self._submitted
+                self._waiting = False
+            output = self.policy.predict(x)
+            with self._condition:
+                self._output[:] = output
+                self._finished = frame
+                self._condition.notify_all()
+
+
+# Loads whichever kind of model is at model_path: a .tflite file from BCQuantize.py, or a saved Keras model directory.
+def load_policy(model_path: str, max_batch: int = 1):
+    if model_path.endswith(".tflite"):
+        return TFLitePolicy(model_path)
+    return NumpyPolicy.load(model_path, max_batch)
+
+
+# Checks the numpy version of each saved model against Keras on random inputs, and times a single-sample prediction with each.
+if __name__ == "__main__":
+    import time
+    from tensorflow import keras
+
+    for model_directory in ("saved_symmetric_melee_model", "saved_asymmetric_melee_model"):
+        keras_model = keras.models.load_model(model_directory, compile=False)
+        policy = NumpyPolicy(extract_layers(model_directory))
+        x = numpy.random.default_rng(0).random((1000, policy.input_size), dtype=numpy.float32)
+        difference = numpy.abs(keras_model.predict(x, verbose=0) - NumpyPolicy(extract_layers(model_directory), 1000).predict(x)).max()
+
+        sample = x[:1]
+        start = time.perf_counter()
+        for i in range(100):
+            keras_model.predict(sample, verbose=0)
+        keras_ms = (time.perf_counter() - start) * 1000 / 100
+        start = time.perf_counter()
+        for i in range(10000):
+            policy.predict(sample)
+        numpy_ms = (time.perf_counter() - start) * 1000 / 10000
+        print(f"{model_directory}: largest difference from Keras {difference:.2e}, "
+              f"Keras predict {keras_ms:.3f}ms, numpy {numpy_ms:.4f}ms per frame")
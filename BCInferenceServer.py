@@ -0,0 +1,246 @@
+# Running a lot of BC bots at once used to mean a lot of copies of the model, one in every BCBot.py process, each predicting one
+# frame at a time. This file is a small server that loads the model once and answers for every bot on the machine. Bots send it
+# their feature vectors over a local socket, and it groups whatever requests come in close together into a single batch, so the
+# model runs once for a dozen bots rather than a dozen times. A batch goes out as soon as it's full or the oldest request in it
+# has waited max_wait_ms, whichever comes first, so no bot waits long for its answer.
+#
+# Every request is just the 23 float32 features of one frame, and every reply is the 9 float32 outputs for it, so there's no
+# message framing to speak of. RemotePolicy is the bot's side of this, and has the same predict() as the other policies in
+# BCInference.py, so BCBot.py doesn't care which one it's using (see inference_server in there).
+#
+# Set synthetic_clients to try it out without an emulator: it starts the server plus that many fake bots, each sending random
+# frames at 60 frames per second, and prints how long they had to wait for answers and how big the batches were.
+
+import os
+import time
+import socket
+import selectors
+import multiprocessing
+import numpy
+from FeatureEncoder import X_FEATURES, Y_FEATURES
+from BCInference import NumpyPolicy
+
+model_path = "saved_symmetric_melee_model"
+address = ("127.0.0.1", 50051)
+# The most requests to put in one batch, and the longest the first request in a batch waits for others to join it.
+max_batch = 64
+max_wait_ms = 1.0
+# How many fake bots to test with, and for how long. Leave synthetic_clients at 0 to just run the server.
+synthetic_clients = 0
+synthetic_seconds = 10
+
+REQUEST_BYTES = len(X_FEATURES) * 4
+REPLY_BYTES = len(Y_FEATURES) * 4
+
+
+class InferenceServer:
+    def __init__(self, policy, address: tuple = address, max_batch: int = max_batch, max_wait_ms: float = max_wait_ms):
+        self.policy = policy
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self.listener = socket.create_server(address)
+        self.listener.setblocking(False)
+        self.address = self.listener.getsockname()
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(self.listener, selectors.EVENT_READ)
+        # Bytes that have come in from each client but don't make up a whole request yet.
+        self._partial = {}
+        # Requests waiting to go into a batch, as (client, request bytes), and when the oldest of them arrived.
+        self._pending = []
+        self._oldest = 0.0
+        self._batch = numpy.empty((max_batch, len(X_FEATURES)), dtype=numpy.float32)
+        self._running = False
+        # How many batches and requests have been run, and how many clients are connected.
+        self.batches = 0
+        self.requests = 0
+        self.clients = 0
+
+    def serve_forever(self):
+        self._running = True
+        while self._running:
+            if self._pending:
+                timeout = max(0.0, self._oldest + self.max_wait - time.perf_counter())
+            else:
+                # Wake up now and then even with nothing to do, so that stop() gets noticed.
+                timeout = 0.5
+            for key, events in self.selector.select(timeout):
+                if key.fileobj is self.listener:
+                    self._accept()
+                else:
+                    self._read(key.fileobj)
+            while self._pending and (len(self._pending) >= self.max_batch or
+                                     time.perf_counter() >= self._oldest + self.max_wait):
+                self._run_batch()
+
+    def stop(self):
+        self._running = False
+
+    def close(self):
+        for client in list(self._partial):
+            self._drop(client)
+        self.selector.close()
+        self.listener.close()
+
+    def _accept(self):
+        try:
+            client, client_address = self.listener.accept()
+        except BlockingIOError:
+            return
+        client.setblocking(False)
+        # The replies are tiny, so don't let the operating system hold them back to fill a bigger packet.
+        client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.selector.register(client, selectors.EVENT_READ)
+        self._partial[client] = bytearray()
+        self.clients += 1
+
+    def _drop(self, client: socket.socket):
+        self.selector.unregister(client)
+        client.close()
+        del self._partial[client]
+        self._pending = [(pending_client, request) for pending_client, request in self._pending if pending_client is not client]
+        self.clients -= 1
+
+    def _read(self, client: socket.socket):
+        try:
+            data = client.recv(65536)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            data = b""
+        if not data:
+            self._drop(client)
+            return
+        partial = self._partial[client]
+        partial += data
+        whole = len(partial) - len(partial) % REQUEST_BYTES
+        for start in range(0, whole, REQUEST_BYTES):
+            if not self._pending:
+                self._oldest = time.perf_counter()
+            self._pending.append((client, bytes(partial[start:start + REQUEST_BYTES])))
+        del partial[:whole]
+
+    def _run_batch(self):
+        batch = self._pending[:self.max_batch]
+        del self._pending[:self.max_batch]
+        # Anything left over has been waiting just as long, so it goes out in the next batch straight away.
+        if self._pending:
+            self._oldest = 0.0
+        for row, (client, request) in enumerate(batch):
+            self._batch[row] = numpy.frombuffer(request, dtype=numpy.float32)
+        outputs = self.policy.predict(self._batch[:len(batch)])
+        for row, (client, request) in enumerate(batch):
+            if client not in self._partial:
+                continue
+            try:
+                client.sendall(outputs[row].tobytes())
+            except OSError:
+                self._drop(client)
+        self.batches += 1
+        self.requests += len(batch)
+
+
+# The bot's side of the server. Connects once and then sends one request per frame.
+class RemotePolicy:
+    def __init__(self, address: tuple = address):
+        self.connection = socket.create_connection(address)
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.input_size = len(X_FEATURES)
+        self.output_size = len(Y_FEATURES)
+        self._allocate(1)
+
+    # The reply buffer, big enough for max_batch rows. predict() returns a view of it, just like NumpyPolicy.
+    def _allocate(self, max_batch: int):
+        self.max_batch = max_batch
+        self._reply = bytearray(max_batch * REPLY_BYTES)
+        self._view = memoryview(self._reply)
+        self._outputs = numpy.frombuffer(self._reply, dtype=numpy.float32).reshape(max_batch, self.output_size)
+
+    def predict(self, x: numpy.ndarray):
+        samples = len(x)
+        if samples > self.max_batch:
+            self._allocate(samples)
+        self.connection.sendall(numpy.ascontiguousarray(x, dtype=numpy.float32))
+        expected = samples * REPLY_BYTES
+        received = 0
+        while received < expected:
+            count = self.connection.recv_into(self._view[received:expected])
+            if count == 0:
+                raise ConnectionError("Inference server closed the connection.")
+            received += count
+        return self._outputs[:samples]
+
+    def close(self):
+        self.connection.close()
+
+
+# Random weights in the shape of our symmetric model, so the server can be tested before there's a trained model around.
+def random_layers(seed: int = 0):
+    rng = numpy.random.default_rng(seed)
+    sizes = (len(X_FEATURES), 115, 115, 115, len(Y_FEATURES))
+    return [(rng.normal(0, (2 / inputs) ** 0.5, (inputs, outputs)), numpy.zeros(outputs), "relu")
+            for inputs, outputs in zip(sizes[:-1], sizes[1:])]
+
+
+# A fake bot. Sends a random frame every 1/60th of a second for `seconds` seconds and puts how long each answer took, in
+# milliseconds, on the results queue.
+def synthetic_client(client: int, server_address: tuple, seconds: float, results: multiprocessing.Queue):
+    rng = numpy.random.default_rng(client)
+    frames = rng.random((600, len(X_FEATURES)), dtype=numpy.float32)
+    policy = RemotePolicy(server_address)
+    latencies = []
+    start = time.perf_counter()
+    frame = 0
+    while time.perf_counter() - start < seconds:
+        sent = time.perf_counter()
+        policy.predict(frames[frame % len(frames)][None])
+        latencies.append((time.perf_counter() - sent) * 1000)
+        frame += 1
+        # Wait for the next frame, like a bot waiting on console.step() would.
+        next_frame = start + frame / 60
+        if next_frame > time.perf_counter():
+            time.sleep(next_frame - time.perf_counter())
+    policy.close()
+    results.put(latencies)
+
+
+def load_server_policy():
+    if os.path.isdir(model_path) or os.path.isfile(os.path.normpath(model_path) + ".npz"):
+        return NumpyPolicy.load(model_path, max_batch)
+    print(f"No model at {model_path}, using random weights.")
+    return NumpyPolicy(random_layers(), max_batch)
+
+
+if __name__ == "__main__":
+    if synthetic_clients == 0:
+        server = InferenceServer(load_server_policy(), address, max_batch, max_wait_ms)
+        print(f"Serving {model_path} on {server.address[0]}:{server.address[1]}.")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        server.close()
+        print(f"{server.requests} requests in {server.batches} batches.")
+    else:
+        import threading
+
+        # Port 0 lets the operating system pick a free one.
+        server = InferenceServer(load_server_policy(), (address[0], 0), max_batch, max_wait_ms)
+        server_thread = threading.Thread(target=server.serve_forever, daemon=True)
+        server_thread.start()
+
+        results = multiprocessing.Queue()
+        clients = [multiprocessing.Process(target=synthetic_client, args=(client, server.address, synthetic_seconds, results))
+                   for client in range(synthetic_clients)]
+        for client in clients:
+            client.start()
+        latencies = numpy.concatenate([results.get() for client in clients])
+        for client in clients:
+            client.join()
+        server.stop()
+        server_thread.join()
+        server.close()
+
+        print(f"{synthetic_clients} clients, {len(latencies)} requests in {server.batches} batches "
+              f"({server.requests / max(1, server.batches):.1f} per batch on average).")
+        print(f"Round trip: p50 {numpy.percentile(latencies, 50):.3f}ms, p99 {numpy.percentile(latencies, 99):.3f}ms, "
+              f"max {latencies.max():.3f}ms.")
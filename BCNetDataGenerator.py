@@ -11,169 +11,207 @@
 
 import os
 import sys
+import json
+import multiprocessing
 import melee
 import numpy
 # Thank you, ChatGPT, for this suggestion. I was just asking it how I would multithread this application (spoiler alert, that didn't
 # end up working), but it helpfully suggested this library. Were it not for this, I think I would've killed the process at hour 5.
 from tqdm import tqdm
-
-# This function probably could've been its own file, but it's here, so oh well. This actually formats the data for each frame.
-def store_data(gamestate: melee.GameState, controller_ports: list):
-    # This is the game state data.
-    x = []
-    # This is the first player's controller data.
-    y0 = []
-    # This is the second player's controller data.
-    y1 = []
-
-    # Generate X data
-    # Stage. Notice that we forgot to normalize this value. That ends up getting done in the NN training file instead.
-    x.append(gamestate.stage.value)
-    # P1 XY (this is deprecated but I can't get position to work for some reason)
-    x.append(gamestate.players[controller_ports[0]].x/500)
-    x.append(gamestate.players[controller_ports[0]].y/500)
-    # P2 XY
-    x.append(gamestate.players[controller_ports[1]].x/500)
-    x.append(gamestate.players[controller_ports[1]].y/500)
-    # P1 Percent
-    x.append(gamestate.players[controller_ports[0]].percent/999)
-    # P2 Percent
-    x.append(gamestate.players[controller_ports[1]].percent/999)
-    # P1 Action
-    x.append(gamestate.players[controller_ports[0]].action.value/397)
-    # P2 Action
-    x.append(gamestate.players[controller_ports[1]].action.value/397)
-    # P1 Action Frame
-    x.append(gamestate.players[controller_ports[0]].action_frame/250)
-    # P2 Action Frame
-    x.append(gamestate.players[controller_ports[1]].action_frame/250)
-    # P1 Facing
-    x.append(int(gamestate.players[controller_ports[0]].facing))
-    # P2 Facing
-    x.append(int(gamestate.players[controller_ports[1]].facing))
-    # P1 Jumps
-    x.append(gamestate.players[controller_ports[0]].jumps_left/2)
-    # P2 Jumps
-    x.append(gamestate.players[controller_ports[1]].jumps_left/2)
-    # P1 Inv
-    x.append(int(gamestate.players[controller_ports[0]].invulnerable))
-    # P2 Inv
-    x.append(int(gamestate.players[controller_ports[1]].invulnerable))
-    # P1 Ground
-    x.append(int(gamestate.players[controller_ports[0]].on_ground))
-    # P2 Ground
-    x.append(int(gamestate.players[controller_ports[1]].on_ground))
-    # P1 Off
-    x.append(int(gamestate.players[controller_ports[0]].off_stage))
-    # P2 Off
-    x.append(int(gamestate.players[controller_ports[1]].off_stage))
-    # P1 Shield
-    x.append(round(gamestate.players[controller_ports[0]].shield_strength/60, 1))
-    # P2 Shield
-    x.append(round(gamestate.players[controller_ports[1]].shield_strength/60, 1))
-
-    # Generate Y Data
-    controller_0: melee.PlayerState.controller_state = gamestate.players[controller_ports[0]].controller_state
-    controller_1: melee.PlayerState.controller_state = gamestate.players[controller_ports[1]].controller_state
-    # A button
-    y0.append(int(controller_0.button[melee.Button.BUTTON_A]))
-    y1.append(int(controller_1.button[melee.Button.BUTTON_A]))
-    # B button
-    y0.append(int(controller_0.button[melee.Button.BUTTON_B]))
-    y1.append(int(controller_1.button[melee.Button.BUTTON_B]))
-    # X || Y, since both X and Y can be used to jump.
-    y0.append(int( controller_0.button[melee.Button.BUTTON_X] or controller_0.button[melee.Button.BUTTON_Y] ))
-    y1.append(int( controller_1.button[melee.Button.BUTTON_X] or controller_1.button[melee.Button.BUTTON_Y] ))
-    # L||R || L_SH||R_SH. Both of these can be used to shield, and it seems like we can probably ignore the continuous
-    # nature of the shield button since this rarely comes into play in an actual game. We'll reduce this to a 0/1
-    # binary value.
-    y0.append(int( controller_0.button[melee.Button.BUTTON_L] or controller_0.button[melee.Button.BUTTON_R] or
-                  (controller_0.l_shoulder > 0) or (controller_0.r_shoulder > 0) ))
-    y1.append(int( controller_1.button[melee.Button.BUTTON_L] or controller_1.button[melee.Button.BUTTON_R] or
-                  (controller_1.l_shoulder > 0) or (controller_1.r_shoulder > 0) ))
-    # Z button
-    y0.append(int(controller_0.button[melee.Button.BUTTON_Z]))
-    y1.append(int(controller_1.button[melee.Button.BUTTON_Z]))
-    # Main Stick X value, reduced to ten possible states to simplify things.
-    y0.append(round(controller_0.main_stick[0], 1))
-    y1.append(round(controller_1.main_stick[0], 1))
-    # Main Stick Y value, reduced to ten possible states to simplify things.
-    y0.append(round(controller_0.main_stick[1], 1))
-    y1.append(round(controller_1.main_stick[1], 1))
-    # C stick X value
-    y0.append(round(controller_0.c_stick[0], 1))
-    y1.append(round(controller_1.c_stick[0], 1))
-    # C stick Y value
-    y0.append(round(controller_0.c_stick[1], 1))
-    y1.append(round(controller_1.c_stick[1], 1))
-
-    return x, y0, y1
+from FeatureEncoder import ReplayFeatures
+from ShardedDataset import ShardWriter
+from CompactCodec import encode_x, encode_y
+from ReplayIndex import build_index, select_replays
 
 input_path = "D:\\smashdataset\\smashdataset\\"#
 output_path = "D:\\smashdataset\\parseddata\\"
-# Unimportant for data, but we can't have identically named files. This will ensure unique filenames.
-replay_num = 0
-
-for replay in tqdm(os.listdir(input_path)):
-    # Increment filenum
-    replay_num += 1
-    # There were some corrupt replay files in the set. When the program crashed here at replay 42016, this line let us pick up
-    # right where we left off.
-    if replay_num < 42017: 
-        continue
-    # Load the file in.
-    console = melee.Console(path=input_path+replay, system="file", allow_old_version=True)
-    console.connect()
-
-    gamestate = console.step()
-    # Ensure the game is valid to minimize crashes.
-    if gamestate is None:
-        continue
-    # Ensure the data is valid as well. 1, 3, or 4 player games are meaningless if they're in there.
-    if len(gamestate.players) != 2:
-        continue
-
-    # Since we now know the game data is good, this gets the controller port numbers to read controller state data from.
-    # Players in real games could be connected to any controller port, after all.
-    controller_ports = list(gamestate.players.keys())
-
-    # We knew this was going to take a very long time to run through, so we simplified our methods to read data from only two characters.
-    # Initially, we thought we might train a network on both of these characters, but when it became apparent just how many more games played
-    # Fox than played Jigglypuff, we stuck with just the one.
-    p1 = gamestate.players[controller_ports[0]].character
-    p2 = gamestate.players[controller_ports[1]].character
-    if p1 != melee.Character.FOX and p2 != melee.Character.FOX and p1 != melee.Character.JIGGLYPUFF and p2 != melee.Character.JIGGLYPUFF:
-        continue
-
-    # We have data to assign a filename with, so we do that. Files are named with the format "ID#-P1 character-P2 character-data set.npy"
-    filename = f"{replay_num}-{gamestate.players[controller_ports[0]].character.value}-{gamestate.players[controller_ports[1]].character.value}-"
-    # We thought maybe it would be worth training on only a single stage, but by the time we got to writing the network it became apparent that the more
-    # data we had, the better things would probably turn out. This step ended up being redundant, then.
-    stagename = gamestate.stage.value
-
-    # Arrays in which to store each frame for a given replay.
-    x_set = []
-    y0_set = []
-    y1_set = []
-    
-    while gamestate is not None:
-
-        # Store the data for the current frame.
-        x_data, y0_data, y1_data = store_data(gamestate, controller_ports)
-        # Append to the game set.
-        x_set.append(x_data)
-        y0_set.append(y0_data)
-        y1_set.append(y1_data)
-
-        # Proceed to the next frame.
+# Every replay we finish, skip or fail on gets a line in this file. If the program crashes (and it will, there are corrupt replays
+# in the set), running it again picks up right where it left off instead of us having to hardcode which replay to start from.
+manifest_path = os.path.join(output_path, "manifest.jsonl")
+# How many processes to parse replays with. Parsing is entirely CPU bound, so one per core is what we want. Set this to 1 to parse
+# one replay at a time on the main process like we originally did.
+worker_count = os.cpu_count()
+# Replays that threw an error are normally left alone on a resume, since they'll most likely just fail again. Flip this to give them
+# another shot.
+retry_failed = False
+# "files" writes small .npy files per replay into a folder for each stage, which is what we originally did: x, y0 and y1, plus
+# both players' stock counts for SmashOffline.py (which the network doesn't use). "shards" packs
+# every replay into a few big fixed-size files with an index alongside them (see ShardedDataset.py), which is a lot friendlier to
+# the file system and to training.
+output_format = "files"
+# Store bit-packed flags, tenths and action IDs (see CompactCodec.py) instead of float32 for everything. This cuts the size of the
+# data set on disk by several times, and the training side decodes it back into floats as it reads it in.
+compact_output = False
+# Before parsing anything for real, read just the header of every replay (see ReplayIndex.py) and only parse the 2 player games
+# that have one of wanted_characters in them. The header index is kept in replay_index_path, so this scan only happens once per
+# replay, and corrupt replays get moved out of input_path and into quarantine_path.
+prefilter = True
+replay_index_path = os.path.join(output_path, "replay_index.csv")
+quarantine_path = os.path.join(output_path, "quarantine")
+# We knew this was going to take a very long time to run through, so we simplified our methods to read data from only two characters.
+# Initially, we thought we might train a network on both of these characters, but when it became apparent just how many more games played
+# Fox than played Jigglypuff, we stuck with just the one.
+wanted_characters = (melee.Character.FOX, melee.Character.JIGGLYPUFF)
+
+# The arrays each process writes its replays into. See FeatureEncoder.py for what goes in them.
+replay_features = ReplayFeatures()
+
+# Reads in the manifest, if there is one, and returns a dictionary of replay filename -> the entry that was recorded for it.
+def load_manifest(path: str):
+    manifest = {}
+    if not os.path.isfile(path):
+        return manifest
+    with open(path, "r") as manifest_file:
+        for line in manifest_file:
+            # A crash in the middle of a write can leave a partial line at the end of the file. That replay just gets redone.
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            manifest[entry["replay"]] = entry
+    return manifest
+
+# Parses a single replay. This runs inside the worker processes, so it takes everything it needs as one tuple and hands back a
+# manifest entry rather than touching the manifest itself. In "files" mode the worker saves the arrays itself and hands back None
+# for them. In "shards" mode the arrays get handed back to the main process, which is the only one that writes to the shards.
+def parse_replay(job: tuple):
+    # replay_num is unimportant for data, but we can't have identically named files. This will ensure unique filenames.
+    replay_num, replay = job
+    entry = {"replay": replay, "id": replay_num}
+    try:
+        # Load the file in.
+        console = melee.Console(path=os.path.join(input_path, replay), system="file", allow_old_version=True)
+        console.connect()
+
         gamestate = console.step()
-    
-    # Store the data as a numpy array, which will allow for easy reading later on.
-    x_arr = numpy.array(x_set)
-    y0_arr = numpy.array(y0_set)
-    y1_arr = numpy.array(y1_set)
-    
-    # Save those arrays.
-    numpy.save(f"{output_path}{stagename}\\{filename}x", x_arr)
-    numpy.save(f"{output_path}{stagename}\\{filename}y0", y0_arr)
-    numpy.save(f"{output_path}{stagename}\\{filename}y1", y1_arr)
\ No newline at end of file
+        # Ensure the game is valid to minimize crashes.
+        if gamestate is None:
+            entry.update(status="skipped", reason="no frames")
+            return entry, None
+        # Ensure the data is valid as well. 1, 3, or 4 player games are meaningless if they're in there.
+        if len(gamestate.players) != 2:
+            entry.update(status="skipped", reason=f"{len(gamestate.players)} players")
+            return entry, None
+
+        # Since we now know the game data is good, this gets the controller port numbers to read controller state data from.
+        # Players in real games could be connected to any controller port, after all.
+        controller_ports = list(gamestate.players.keys())
+
+        # Only keep games with one of the characters we care about. The prefilter already checked this, but Zelda and Sheik can
+        # start the game as each other.
+        p1 = gamestate.players[controller_ports[0]].character
+        p2 = gamestate.players[controller_ports[1]].character
+        if p1 not in wanted_characters and p2 not in wanted_characters:
+            entry.update(status="skipped", reason="characters")
+            return entry, None
+
+        # We have data to assign a filename with, so we do that. Files are named with the format "ID#-P1 character-P2 character-data set.npy"
+        filename = f"{replay_num}-{p1.value}-{p2.value}-"
+        # We thought maybe it would be worth training on only a single stage, but by the time we got to writing the network it became apparent that the more
+        # data we had, the better things would probably turn out. This step ended up being redundant, then.
+        stagename = gamestate.stage.value
+
+        # Each worker keeps one set of preallocated arrays and reuses them for every replay it parses.
+        replay_features.clear()
+
+        while gamestate is not None:
+
+            # Write the data for the current frame straight into the arrays. This is the same encoding BCBot.py uses when playing,
+            # stage normalization included.
+            replay_features.append(gamestate, controller_ports)
+
+            # Proceed to the next frame.
+            gamestate = console.step()
+
+        # These are already float32 numpy arrays, so there's nothing left to convert.
+        x_arr, y0_arr, y1_arr = replay_features.arrays()
+        stocks_arr = replay_features.stock_counts()
+        if compact_output:
+            x_arr, y0_arr, y1_arr = encode_x(x_arr), encode_y(y0_arr), encode_y(y1_arr)
+
+        if output_format == "shards":
+            entry.update(status="finished", frames=len(x_arr), p1_character=p1.value, p2_character=p2.value, stage=stagename,
+                         ports=controller_ports)
+            # These are views into the reusable arrays, but that's fine: they get sent off to the main process (or, with a single
+            # worker, written to the shards) before this process starts on its next replay.
+            return entry, (x_arr, y0_arr, y1_arr, stocks_arr)
+
+        # Save those arrays. Several workers can hit a brand new stage at once, hence exist_ok.
+        stage_path = os.path.join(output_path, str(stagename))
+        os.makedirs(stage_path, exist_ok=True)
+        numpy.save(os.path.join(stage_path, f"{filename}x"), x_arr)
+        numpy.save(os.path.join(stage_path, f"{filename}y0"), y0_arr)
+        numpy.save(os.path.join(stage_path, f"{filename}y1"), y1_arr)
+        numpy.save(os.path.join(stage_path, f"{filename}stocks"), stocks_arr)
+
+        entry.update(status="finished", frames=len(x_arr))
+    # There were some corrupt replay files in the set. Those used to take the whole program down with them, now they just get
+    # written off as failed.
+    except Exception as error:
+        entry.update(status="failed", reason=repr(error))
+    return entry, None
+
+# Everything below only runs on the main process. The workers import this file too, and we really don't want each of them starting
+# up their own pool.
+if __name__ == "__main__":
+    os.makedirs(output_path, exist_ok=True)
+    manifest = load_manifest(manifest_path)
+
+    writer = None
+    if output_format == "shards":
+        writer = ShardWriter(output_path, compact=compact_output)
+        # If we crashed between a replay making it into the shards and making it into the manifest, it's still done.
+        for replay in writer.replays:
+            if replay not in manifest:
+                manifest[replay] = {"replay": replay, "status": "finished"}
+
+    # Replay IDs come from the header index when there is one, since corrupt replays get moved out of input_path. Otherwise
+    # they're sorted so that a replay always gets the same ID number, no matter how many times we've had to restart.
+    skipped = []
+    if prefilter:
+        index_rows = build_index(input_path, replay_index_path, quarantine_path)
+        wanted = select_replays(index_rows, wanted_characters)
+        candidates = [(row["replay_id"], row["replay"]) for row in wanted]
+        wanted_replays = set(row["replay"] for row in wanted)
+        for row in index_rows:
+            if row["replay"] not in wanted_replays and row["replay"] not in manifest:
+                skipped.append({"replay": row["replay"], "id": row["replay_id"], "status": "skipped",
+                                "reason": "corrupt" if row["corrupt"] else "prefilter"})
+    else:
+        candidates = enumerate(sorted(os.listdir(input_path)), start=1)
+
+    jobs = []
+    for replay_num, replay in candidates:
+        entry = manifest.get(replay)
+        if entry is None or (retry_failed and entry["status"] == "failed"):
+            jobs.append((replay_num, replay))
+    print(f"{len(manifest)} replays already in the manifest, {len(skipped)} ruled out by the prefilter, {len(jobs)} left to parse.")
+
+    with open(manifest_path, "a") as manifest_file:
+        # Anything the prefilter ruled out goes straight into the manifest without ever being opened.
+        for entry in skipped:
+            manifest_file.write(json.dumps(entry) + "\n")
+        manifest_file.flush()
+
+        if worker_count > 1:
+            # Replays finish in whatever order they finish in, which is fine since each one is independent. Restarting the workers every
+            # so often keeps any memory libmelee holds onto from piling up over tens of thousands of replays.
+            pool = multiprocessing.Pool(worker_count, maxtasksperchild=250)
+            results = pool.imap_unordered(parse_replay, jobs, chunksize=4)
+        else:
+            pool = None
+            results = map(parse_replay, jobs)
+
+        for entry, arrays in tqdm(results, total=len(jobs)):
+            if arrays is not None:
+                writer.add(entry["id"], entry["replay"], entry["p1_character"], entry["p2_character"], entry["stage"], entry["ports"], *arrays)
+            # Flush every line so that a crash never loses track of work that was actually done.
+            manifest_file.write(json.dumps(entry) + "\n")
+            manifest_file.flush()
+
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    if writer is not None:
+        writer.close()
@@ -0,0 +1,137 @@
+# Our bots run on CPU-only machines that also have to run Dolphin, so the cheaper the network is to run the better, as long as it
+# still plays the same. This file converts the saved behavioral cloning models into TensorFlow Lite models in a few different
+# precisions, using post-training quantization:
+#   float32       - a straight conversion, for comparison
+#   float16       - weights stored as float16
+#   dynamic_int8  - weights stored as int8, activations worked out in float
+#   int8          - weights and activations both int8. The activation ranges are calibrated on real frames from the parsed data.
+#
+# Each one is checked against the original float model on frames from the held out test games: how far its outputs drift, and
+# more importantly how often the bot would press a different button or hold the stick somewhere else because of it. Its size on
+# disk and how long a single prediction takes are recorded too. Everything goes into quantization_report.json, and any of the
+# .tflite files can be given to BCBot.py in place of the saved model.
+
+import os
+import json
+import time
+import numpy
+import tensorflow as tf
+from tensorflow import keras
+from BCDataPipeline import find_games, make_blocks, split_blocks, batch_generator
+from BCInference import NumpyPolicy, TFLitePolicy, extract_layers
+
+# Same data set and split as BCNeuralNetwork.py. Calibration frames come from the training games, and the comparison is done on
+# frames from the test games.
+load_directory = "D:\\smashdataset\\parseddata\\"
+test_size = 0.2
+calibration_frames = 2000
+evaluation_frames = 50000
+model_directories = ("saved_symmetric_melee_model", "saved_asymmetric_melee_model")
+variants = ("float32", "float16", "dynamic_int8", "int8")
+# How many single-frame predictions to time each model on.
+latency_samples = 5000
+report_path = "quantization_report.json"
+
+
+# Pulls `frames` random frames out of the given blocks.
+def sample_frames(games: list, blocks: tuple, frames: int, seed: int):
+    collected = []
+    count = 0
+    for x, y in batch_generator(games, blocks, batch_size=1024, seed=seed):
+        collected.append(x)
+        count += len(x)
+        if count >= frames:
+            break
+    return numpy.concatenate(collected)[:frames]
+
+
+# Converts one saved model to TensorFlow Lite in the given precision.
+def convert(model_directory: str, variant: str, calibration: numpy.ndarray):
+    converter = tf.lite.TFLiteConverter.from_saved_model(model_directory)
+    if variant == "float16":
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.target_spec.supported_types = [tf.float16]
+    elif variant == "dynamic_int8":
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    elif variant == "int8":
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        # The converter runs these frames through the network to find the range of values each layer puts out.
+        converter.representative_dataset = lambda: ([calibration[i:i + 1]] for i in range(len(calibration)))
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+    return converter.convert()
+
+
+# The button BCBot.py would press for each frame: whichever of the first five outputs is highest, or none if none are above 0.
+def chosen_buttons(outputs: numpy.ndarray):
+    buttons = outputs[:, :5]
+    return numpy.where(buttons.max(axis=1) > 0, buttons.argmax(axis=1), -1)
+
+
+# The main stick position BCBot.py would send for each frame, rounded to the nearest tenth.
+def chosen_sticks(outputs: numpy.ndarray):
+    return numpy.round(outputs[:, 5:7], 1)
+
+
+# How different a model's outputs are from the original model's, both in raw numbers and in what the bot would actually do.
+def compare(reference: numpy.ndarray, outputs: numpy.ndarray):
+    same_button = chosen_buttons(reference) == chosen_buttons(outputs)
+    same_stick = (chosen_sticks(reference) == chosen_sticks(outputs)).all(axis=1)
+    return {
+        "mean_abs_error": float(numpy.abs(reference - outputs).mean()),
+        "max_abs_error": float(numpy.abs(reference - outputs).max()),
+        "same_button": float(same_button.mean()),
+        "same_stick": float(same_stick.mean()),
+        "same_move": float((same_button & same_stick).mean()),
+    }
+
+
+# Times single-frame predictions, the way the bot makes them. Returns the mean and 99th percentile in milliseconds.
+def time_policy(policy, frames: numpy.ndarray):
+    times = numpy.empty(latency_samples)
+    for sample in range(latency_samples):
+        frame = frames[sample % len(frames)][None]
+        start = time.perf_counter()
+        policy.predict(frame)
+        times[sample] = time.perf_counter() - start
+    return float(times.mean() * 1000), float(numpy.percentile(times, 99) * 1000)
+
+
+if __name__ == "__main__":
+    games = find_games(load_directory)
+    train_blocks, test_blocks = split_blocks(games, make_blocks(games), test_size, seed=20)
+    calibration = sample_frames(games, train_blocks, calibration_frames, seed=1)
+    evaluation = sample_frames(games, test_blocks, evaluation_frames, seed=2)
+
+    report = {}
+    for model_directory in model_directories:
+        keras_model = keras.models.load_model(model_directory, compile=False)
+        reference = keras_model.predict(evaluation, batch_size=4096, verbose=0)
+
+        # The numpy version BCBot.py uses by default, as the baseline to beat.
+        numpy_policy = NumpyPolicy(extract_layers(model_directory), len(evaluation))
+        outputs = numpy_policy.predict(evaluation).copy()
+        mean_ms, p99_ms = time_policy(numpy_policy, evaluation)
+        weight_bytes = sum(weights.nbytes + biases.nbytes for weights, biases in zip(numpy_policy.weights, numpy_policy.biases))
+        results = {"numpy_float32": dict(compare(reference, outputs), size_bytes=weight_bytes, mean_ms=mean_ms, p99_ms=p99_ms)}
+
+        for variant in variants:
+            model_path = f"{os.path.normpath(model_directory)}_{variant}.tflite"
+            with open(model_path, "wb") as model_file:
+                model_file.write(convert(model_directory, variant, calibration))
+
+            policy = TFLitePolicy(model_path)
+            outputs = numpy.concatenate([policy.predict(evaluation[start:start + 4096]).copy()
+                                         for start in range(0, len(evaluation), 4096)])
+            mean_ms, p99_ms = time_policy(policy, evaluation)
+            results[variant] = dict(compare(reference, outputs), size_bytes=os.path.getsize(model_path), mean_ms=mean_ms,
+                                    p99_ms=p99_ms, path=model_path)
+
+        report[model_directory] = results
+        print(model_directory)
+        for variant, result in results.items():
+            print(f"  {variant:>14}: same move {100 * result['same_move']:.2f}%, mean error {result['mean_abs_error']:.5f}, "
+                  f"{result['size_bytes'] / 1024:.1f}KB, {result['mean_ms']:.4f}ms mean / {result['p99_ms']:.4f}ms p99")
+
+    with open(report_path, "w") as report_file:
+        json.dump(report, report_file, indent=4)
+    print(f"Report written to {report_path}.")
@@ -0,0 +1,132 @@
+# We never had the time to properly try out different layer sizes, activations, batch sizes or learning rates for the behavioral
+# cloning network. This file trains a list of model configurations side by side, each in its own worker process, and ranks them by
+# how well they do on the held out test games.
+#
+# Every worker memory maps the same parsed data set. Memory mapped files are backed by the operating system's file cache, so the
+# data only ever sits in RAM once no matter how many workers are reading it, and each worker only adds its own small shuffle
+# buffer on top of that.
+#
+# The results go into a leaderboard (CSV and JSON) in sweep_directory, every configuration's model is saved in there too, and the
+# best one gets copied to best_model_directory.
+
+import os
+import csv
+import json
+import time
+import shutil
+import multiprocessing
+
+# The same data set and split that BCNeuralNetwork.py trains on.
+load_directory = "D:\\smashdataset\\parseddata\\"
+test_size = 0.2
+block_frames = 1024
+# Each worker gets a smaller shuffle buffer than a single training run would, since there are several of them.
+buffer_blocks = 16
+# Each configuration is trained for this many epochs. Set steps_per_epoch to only train on part of the data each epoch, which is
+# handy for a quick first pass over a lot of configurations.
+epochs = 5
+steps_per_epoch = None
+# How many configurations to train at once. The CPU cores are split evenly between them.
+concurrent_workers = 4
+sweep_directory = "bc_sweep"
+best_model_directory = "saved_sweep_best_model"
+
+# The configurations to try. Anything left out uses the default from build_model() in BCNeuralNetwork.py.
+configurations = [
+    {"name": "symmetric", "hidden_layers": (115, 115, 115), "output_activation": "relu", "batch_size": 512},
+    {"name": "asymmetric", "hidden_layers": (230, 115), "output_activation": "sigmoid", "batch_size": 512},
+    {"name": "symmetric_sigmoid", "hidden_layers": (115, 115, 115), "output_activation": "sigmoid", "batch_size": 512},
+    {"name": "symmetric_batch_2048", "hidden_layers": (115, 115, 115), "batch_size": 2048, "learning_rate": 0.002},
+    {"name": "asymmetric_batch_2048", "hidden_layers": (230, 115), "output_activation": "sigmoid", "batch_size": 2048,
+     "learning_rate": 0.002},
+    {"name": "symmetric_low_lr", "hidden_layers": (115, 115, 115), "batch_size": 512, "learning_rate": 0.0003},
+    {"name": "wide", "hidden_layers": (256, 256), "output_activation": "sigmoid", "batch_size": 1024},
+    {"name": "deep_tanh", "hidden_layers": (115, 115, 115, 115), "activation": "tanh", "output_activation": "sigmoid",
+     "batch_size": 512},
+]
+
+# The options that go to build_model(), as opposed to the ones that control training.
+_MODEL_OPTIONS = ("hidden_layers", "activation", "output_activation", "learning_rate")
+
+
+# Runs once in each worker before it starts training anything. TensorFlow would otherwise give every worker every core, and
+# they'd spend all their time fighting over them.
+def _start_worker(threads: int):
+    import tensorflow as tf
+    tf.config.threading.set_intra_op_parallelism_threads(threads)
+    tf.config.threading.set_inter_op_parallelism_threads(2)
+
+
+# Trains and evaluates one configuration, saves its model, and returns its results. Runs inside a worker process.
+def run_configuration(configuration: dict):
+    from BCNeuralNetwork import build_model
+    from BCDataPipeline import find_games, make_blocks, split_blocks, make_dataset
+
+    name = configuration["name"]
+    batch_size = configuration.get("batch_size", 512)
+    games = find_games(load_directory)
+    blocks = make_blocks(games, block_frames)
+    train_blocks, test_blocks = split_blocks(games, blocks, test_size, seed=20)
+    train_dataset = make_dataset(games, train_blocks, batch_size, block_frames, buffer_blocks, reader_threads=2, seed=20)
+    test_dataset = make_dataset(games, test_blocks, batch_size, block_frames, buffer_blocks, shuffle=False, reader_threads=2)
+    if steps_per_epoch is not None:
+        train_dataset = train_dataset.repeat()
+
+    bc_model = build_model(**{option: configuration[option] for option in _MODEL_OPTIONS if option in configuration})
+    start = time.perf_counter()
+    history = bc_model.fit(train_dataset, epochs=epochs, steps_per_epoch=steps_per_epoch, verbose=0)
+    train_seconds = time.perf_counter() - start
+    test_loss, test_accuracy = bc_model.evaluate(test_dataset, verbose=0)
+
+    model_directory = os.path.join(sweep_directory, name)
+    bc_model.save(model_directory)
+    return {
+        "name": name,
+        "test_loss": float(test_loss),
+        "test_accuracy": float(test_accuracy),
+        "train_loss": float(history.history["loss"][-1]),
+        "train_accuracy": float(history.history["accuracy"][-1]),
+        "train_seconds": train_seconds,
+        "parameters": int(bc_model.count_params()),
+        "model_directory": model_directory,
+        "configuration": configuration,
+    }
+
+
+# Writes the leaderboard, best (lowest test loss) first.
+def write_leaderboard(results: list):
+    results = sorted(results, key=lambda result: result["test_loss"])
+    with open(os.path.join(sweep_directory, "leaderboard.json"), "w") as leaderboard_file:
+        json.dump(results, leaderboard_file, indent=4)
+    columns = ("rank", "name", "test_loss", "test_accuracy", "train_loss", "train_accuracy", "train_seconds", "parameters",
+               "model_directory")
+    with open(os.path.join(sweep_directory, "leaderboard.csv"), "w", newline="") as leaderboard_file:
+        leaderboard = csv.DictWriter(leaderboard_file, fieldnames=columns, extrasaction="ignore")
+        leaderboard.writeheader()
+        for rank, result in enumerate(results, start=1):
+            leaderboard.writerow(dict(result, rank=rank))
+    return results
+
+
+if __name__ == "__main__":
+    os.makedirs(sweep_directory, exist_ok=True)
+    threads = max(1, (os.cpu_count() or 1) // concurrent_workers)
+
+    # "spawn" gives every worker a clean TensorFlow, and a fresh worker for every configuration means memory from one model
+    # can't build up and crowd out the next.
+    context = multiprocessing.get_context("spawn")
+    results = []
+    with context.Pool(concurrent_workers, initializer=_start_worker, initargs=(threads,), maxtasksperchild=1) as pool:
+        for result in pool.imap_unordered(run_configuration, configurations):
+            print(f"{result['name']}: test loss {result['test_loss']:.5f}, test accuracy {result['test_accuracy']:.4f}, "
+                  f"{result['train_seconds']:.0f}s")
+            results.append(result)
+            # Keep the leaderboard up to date as results come in, in case the sweep doesn't get to finish.
+            write_leaderboard(results)
+
+    results = write_leaderboard(results)
+    best = results[0]
+    if os.path.isdir(best_model_directory):
+        shutil.rmtree(best_model_directory)
+    shutil.copytree(best["model_directory"], best_model_directory)
+    print(f"Best configuration was {best['name']}, copied to {best_model_directory}.")
@@ -0,0 +1,108 @@
+# Runs each of the loops that normally need Dolphin against a recording from FakeConsole.py instead, as fast as they'll go, and
+# prints how many frames a second each one manages. Anything well over 60 is keeping up with the game; this is the number to
+# watch when changing any of them.
+#
+# Make a recording first, either from a replay with record_replay() in FakeConsole.py, or by swapping a RecordingConsole in for
+# the console in one of the bots and calling save() when done. The scripts are run exactly as they are, with melee.Console and
+# melee.Controller swapped for the fakes while they run. BCBot.py needs its model to load (see BCInference.py), and MeleeBot.py
+# needs psutil; if either can't start, it's skipped and the reason printed.
+
+import os
+import time
+import runpy
+import random
+import melee
+from FakeConsole import FakeConsole, FakeController, RecordingFinished, load_gamestates, record_replay
+
+# The recording to play back. If it doesn't exist yet and replay_path does, it gets recorded from that replay.
+recording_path = "benchmark_recording.npz"
+replay_path = "benchmark_replay.slp"
+# Which loops to run.
+benchmarks = ("generator", "bcbot", "meleebot", "gym")
+# How many times to go through the recording for each one. More gives steadier numbers.
+passes = 5
+# The gym has no end to its loop, so it just takes this many steps.
+gym_steps = 20000
+
+
+# Runs one of the bot scripts until it's played the recording `passes` times. Returns (frames, seconds).
+def run_script(path: str, gamestates: list):
+    console = FakeConsole(None, at_end="raise", gamestates=gamestates * passes)
+    real_console, real_controller = melee.Console, melee.Controller
+    melee.Console = lambda *args, **kwargs: console
+    melee.Controller = FakeController
+    # BCBot.py builds its Dolphin path from this.
+    os.environ.setdefault("USERNAME", "benchmark")
+    start = time.perf_counter()
+    try:
+        runpy.run_path(path, run_name="__main__")
+    except RecordingFinished:
+        pass
+    finally:
+        melee.Console, melee.Controller = real_console, real_controller
+    return console.frames, time.perf_counter() - start
+
+
+# Parses the recording with BCNetDataGenerator.py's parse_replay, the same as a worker would parse a replay.
+def run_generator(gamestates: list):
+    import BCNetDataGenerator
+    # Shards mode hands the arrays back rather than writing them.
+    BCNetDataGenerator.output_format = "shards"
+    real_console = melee.Console
+    frames = 0
+    start = time.perf_counter()
+    try:
+        for replay_num in range(passes):
+            console = FakeConsole(None, gamestates=gamestates)
+            melee.Console = lambda *args, **kwargs: console
+            entry, arrays = BCNetDataGenerator.parse_replay((replay_num, "benchmark.slp"))
+            if entry["status"] != "finished":
+                raise RuntimeError(f"parse_replay {entry['status']}: {entry.get('reason')}")
+            frames += console.frames
+    finally:
+        melee.Console = real_console
+    return frames, time.perf_counter() - start
+
+
+# Takes random steps in CustomGame. The time spent in reset() (including the sleeps for Dolphin) isn't counted.
+def run_gym(gamestates: list):
+    from SmashGym import CustomGame
+    real_controller = melee.Controller
+    melee.Controller = FakeController
+    try:
+        game = CustomGame(console_factory=lambda slippi_port: FakeConsole(None, at_end="loop", gamestates=gamestates))
+        game.reset()
+        start = time.perf_counter()
+        for _ in range(gym_steps):
+            observation, reward, terminated, truncated, info = game.step(random.randrange(game.action_space.n))
+            if terminated or truncated:
+                game.reset()
+        frames = game.console.frames
+        seconds = time.perf_counter() - start
+        game.close()
+    finally:
+        melee.Controller = real_controller
+    return frames, seconds
+
+
+if __name__ == "__main__":
+    if not os.path.isfile(recording_path):
+        print(f"Recording {replay_path} into {recording_path}...")
+        record_replay(replay_path, recording_path)
+    gamestates = load_gamestates(recording_path)
+    print(f"{len(gamestates)} frames in {recording_path}.")
+
+    runners = {
+        "generator": lambda: run_generator(gamestates),
+        "bcbot": lambda: run_script("BCBot.py", gamestates),
+        "meleebot": lambda: run_script("MeleeBot.py", gamestates),
+        "gym": lambda: run_gym(gamestates),
+    }
+    for name in benchmarks:
+        try:
+            frames, seconds = runners[name]()
+        except Exception as error:
+            print(f"{name:>10}: skipped ({error!r})")
+            continue
+        print(f"{name:>10}: {frames:8d} frames in {seconds:7.2f}s, {frames / seconds:10.0f} frames/s, "
+              f"{1e6 * seconds / frames:8.1f}us/frame")
@@ -0,0 +1,148 @@
+# Our parsed data set ended up being over 100GB, mostly because every value was stored as a float64 even though most of them are
+# really just booleans, small whole numbers, or numbers that were already rounded to the nearest tenth. This file converts the
+# float arrays from FeatureEncoder.py into a compact record format and back again.
+#
+# Each frame of X data becomes one 34 byte record instead of 23 floats (184 bytes as float64, 92 as float32):
+#   stage           uint8       the stage ID
+#   position        4x float32  P1 X, P1 Y, P2 X, P2 Y, left as they were
+#   percent         2x uint16   percent in tenths of a percent
+#   action          2x uint16   the action ID
+#   action_frame    2x int16    the frame of the action
+#   jumps           2x uint8    jumps left
+#   flags           uint8       facing, invulnerable, on ground and off stage for both players, one bit each
+#   shield          2x uint8    shield strength in tenths, which is how it was rounded in the first place
+#
+# Each frame of Y data becomes 5 bytes instead of 9 floats:
+#   buttons         uint8       A, B, jump, shield and Z, one bit each
+#   sticks          4x int8     main stick X/Y and C stick X/Y in tenths
+#
+# Everything but percent comes back out exactly as it went in. Data sets written when the stage was kept as a float16 still
+# decode, but the stage comes out of those slightly off, and new replays can't be added to them (see ShardedDataset.py).
+
+import numpy
+from FeatureEncoder import (X_FEATURES, Y_FEATURES, STAGE_SCALE, PERCENT_SCALE, ACTION_SCALE, ACTION_FRAME_SCALE, JUMPS_SCALE)
+
+X_DTYPE = numpy.dtype([
+    ("stage", numpy.uint8),
+    ("position", numpy.float32, (4,)),
+    ("percent", numpy.uint16, (2,)),
+    ("action", numpy.uint16, (2,)),
+    ("action_frame", numpy.int16, (2,)),
+    ("jumps", numpy.uint8, (2,)),
+    ("flags", numpy.uint8),
+    ("shield", numpy.uint8, (2,)),
+])
+
+Y_DTYPE = numpy.dtype([
+    ("buttons", numpy.uint8),
+    ("sticks", numpy.int8, (4,)),
+])
+
+# Where each group of values lives in the float arrays.
+_STAGE = X_FEATURES.index("stage")
+_POSITION = [X_FEATURES.index(name) for name in ("p1_x", "p1_y", "p2_x", "p2_y")]
+_PERCENT = [X_FEATURES.index("p1_percent"), X_FEATURES.index("p2_percent")]
+_ACTION = [X_FEATURES.index("p1_action"), X_FEATURES.index("p2_action")]
+_ACTION_FRAME = [X_FEATURES.index("p1_action_frame"), X_FEATURES.index("p2_action_frame")]
+_JUMPS = [X_FEATURES.index("p1_jumps"), X_FEATURES.index("p2_jumps")]
+_SHIELD = [X_FEATURES.index("p1_shield"), X_FEATURES.index("p2_shield")]
+# Bit 0 of the flags byte is the first column here, bit 1 the second, and so on.
+_FLAGS = [X_FEATURES.index(name) for name in ("p1_facing", "p1_invulnerable", "p1_on_ground", "p1_off_stage",
+                                               "p2_facing", "p2_invulnerable", "p2_on_ground", "p2_off_stage")]
+_BUTTONS = [Y_FEATURES.index(name) for name in ("a", "b", "jump", "shield", "z")]
+_STICKS = [Y_FEATURES.index(name) for name in ("main_x", "main_y", "c_x", "c_y")]
+
+# Percent, shield and the sticks are all stored in tenths.
+_PERCENT_STEPS = PERCENT_SCALE * 10
+_TENTHS = 10
+
+
+# Packs a few 0/1 columns into the bits of a single uint8 column.
+def _pack_bits(columns: numpy.ndarray):
+    packed = numpy.zeros(len(columns), dtype=numpy.uint8)
+    for bit in range(columns.shape[1]):
+        packed |= (columns[:, bit] > 0.5).astype(numpy.uint8) << bit
+    return packed
+
+
+# Unpacks a uint8 column back into `out`, one 0/1 float column per bit.
+def _unpack_bits(packed: numpy.ndarray, out: numpy.ndarray, columns: list):
+    for bit, column in enumerate(columns):
+        out[:, column] = (packed >> bit) & 1
+
+
+# Turns an (n, 23) array of X data into n compact records.
+def encode_x(x: numpy.ndarray):
+    encoded = numpy.empty(len(x), dtype=X_DTYPE)
+    encoded["stage"] = numpy.rint(x[:, _STAGE] * STAGE_SCALE)
+    encoded["position"] = x[:, _POSITION]
+    encoded["percent"] = numpy.rint(x[:, _PERCENT] * _PERCENT_STEPS)
+    encoded["action"] = numpy.rint(x[:, _ACTION] * ACTION_SCALE)
+    encoded["action_frame"] = numpy.rint(x[:, _ACTION_FRAME] * ACTION_FRAME_SCALE)
+    encoded["jumps"] = numpy.rint(x[:, _JUMPS] * JUMPS_SCALE)
+    encoded["flags"] = _pack_bits(x[:, _FLAGS])
+    encoded["shield"] = numpy.rint(x[:, _SHIELD] * _TENTHS)
+    return encoded
+
+
+# Turns an (n, 9) array of Y data into n compact records.
+def encode_y(y: numpy.ndarray):
+    encoded = numpy.empty(len(y), dtype=Y_DTYPE)
+    encoded["buttons"] = _pack_bits(y[:, _BUTTONS])
+    encoded["sticks"] = numpy.rint(y[:, _STICKS] * _TENTHS)
+    return encoded
+
+
+# Turns compact X records back into an (n, 23) float32 array, the same thing encode_x was given. Pass in `out` to decode straight
+# into an existing array, like a training batch, rather than allocating a new one.
+def decode_x(encoded: numpy.ndarray, out: numpy.ndarray = None):
+    if out is None:
+        out = numpy.empty((len(encoded), len(X_FEATURES)), dtype=numpy.float32)
+    if encoded.dtype["stage"].kind == "f":
+        out[:, _STAGE] = encoded["stage"]
+    else:
+        out[:, _STAGE] = encoded["stage"] / STAGE_SCALE
+    out[:, _POSITION] = encoded["position"]
+    # These (and the stage) are divided in float64 and then rounded to float32, which is exactly what happened to them in the first place.
+    out[:, _PERCENT] = encoded["percent"] / _PERCENT_STEPS
+    out[:, _ACTION] = encoded["action"] / ACTION_SCALE
+    out[:, _ACTION_FRAME] = encoded["action_frame"] / ACTION_FRAME_SCALE
+    out[:, _JUMPS] = encoded["jumps"] / JUMPS_SCALE
+    _unpack_bits(encoded["flags"], out, _FLAGS)
+    out[:, _SHIELD] = encoded["shield"] / _TENTHS
+    return out
+
+
+# Turns compact Y records back into an (n, 9) float32 array.
+def decode_y(encoded: numpy.ndarray, out: numpy.ndarray = None):
+    if out is None:
+        out = numpy.empty((len(encoded), len(Y_FEATURES)), dtype=numpy.float32)
+    _unpack_bits(encoded["buttons"], out, _BUTTONS)
+    out[:, _STICKS] = encoded["sticks"] / _TENTHS
+    return out
+
+
+# Whether an array came out of encode_x or encode_y, as opposed to being plain floats.
+def is_compact(array: numpy.ndarray):
+    return array.dtype.names is not None
+
+
+# Gives back float32 X data no matter which format `x` is stored in. Plain float arrays (including the old float64 ones) are
+# just converted, without a copy if they're already float32.
+def as_x_features(x: numpy.ndarray, out: numpy.ndarray = None):
+    if is_compact(x):
+        return decode_x(x, out)
+    if out is None:
+        return x.astype(numpy.float32, copy=False)
+    out[...] = x
+    return out
+
+
+# Same as as_x_features, for Y data.
+def as_y_features(y: numpy.ndarray, out: numpy.ndarray = None):
+    if is_compact(y):
+        return decode_y(y, out)
+    if out is None:
+        return y.astype(numpy.float32, copy=False)
+    out[...] = y
+    return out
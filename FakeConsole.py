@@ -0,0 +1,309 @@
+# Everything in this project that plays or parses the game (BCBot.py, MeleeBot.py, SmashGym.py, BCNetDataGenerator.py) needs a real
+# melee.Console, which means Dolphin, which means we could never profile or test any of it on a machine without a screen. This
+# file records the gamestates from a live session or a .slp replay into a small file, and FakeConsole plays them back through
+# the same step() as a real console, as fast as the code asking for them can go. FakeController stands in for melee.Controller
+# and just counts what it's told to do.
+#
+# The recording only keeps what our code actually reads from a gamestate: the menu, stage and frame, and for every player their
+# character, position, percent, stocks, action, the various flags, their controller state, and their cursor on the menus. It's
+# stored as numpy structured arrays in a compressed .npz file.
+#
+# The gamestates that come back out are lightweight stand-ins with the same attributes as libmelee's, built ahead of time so that
+# step() costs next to nothing. See BenchmarkLoops.py for running each of our loops against a recording.
+
+import numpy
+import melee
+
+# Every button that's either pressed or not. The sticks and shoulders are analog and get stored separately.
+_DIGITAL_BUTTONS = [button for button in melee.Button if button not in (melee.Button.BUTTON_MAIN, melee.Button.BUTTON_C)]
+# Ports that can have a player in them.
+PORTS = (1, 2, 3, 4)
+
+FRAME_DTYPE = numpy.dtype([
+    ("menu_state", numpy.int16),
+    ("stage", numpy.int16),
+    ("frame", numpy.int32),
+    ("distance", numpy.float32),
+])
+
+PLAYER_DTYPE = numpy.dtype([
+    ("present", numpy.bool_),
+    ("character", numpy.int16),
+    ("costume", numpy.uint8),
+    ("x", numpy.float32),
+    ("y", numpy.float32),
+    ("percent", numpy.float32),
+    ("stock", numpy.uint8),
+    ("action", numpy.int16),
+    ("action_frame", numpy.int16),
+    ("facing", numpy.bool_),
+    ("jumps_left", numpy.uint8),
+    ("invulnerable", numpy.bool_),
+    ("on_ground", numpy.bool_),
+    ("off_stage", numpy.bool_),
+    ("shield_strength", numpy.float32),
+    ("cursor_x", numpy.float32),
+    ("cursor_y", numpy.float32),
+    ("coin_down", numpy.bool_),
+    # One bit per button in _DIGITAL_BUTTONS.
+    ("buttons", numpy.uint16),
+    ("main_stick", numpy.float32, (2,)),
+    ("c_stick", numpy.float32, (2,)),
+    ("l_shoulder", numpy.float32),
+    ("r_shoulder", numpy.float32),
+])
+
+
+# Raised by FakeConsole.step() at the end of a recording when it's set to stop the loop that's running it.
+class RecordingFinished(Exception):
+    pass
+
+
+# Collects gamestates into structured arrays that double in size as they fill up, like ReplayFeatures in FeatureEncoder.py.
+class GameStateRecorder:
+    def __init__(self, capacity: int = 16384):
+        self.frames = numpy.zeros(capacity, dtype=FRAME_DTYPE)
+        self.players = numpy.zeros((capacity, len(PORTS)), dtype=PLAYER_DTYPE)
+        self.count = 0
+
+    def _grow(self):
+        frames = numpy.zeros(2 * len(self.frames), dtype=FRAME_DTYPE)
+        players = numpy.zeros((2 * len(self.frames), len(PORTS)), dtype=PLAYER_DTYPE)
+        frames[:self.count] = self.frames[:self.count]
+        players[:self.count] = self.players[:self.count]
+        self.frames, self.players = frames, players
+
+    def add(self, gamestate: melee.GameState):
+        if self.count == len(self.frames):
+            self._grow()
+        row = self.count
+        self.frames[row] = (
+            gamestate.menu_state.value,
+            gamestate.stage.value if gamestate.stage is not None else -1,
+            gamestate.frame,
+            getattr(gamestate, "distance", 0.0),
+        )
+        for column, port in enumerate(PORTS):
+            player = gamestate.players.get(port)
+            if player is None:
+                continue
+            controller = player.controller_state
+            # Positions use .x/.y like the rest of the project, but newer versions of libmelee only have .position.
+            position = getattr(player, "position", player)
+            buttons = 0
+            for bit, button in enumerate(_DIGITAL_BUTTONS):
+                if controller.button.get(button, False):
+                    buttons |= 1 << bit
+            self.players[row, column] = (
+                True, player.character.value, player.costume, position.x, position.y, player.percent, player.stock,
+                player.action.value, player.action_frame, player.facing, player.jumps_left, player.invulnerable,
+                player.on_ground, player.off_stage, player.shield_strength, player.cursor_x, player.cursor_y,
+                player.coin_down, buttons, controller.main_stick, controller.c_stick, controller.l_shoulder,
+                controller.r_shoulder,
+            )
+        self.count += 1
+
+    def save(self, path: str):
+        numpy.savez_compressed(path, frames=self.frames[:self.count], players=self.players[:self.count])
+
+
+# Wraps a real console and records every gamestate it hands out. Use it in place of the console in any of our loops, then call
+# save() at the end.
+class RecordingConsole:
+    def __init__(self, console: melee.Console):
+        self.console = console
+        self.recorder = GameStateRecorder()
+
+    def step(self):
+        gamestate = self.console.step()
+        if gamestate is not None:
+            self.recorder.add(gamestate)
+        return gamestate
+
+    def save(self, path: str):
+        self.recorder.save(path)
+
+    # Everything else goes straight to the real console.
+    def __getattr__(self, name: str):
+        return getattr(self.console, name)
+
+
+# Records every frame of a .slp replay.
+def record_replay(replay_path: str, output_path: str):
+    console = melee.Console(path=replay_path, system="file", allow_old_version=True)
+    console.connect()
+    recorder = GameStateRecorder()
+    gamestate = console.step()
+    while gamestate is not None:
+        recorder.add(gamestate)
+        gamestate = console.step()
+    recorder.save(output_path)
+    return recorder.count
+
+
+# Stand-ins for libmelee's gamestate classes, with the attributes our code reads.
+class FakeControllerState:
+    __slots__ = ("button", "main_stick", "c_stick", "l_shoulder", "r_shoulder")
+
+
+class FakePlayerState:
+    __slots__ = ("character", "costume", "x", "y", "position", "percent", "stock", "action", "action_frame", "facing",
+                 "jumps_left", "invulnerable", "on_ground", "off_stage", "shield_strength", "cursor_x", "cursor_y", "cursor",
+                 "coin_down", "controller_state")
+
+
+class FakeGameState:
+    __slots__ = ("menu_state", "stage", "frame", "distance", "players")
+
+
+class _Position:
+    __slots__ = ("x", "y")
+
+    def __init__(self, x: float, y: float):
+        self.x = x
+        self.y = y
+
+
+# Loads a recording and turns it back into gamestates.
+def load_gamestates(path: str):
+    with numpy.load(path) as recording:
+        return gamestates_from_arrays(recording["frames"], recording["players"])
+
+
+# Made-up gamestates for when there's no recording handy: two players, Fox against Jigglypuff on Battlefield, with everything else
+# random but in the ranges the real game uses. The same seed always gives the same frames.
+def synthetic_gamestates(count: int, seed: int = 0):
+    random = numpy.random.default_rng(seed)
+    frames = numpy.zeros(count, dtype=FRAME_DTYPE)
+    frames["menu_state"] = melee.Menu.IN_GAME.value
+    frames["stage"] = melee.Stage.BATTLEFIELD.value
+    frames["frame"] = numpy.arange(count)
+    frames["distance"] = random.uniform(0, 100, count)
+    players = numpy.zeros((count, len(PORTS)), dtype=PLAYER_DTYPE)
+    actions = numpy.array([action.value for action in melee.Action if action.value < 0x17F])
+    for column, character in ((0, melee.Character.FOX), (1, melee.Character.JIGGLYPUFF)):
+        player = players[:, column]
+        player["present"] = True
+        player["character"] = character.value
+        player["x"] = random.uniform(-80, 80, count)
+        player["y"] = random.uniform(-20, 60, count)
+        player["percent"] = random.integers(0, 150, count)
+        player["stock"] = random.integers(1, 5, count)
+        player["action"] = random.choice(actions, count)
+        player["action_frame"] = random.integers(0, 60, count)
+        player["facing"] = random.random(count) < 0.5
+        player["jumps_left"] = random.integers(0, 3, count)
+        player["on_ground"] = random.random(count) < 0.7
+        player["off_stage"] = random.random(count) < 0.1
+        player["shield_strength"] = 60
+        player["buttons"] = random.integers(0, 1 << len(_DIGITAL_BUTTONS), count)
+        player["main_stick"] = random.random((count, 2))
+        player["c_stick"] = 0.5
+    return gamestates_from_arrays(frames, players)
+
+
+# Turns recorded arrays back into gamestates.
+def gamestates_from_arrays(frames: numpy.ndarray, players: numpy.ndarray):
+    gamestates = []
+    for frame, frame_players in zip(frames.tolist(), players.tolist()):
+        menu_state, stage, frame_number, distance = frame
+        gamestate = FakeGameState()
+        gamestate.menu_state = melee.Menu(menu_state)
+        gamestate.stage = melee.Stage(stage) if stage >= 0 else None
+        gamestate.frame = frame_number
+        gamestate.distance = distance
+        gamestate.players = {}
+        for port, player in zip(PORTS, frame_players):
+            (present, character, costume, x, y, percent, stock, action, action_frame, facing, jumps_left, invulnerable,
+             on_ground, off_stage, shield_strength, cursor_x, cursor_y, coin_down, buttons, main_stick, c_stick, l_shoulder,
+             r_shoulder) = player
+            if not present:
+                continue
+            controller = FakeControllerState()
+            controller.button = {button: bool(buttons >> bit & 1) for bit, button in enumerate(_DIGITAL_BUTTONS)}
+            controller.main_stick = tuple(main_stick.tolist())
+            controller.c_stick = tuple(c_stick.tolist())
+            controller.l_shoulder = l_shoulder
+            controller.r_shoulder = r_shoulder
+            state = FakePlayerState()
+            state.character = melee.Character(character)
+            state.costume = costume
+            state.x = x
+            state.y = y
+            state.position = _Position(x, y)
+            state.percent = percent
+            state.stock = stock
+            state.action = melee.Action(action)
+            state.action_frame = action_frame
+            state.facing = facing
+            state.jumps_left = jumps_left
+            state.invulnerable = invulnerable
+            state.on_ground = on_ground
+            state.off_stage = off_stage
+            state.shield_strength = shield_strength
+            state.cursor_x = cursor_x
+            state.cursor_y = cursor_y
+            state.cursor = _Position(cursor_x, cursor_y)
+            state.coin_down = coin_down
+            state.controller_state = controller
+            gamestate.players[port] = state
+        gamestates.append(gamestate)
+    return gamestates
+
+
+# What Stop.stop() pokes at when shutting a console down.
+class _FakeSlippstream:
+    _peer = None
+    _host = None
+
+
+# Plays a recording back through step(). at_end says what happens after the last frame: "none" returns None like a replay file
+# console does, "raise" raises RecordingFinished to break out of a bot's endless loop, and "loop" starts over from the beginning.
+class FakeConsole:
+    def __init__(self, recording_path: str, at_end: str = "none", gamestates: list = None):
+        self.gamestates = gamestates if gamestates is not None else load_gamestates(recording_path)
+        self.at_end = at_end
+        self.position = 0
+        # How many frames have been handed out, over every loop through the recording.
+        self.frames = 0
+        self.connected = False
+        self.temp_dir = None
+        self._process = None
+        self._slippstream = _FakeSlippstream()
+
+    def run(self, *args, **kwargs):
+        pass
+
+    def connect(self):
+        self.connected = True
+        return True
+
+    def stop(self):
+        self.connected = False
+
+    def step(self):
+        if self.position == len(self.gamestates):
+            if self.at_end == "raise":
+                raise RecordingFinished()
+            if self.at_end == "none":
+                return None
+            self.position = 0
+        gamestate = self.gamestates[self.position]
+        self.position += 1
+        self.frames += 1
+        return gamestate
+
+
+# Takes the place of melee.Controller. Every call is accepted and counted, and nothing else happens.
+class FakeController:
+    def __init__(self, console=None, port: int = 1, *args, **kwargs):
+        self.console = console
+        self.port = port
+        self.calls = 0
+
+    def _call(self, *args, **kwargs):
+        self.calls += 1
+        return True
+
+    connect = disconnect = flush = press_button = release_button = tilt_analog = press_shoulder = simple_press = \
+        release_all = _call
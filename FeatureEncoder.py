@@ -0,0 +1,211 @@
+# This file defines exactly what goes into the gamestate (X) and controller (Y) arrays that the behavioral cloning network is
+# trained on, and fills them in frame by frame. Originally store_data() built three Python lists for every frame, those got
+# appended to lists of lists, and only at the very end did numpy.array turn all of it into float64 arrays. That meant holding two
+# copies of every replay in memory at once and creating a mountain of Python objects along the way. Here, every frame gets
+# written straight into float32 arrays that were allocated ahead of time.
+#
+# BCBot.py used to have its own hand-written copy of the gamestate half of this, which had already drifted from the generator's
+# (it normalized stage, the generator didn't). Now both use state_row() below, so the bot sees exactly what the network was
+# trained on, and StateEncoder fills the bot's input array in place instead of building nested lists every frame.
+
+import melee
+import numpy
+
+# The columns of the X array, in order. Everything is normalized to roughly 0-1.
+X_FEATURES = (
+    "stage",
+    "p1_x", "p1_y",
+    "p2_x", "p2_y",
+    "p1_percent", "p2_percent",
+    "p1_action", "p2_action",
+    "p1_action_frame", "p2_action_frame",
+    "p1_facing", "p2_facing",
+    "p1_jumps", "p2_jumps",
+    "p1_invulnerable", "p2_invulnerable",
+    "p1_on_ground", "p2_on_ground",
+    "p1_off_stage", "p2_off_stage",
+    "p1_shield", "p2_shield",
+)
+
+# The columns of each Y array. Stick values are rounded to the nearest tenth to keep things simple.
+Y_FEATURES = (
+    "a", "b", "jump", "shield", "z",
+    "main_x", "main_y",
+    "c_x", "c_y",
+)
+
+# Values that the raw gamestate numbers are divided by to normalize them. Stage is divided by 26 rather than 29 because the stage
+# represented by 29 had zero replays, so we divided by the next highest value.
+STAGE_SCALE = 26
+POSITION_SCALE = 500
+PERCENT_SCALE = 999
+ACTION_SCALE = 397
+ACTION_FRAME_SCALE = 250
+JUMPS_SCALE = 2
+SHIELD_SCALE = 60
+
+# Looking these up once here rather than on every frame saves a surprising amount of time over a whole replay.
+_BUTTON_A = melee.Button.BUTTON_A
+_BUTTON_B = melee.Button.BUTTON_B
+_BUTTON_X = melee.Button.BUTTON_X
+_BUTTON_Y = melee.Button.BUTTON_Y
+_BUTTON_L = melee.Button.BUTTON_L
+_BUTTON_R = melee.Button.BUTTON_R
+_BUTTON_Z = melee.Button.BUTTON_Z
+
+
+# Turns one player's controller state into a row of Y data.
+def _controller_row(controller: melee.ControllerState):
+    button = controller.button
+    return (
+        # A button
+        button[_BUTTON_A],
+        # B button
+        button[_BUTTON_B],
+        # X || Y, since both X and Y can be used to jump.
+        button[_BUTTON_X] or button[_BUTTON_Y],
+        # L||R || L_SH||R_SH. Both of these can be used to shield, and it seems like we can probably ignore the continuous
+        # nature of the shield button since this rarely comes into play in an actual game. We'll reduce this to a 0/1
+        # binary value.
+        button[_BUTTON_L] or button[_BUTTON_R] or controller.l_shoulder > 0 or controller.r_shoulder > 0,
+        # Z button
+        button[_BUTTON_Z],
+        # Main Stick X and Y values, reduced to ten possible states to simplify things.
+        round(controller.main_stick[0], 1),
+        round(controller.main_stick[1], 1),
+        # C stick X and Y values
+        round(controller.c_stick[0], 1),
+        round(controller.c_stick[1], 1),
+    )
+
+
+# Turns one frame's gamestate into a row of X data, from the point of view of p1. The order here has to match X_FEATURES. It's a
+# tuple so that a whole row can be assigned in one go, which is a lot cheaper than filling it in one value at a time.
+# (Positions use .x/.y; this is deprecated but I can't get position to work for some reason.)
+def state_row(gamestate: melee.GameState, p1: melee.PlayerState, p2: melee.PlayerState):
+    return (
+        gamestate.stage.value/STAGE_SCALE,
+        p1.x/POSITION_SCALE, p1.y/POSITION_SCALE,
+        p2.x/POSITION_SCALE, p2.y/POSITION_SCALE,
+        p1.percent/PERCENT_SCALE, p2.percent/PERCENT_SCALE,
+        p1.action.value/ACTION_SCALE, p2.action.value/ACTION_SCALE,
+        p1.action_frame/ACTION_FRAME_SCALE, p2.action_frame/ACTION_FRAME_SCALE,
+        p1.facing, p2.facing,
+        p1.jumps_left/JUMPS_SCALE, p2.jumps_left/JUMPS_SCALE,
+        p1.invulnerable, p2.invulnerable,
+        p1.on_ground, p2.on_ground,
+        p1.off_stage, p2.off_stage,
+        round(p1.shield_strength/SHIELD_SCALE, 1), round(p2.shield_strength/SHIELD_SCALE, 1),
+    )
+
+
+# Holds the X, Y0 and Y1 arrays for one replay. The arrays are allocated once up front and double in size whenever a replay runs
+# longer than expected, so the same object can be reused for replay after replay without reallocating anything.
+class ReplayFeatures:
+    def __init__(self, capacity: int = 16384):
+        # This is the game state data.
+        self.x = numpy.empty((capacity, len(X_FEATURES)), dtype=numpy.float32)
+        # This is the first player's controller data.
+        self.y0 = numpy.empty((capacity, len(Y_FEATURES)), dtype=numpy.float32)
+        # This is the second player's controller data.
+        self.y1 = numpy.empty((capacity, len(Y_FEATURES)), dtype=numpy.float32)
+        # How many stocks each player has left. The network doesn't see these, but the offline RL rewards in SmashOffline.py
+        # need them to match CustomGame's.
+        self.stocks = numpy.empty((capacity, 2), dtype=numpy.uint8)
+        # How many frames have been written so far.
+        self.frames = 0
+
+    # Doubles the size of every array, keeping the frames that have already been written.
+    def _grow(self):
+        capacity = 2 * len(self.x)
+        for name in ("x", "y0", "y1", "stocks"):
+            old = getattr(self, name)
+            new = numpy.empty((capacity, old.shape[1]), dtype=old.dtype)
+            new[:self.frames] = old[:self.frames]
+            setattr(self, name, new)
+
+    # Forget about the current replay so the arrays can be reused for the next one.
+    def clear(self):
+        self.frames = 0
+
+    # Writes a single frame of data into the next row of each array.
+    def append(self, gamestate: melee.GameState, controller_ports: list):
+        if self.frames == len(self.x):
+            self._grow()
+        row = self.frames
+        p1 = gamestate.players[controller_ports[0]]
+        p2 = gamestate.players[controller_ports[1]]
+        self.x[row] = state_row(gamestate, p1, p2)
+        self.y0[row] = _controller_row(p1.controller_state)
+        self.y1[row] = _controller_row(p2.controller_state)
+        self.stocks[row] = (p1.stock, p2.stock)
+        self.frames += 1
+
+    # Returns the frames written so far. These are views into the arrays rather than copies, so they're only good until the
+    # next replay starts getting written.
+    def arrays(self):
+        return self.x[:self.frames], self.y0[:self.frames], self.y1[:self.frames]
+
+    # The stock counts written so far, one (p1, p2) row per frame. Also a view.
+    def stock_counts(self):
+        return self.stocks[:self.frames]
+
+
+# Fills the network's input array for live play. The array is allocated once and written in place, so encoding a frame doesn't
+# create anything new. ports says which player the bot is and which is the opponent, in that order.
+class StateEncoder:
+    def __init__(self, ports: tuple = (1, 2), max_batch: int = 1):
+        self.ports = ports
+        self.x = numpy.empty((max_batch, len(X_FEATURES)), dtype=numpy.float32)
+
+    # Encodes a single gamestate and returns it as a (1, 23) array, ready for predict(). The same array comes back every time, so
+    # it gets overwritten by the next call.
+    def encode(self, gamestate: melee.GameState):
+        players = gamestate.players
+        self.x[0] = state_row(gamestate, players[self.ports[0]], players[self.ports[1]])
+        return self.x[:1]
+
+    # Encodes a list of gamestates at once and returns them as an (n, 23) array. Like encode(), the array is reused.
+    def encode_batch(self, gamestates: list):
+        if len(gamestates) > len(self.x):
+            self.x = numpy.empty((len(gamestates), len(X_FEATURES)), dtype=numpy.float32)
+        p1_port, p2_port = self.ports
+        for row, gamestate in enumerate(gamestates):
+            players = gamestate.players
+            self.x[row] = state_row(gamestate, players[p1_port], players[p2_port])
+        return self.x[:len(gamestates)]
+
+
+# This goes the other way, from the network's output back to the controller. Since there's no way for the bot to convey holding
+# or pressing buttons, we use a simplified input scheme where the button it is most likely to press gets pressed on a given frame.
+def send_simple_input(input, controller: melee.Controller):
+    # Find most likely to be pressed button
+    score = 0
+    button = -1
+    it = 0
+    for x in input[0]:
+        # This means we've gotten into stick position territory. Stop looking.
+        if it > 4:
+            break
+        if score < x:
+            score = x
+            button = it
+        it += 1
+
+    # Conver the number to an actual button.
+    if button == 0:
+        button = melee.Button.BUTTON_A
+    elif button == 1:
+        button = melee.Button.BUTTON_B
+    elif button == 2:
+        button = melee.Button.BUTTON_X
+    elif button == 3:
+        button = melee.Button.BUTTON_L
+    elif button == 4:
+        button = melee.Button.BUTTON_Z
+    else:
+        button = None
+
+    # Sends to the emulator a controller position with the desired stick positions, rounded to the nearest tenth just like the
+    # training data was, as well as a button to be pressed.
+    controller.simple_press(round(input[0][5], 1), round(input[0][6], 1), button)
@@ -0,0 +1,130 @@
+# The game runs at 60 frames per second, so a bot has about 16.7ms to look at a frame and send its inputs before the next one
+# arrives. When a bot missed an input we had no idea if it was waiting on the emulator, turning the gamestate into features, running
+# the model or sending the controller inputs. This file times each of those stages on every frame the bot plays, and counts how
+# many frames the bot took longer than the budget to decide what to do.
+#
+# Timings go into a ring buffer of preallocated numpy arrays, so recording a frame doesn't allocate anything and memory stays the
+# same no matter how long the bot runs. Only the most recent `capacity` frames are kept for the percentiles, but the frame and
+# over-budget counts cover the whole run. Call dump() at the end (the bots register it with atexit, which also covers CTRL+C) to
+# print a summary and save it as JSON.
+#
+# In a bot's game loop it looks like this:
+#     timer.start()
+#     gamestate = console.step()
+#     timer.mark("step")
+#     ...work out the features...
+#     timer.mark("encode")
+#     ...and so on for each stage, then once the inputs are sent:
+#     timer.end_frame()
+# Frames that never get to end_frame(), like menu frames, are dropped when start() is called again.
+
+import json
+import time
+import numpy
+
+# One frame at 60 frames per second, in milliseconds.
+FRAME_BUDGET_MS = 1000 / 60
+# Stages that are spent waiting on the emulator rather than deciding on a move, so they don't count towards the budget.
+WAIT_STAGES = ("step",)
+PERCENTILES = (50, 90, 99, 99.9)
+
+
+class FrameTimer:
+    def __init__(self, stages: tuple, capacity: int = 1 << 16, budget_ms: float = FRAME_BUDGET_MS):
+        self.stages = tuple(stages)
+        self._columns = {stage: column for column, stage in enumerate(self.stages)}
+        self._waiting = {stage for stage in self.stages if stage in WAIT_STAGES}
+        # Nanoseconds spent in each stage, one row per frame.
+        self.times = numpy.zeros((capacity, len(self.stages)), dtype=numpy.int64)
+        # Nanoseconds spent deciding on each frame, which is every stage except the waiting ones.
+        self.decision_times = numpy.zeros(capacity, dtype=numpy.int64)
+        self.budget_ns = int(budget_ms * 1_000_000)
+        self.frames = 0
+        self.over_budget = 0
+        self.worst_ns = 0
+        self._row = self.times[0]
+        self._decision = 0
+        self._last = 0
+
+    # Starts timing a new frame. Call this right before console.step().
+    def start(self):
+        self._row = self.times[self.frames % len(self.times)]
+        self._row[:] = 0
+        self._decision = 0
+        self._last = time.perf_counter_ns()
+
+    # Records the time since the last mark (or start()) against the given stage.
+    def mark(self, stage: str):
+        now = time.perf_counter_ns()
+        elapsed = now - self._last
+        self._row[self._columns[stage]] += elapsed
+        if stage not in self._waiting:
+            self._decision += elapsed
+        self._last = now
+
+    # Finishes the frame, once the bot's inputs have been sent.
+    def end_frame(self):
+        self.decision_times[self.frames % len(self.times)] = self._decision
+        if self._decision > self.budget_ns:
+            self.over_budget += 1
+        if self._decision > self.worst_ns:
+            self.worst_ns = self._decision
+        self.frames += 1
+
+    # Percentiles for every stage and for the whole decision, in milliseconds, plus a histogram of decision times in 1ms buckets.
+    def report(self):
+        recorded = min(self.frames, len(self.times))
+        report = {
+            "frames": self.frames,
+            "recorded_frames": recorded,
+            "budget_ms": self.budget_ns / 1_000_000,
+            "over_budget_frames": self.over_budget,
+            "over_budget_fraction": self.over_budget / self.frames if self.frames else 0.0,
+            "worst_decision_ms": self.worst_ns / 1_000_000,
+            "stages": {},
+        }
+        if recorded == 0:
+            return report
+
+        columns = [(stage, self.times[:recorded, column]) for stage, column in self._columns.items()]
+        columns.append(("decision", self.decision_times[:recorded]))
+        for stage, nanoseconds in columns:
+            milliseconds = nanoseconds / 1_000_000
+            summary = {f"p{percentile:g}": float(value)
+                       for percentile, value in zip(PERCENTILES, numpy.percentile(milliseconds, PERCENTILES))}
+            summary["mean"] = float(milliseconds.mean())
+            summary["max"] = float(milliseconds.max())
+            report["stages"][stage] = summary
+
+        # Everything past twice the budget goes in the last bucket.
+        edges = numpy.arange(0, int(2 * self.budget_ns / 1_000_000) + 2, dtype=numpy.float64)
+        counts, edges = numpy.histogram(numpy.minimum(self.decision_times[:recorded] / 1_000_000, edges[-1] - 0.5), edges)
+        labels = [f"{int(low)}-{int(high)}" for low, high in zip(edges[:-2], edges[1:-1])] + [f"{int(edges[-2])}+"]
+        report["decision_histogram_ms"] = {label: int(count) for label, count in zip(labels, counts)}
+        return report
+
+    # Prints a summary and saves the full report to path.
+    def dump(self, path: str):
+        report = self.report()
+        print(f"{report['frames']} frames timed, {report['over_budget_frames']} over the {report['budget_ms']:.1f}ms budget "
+              f"(worst {report['worst_decision_ms']:.2f}ms).")
+        for stage, summary in report["stages"].items():
+            print(f"  {stage:>10}: " + ", ".join(f"{name} {value:.3f}ms" for name, value in summary.items()))
+        with open(path, "w") as report_file:
+            json.dump(report, report_file, indent=4)
+        print(f"Frame timings written to {path}.")
+
+
+# Stands in for FrameTimer when timing is turned off, so the game loop doesn't need an if around every mark.
+class NullFrameTimer:
+    def start(self):
+        pass
+
+    def mark(self, stage: str):
+        pass
+
+    def end_frame(self):
+        pass
+
+    def dump(self, path: str):
+        pass
@@ -5,9 +5,11 @@ import melee
 import random
 import os
 import time
+import atexit
 import psutil
 from pathlib import Path
 from Stop import stop
+from FrameTimer import FrameTimer, NullFrameTimer
 
 
 # Hard coded path to Slippi Dolphin
@@ -29,6 +31,13 @@ def close(sig, frame):
 
 signal.signal(signal.SIGINT, close)
 
+# Set this to True to time every frame the bot plays (see FrameTimer.py). The results get printed and saved to timings_path when
+# the script exits, including with CTRL+C.
+time_frames = False
+timings_path = "meleebot_frame_times.json"
+frame_timer = FrameTimer(("step", "act")) if time_frames else NullFrameTimer()
+atexit.register(frame_timer.dump, timings_path)
+
 # Start the emulator and connect to it.
 console.run(iso_path="/Users/emiller3425/cis365/CIS365FinalProject/ssb.iso", exe_name="Slippi Dolphin")
 console.connect()
@@ -39,22 +48,28 @@ opponentController.connect()
 
 while True:
     # Get next frame.
+    frame_timer.start()
     gamestate = console.step()
+    frame_timer.mark("step")
     if gamestate.menu_state in [melee.Menu.IN_GAME, melee.Menu.SUDDEN_DEATH]:
         # Game is active
+        onleft = gamestate.players[1].x < gamestate.players[2].x
 
         #If agent is off stage
-        if gamestate.player[1].off_stage == 1:
+        if gamestate.players[1].off_stage == 1:
             controller.press_button(melee.Button.BUTTON_X)
             controller.release_button(melee.Button.BUTTON_X)
             controller.press_button(melee.Button.BUTTON_X)
             controller.release_button(melee.Button.BUTTON_X)
+            # Waiting on this extra frame is emulator time, not time spent deciding.
+            frame_timer.mark("act")
             gamestate = console.step()
-        if gamestate.player[2].off_stage == 1:
+            frame_timer.mark("step")
+        if gamestate.players[2].off_stage == 1:
             controller.release_all()
         #If opponant is off stage
         elif gamestate.distance < 6:
-            if gamestate.player[1].y < gamestate.player[2].y:
+            if gamestate.players[1].y < gamestate.players[2].y:
                 controller.press_button(melee.Button.BUTTON_X)
                 controller.release_button(melee.Button.BUTTON_X)
             attackType = random.randint(0, 15)
@@ -77,12 +92,11 @@ while True:
                 controller.tilt_analog(melee.Button.BUTTON_MAIN, 0.5, 0)
         else:
             # Move towards opponent if outside attack range
-            onleft = gamestate.player[1].x < gamestate.player[2].x
             controller.press_button(melee.Button.BUTTON_A)
             controller.tilt_analog(melee.Button.BUTTON_MAIN, int(onleft), 0.5)
             controller.release_button(melee.Button.BUTTON_A)
             #If below oppanant jump above them
-            if gamestate.player[1].y < gamestate.player[2].y:
+            if gamestate.players[1].y < gamestate.players[2].y:
                 controller.release_all()
                 controller.tilt_analog(melee.Button.BUTTON_MAIN, int(onleft), 1)
                 controller.press_button(melee.Button.BUTTON_X)
@@ -93,6 +107,9 @@ while True:
                 controller.release_button(melee.Button.BUTTON_X)
             else:
                 controller.release_button(melee.Button.BUTTON_X)
+        # Everything the bot did this frame counts as acting. The extra step it takes when it's off stage counts as stepping.
+        frame_timer.mark("act")
+        frame_timer.end_frame()
 
     else:
         # Navigate menus , select character and map.
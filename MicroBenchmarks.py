@@ -0,0 +1,212 @@
+# Benchmarks for the small functions that run once for every frame, either while parsing replays or while playing live. None of
+# them take long on their own, but they run tens of thousands of times a second during parsing and have to share a 16.7ms frame
+# with the emulator during play, so a little extra work in any of them adds up fast.
+#
+# Each benchmark calls its function over and over on made-up gamestates (see synthetic_gamestates() in FakeConsole.py) and
+# measures two things:
+#   - ns/call: the median of `repeats` timed runs of `calls` calls each, divided out.
+#   - bytes/call: how far memory use rises above where it started during a single call, as measured by tracemalloc, averaged over
+#     alloc_calls calls. Functions that write into arrays allocated ahead of time should be close to zero, and any new array,
+#     list or dict showing up in one of them shows up here.
+#
+# The first run saves its results to baseline_path. Every run after that compares against it and exits with an error if any
+# benchmark got more than time_tolerance slower or allocates more than alloc_tolerance bytes more per call, so it can be used as
+# a check before committing a change. The numbers depend on the machine, so every machine keeps its own baseline. Even on one
+# machine, how fast everything runs drifts with load and clock speed, so each timed run is paired with a run of a fixed bit of
+# work that never changes (reference_work), and it's the ratio between the two that gets compared. Set
+# update_baseline to True to save the current results as the new baseline after a change that's meant to be slower.
+
+import os
+import sys
+import json
+import time
+import tracemalloc
+import numpy
+from FakeConsole import FakeController, synthetic_gamestates
+from FeatureEncoder import ReplayFeatures, StateEncoder, send_simple_input, Y_FEATURES
+from SmashGym import CustomGame
+
+baseline_path = "micro_benchmark_baseline.json"
+update_baseline = False
+# How many different gamestates the benchmarks cycle through. A few thousand is about a minute of a game.
+gamestate_count = 4096
+calls = 2000
+repeats = 30
+alloc_calls = 1000
+# A benchmark fails when it's this much slower than the baseline. Timings on a busy machine wander by 10% or so.
+time_tolerance = 0.25
+# Or when it allocates this many more bytes per call. Small numbers come and go with Python's own bookkeeping.
+alloc_tolerance = 64
+
+
+# Each of these sets up whatever its function needs and returns a function of one gamestate that calls it.
+def bench_replay_features_append(gamestates: list):
+    features = ReplayFeatures(capacity=len(gamestates))
+    ports = [1, 2]
+
+    def call(gamestate):
+        # Start over when the arrays fill up, like parsing a new replay, so they never grow in the middle of a measurement.
+        if features.frames == len(features.x):
+            features.clear()
+        features.append(gamestate, ports)
+    return call
+
+
+def bench_state_encoder_encode(gamestates: list):
+    return StateEncoder(ports=(1, 2)).encode
+
+
+def bench_send_simple_input(gamestates: list):
+    controller = FakeController()
+    # One network output per gamestate, so every button and stick position gets its turn.
+    outputs = numpy.random.default_rng(0).random((len(gamestates), 1, len(Y_FEATURES))).astype(numpy.float32)
+    inputs = {id(gamestate): output for gamestate, output in zip(gamestates, outputs)}
+    return lambda gamestate: send_simple_input(inputs[id(gamestate)], controller)
+
+
+def _game(gamestates: list, **options):
+    game = CustomGame(console_factory=None, **options)
+    game.controller = FakeController()
+    game.current_state = gamestates[-1]
+    game._get_obs(game.current_state, new_episode=True)
+    return game
+
+
+def bench_get_obs_dict(gamestates: list):
+    return _game(gamestates, observation_mode="dict")._get_obs
+
+
+def bench_get_obs_flat(gamestates: list):
+    return _game(gamestates, observation_mode="flat", frame_stack=4)._get_obs
+
+
+def bench_calculate_reward(gamestates: list):
+    game = _game(gamestates)
+
+    def call(gamestate):
+        game._calculate_reward(gamestate)
+        game.current_state = gamestate
+    return call
+
+
+def bench_execute_action(gamestates: list):
+    game = _game(gamestates)
+    actions = {id(gamestate): index % game.action_space.n for index, gamestate in enumerate(gamestates)}
+    return lambda gamestate: game._execute_action(actions[id(gamestate)])
+
+
+BENCHMARKS = {
+    "ReplayFeatures.append": bench_replay_features_append,
+    "StateEncoder.encode": bench_state_encoder_encode,
+    "send_simple_input": bench_send_simple_input,
+    "CustomGame._get_obs (dict)": bench_get_obs_dict,
+    "CustomGame._get_obs (flat, 4 frames)": bench_get_obs_flat,
+    "CustomGame._calculate_reward": bench_calculate_reward,
+    "CustomGame._execute_action": bench_execute_action,
+}
+
+
+# Some plain Python and a small numpy write, roughly the mix the benchmarked functions do, for measuring how fast the machine is
+# running right now.
+def reference_work(gamestate):
+    players = gamestate.players
+    _reference_row[:] = (players[1].x, players[1].y, players[2].x, players[2].y)
+    return sum(1 for port in players if players[port].stock > 0)
+
+
+_reference_row = numpy.empty(4, dtype=numpy.float32)
+
+
+# Times `calls` calls, `repeats` times over, with a run of reference_work right before each one. Returns the median time per call
+# in nanoseconds, and the median of each run's time divided by the reference run's time just before it, which is what gets
+# compared to the baseline. Medians, because on a busy machine the odd run comes out much faster or slower than the rest.
+def time_calls(call, gamestates: list, calls: int, repeats: int):
+    frames = [gamestates[index % len(gamestates)] for index in range(calls)]
+    call(frames[0])
+    times = []
+    ratios = []
+    for _ in range(repeats):
+        start = time.perf_counter_ns()
+        for gamestate in frames:
+            reference_work(gamestate)
+        reference = time.perf_counter_ns() - start
+        start = time.perf_counter_ns()
+        for gamestate in frames:
+            call(gamestate)
+        elapsed = time.perf_counter_ns() - start
+        times.append(elapsed / calls)
+        ratios.append(elapsed / reference)
+    return float(numpy.median(times)), float(numpy.median(ratios))
+
+
+# The average number of bytes a single call takes above what was already in use.
+def measure_allocations(call, gamestates: list, calls: int):
+    frames = [gamestates[index % len(gamestates)] for index in range(calls)]
+    tracemalloc.start()
+    try:
+        # Let anything that gets cached on the first call get cached.
+        call(frames[0])
+        total = 0
+        for gamestate in frames:
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+            call(gamestate)
+            total += tracemalloc.get_traced_memory()[1] - before
+    finally:
+        tracemalloc.stop()
+    return total / calls
+
+
+def run_benchmarks(gamestates: list):
+    results = {}
+    for name, setup in BENCHMARKS.items():
+        call = setup(gamestates)
+        ns_per_call, relative = time_calls(call, gamestates, calls, repeats)
+        results[name] = {"ns_per_call": ns_per_call, "relative": relative,
+                         "bytes_per_call": measure_allocations(call, gamestates, alloc_calls)}
+    return results
+
+
+# Every benchmark that got worse than the baseline by more than the tolerances, as printable lines.
+def regressions(results: dict, baseline: dict):
+    problems = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        old = baseline[name]
+        if result["relative"] > old["relative"] * (1 + time_tolerance):
+            problems.append(f"{name}: {result['relative']:.2f}x the reference work, baseline {old['relative']:.2f}x "
+                            f"({result['ns_per_call']:.0f}ns/call, baseline {old['ns_per_call']:.0f}ns/call)")
+        if result["bytes_per_call"] > old["bytes_per_call"] + alloc_tolerance:
+            problems.append(f"{name}: {result['bytes_per_call']:.0f} bytes/call, baseline {old['bytes_per_call']:.0f} bytes/call")
+    return problems
+
+
+if __name__ == "__main__":
+    gamestates = synthetic_gamestates(gamestate_count)
+    results = run_benchmarks(gamestates)
+
+    baseline = None
+    if os.path.isfile(baseline_path) and not update_baseline:
+        with open(baseline_path, "r") as baseline_file:
+            baseline = json.load(baseline_file)
+
+    print(f"{'':40}{'ns/call':>10}{'relative':>10}{'baseline':>10}{'bytes/call':>12}{'baseline':>10}")
+    for name, result in results.items():
+        old = baseline.get(name, {}) if baseline else {}
+        print(f"{name:40}{result['ns_per_call']:10.0f}{result['relative']:10.2f}{old.get('relative', float('nan')):10.2f}"
+              f"{result['bytes_per_call']:12.0f}{old.get('bytes_per_call', float('nan')):10.0f}")
+
+    if baseline is None:
+        with open(baseline_path, "w") as baseline_file:
+            json.dump(results, baseline_file, indent=2)
+        print(f"Saved these results to {baseline_path} as the baseline.")
+        sys.exit(0)
+
+    problems = regressions(results, baseline)
+    if problems:
+        print("Slower or allocating more than the baseline:")
+        for problem in problems:
+            print(f"  {problem}")
+        sys.exit(1)
+    print("No regressions.")
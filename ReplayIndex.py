@@ -0,0 +1,176 @@
+# The data generator used to fully load every replay and step into it just to find out that it wasn't a 2 player game, or that
+# nobody was playing Fox or Jigglypuff, and most of the replays in the set get thrown out for one of those reasons. Everything we
+# need to know to make that call is in the first few hundred bytes of a .slp file, so this file reads only that (plus the small
+# metadata block at the end for the game length) and builds an index that the expensive pass can pick replays out of.
+#
+# A .slp file is UBJSON: an object with a "raw" byte array holding the game events, followed by a "metadata" object. The first
+# event in "raw" lists the size of every event type, and the second is Game Start, which has the stage and every player's
+# character and player type in it. See https://github.com/project-slippi/slippi-wiki/blob/master/SPEC.md for the details.
+
+import os
+import csv
+import shutil
+import struct
+from multiprocessing.pool import ThreadPool
+import melee
+
+# Columns of the replay index, in order.
+INDEX_COLUMNS = ("replay_id", "replay", "corrupt", "reason", "players", "p1_port", "p2_port", "p1_character", "p2_character",
+                 "stage", "last_frame")
+
+# Game Start event layout.
+_EVENT_PAYLOADS = 0x35
+_GAME_START = 0x36
+_STAGE_OFFSET = 0x13
+_CHARACTER_OFFSET = 0x65
+_PLAYER_TYPE_OFFSET = 0x66
+_PLAYER_BLOCK_SIZE = 0x24
+_EMPTY_SLOT = 3
+
+# Game Start lists characters by their external (character select screen order) ID, while libmelee uses the internal ID that
+# shows up in frame data, so this converts one to the other.
+_EXTERNAL_CHARACTERS = (
+    melee.Character.CPTFALCON, melee.Character.DK, melee.Character.FOX, melee.Character.GAMEANDWATCH, melee.Character.KIRBY,
+    melee.Character.BOWSER, melee.Character.LINK, melee.Character.LUIGI, melee.Character.MARIO, melee.Character.MARTH,
+    melee.Character.MEWTWO, melee.Character.NESS, melee.Character.PEACH, melee.Character.PIKACHU, melee.Character.POPO,
+    melee.Character.JIGGLYPUFF, melee.Character.SAMUS, melee.Character.YOSHI, melee.Character.ZELDA, melee.Character.SHEIK,
+    melee.Character.FALCO, melee.Character.YLINK, melee.Character.DOC, melee.Character.ROY, melee.Character.PICHU,
+    melee.Character.GANONDORF,
+)
+
+# How much of the start of the file to read. Game Start is well within this.
+_HEADER_BYTES = 4096
+# How much of the metadata block to read looking for the last frame number.
+_METADATA_BYTES = 65536
+
+# Sizes of the UBJSON integer types we might run into.
+_UBJSON_INTS = {b"U": ">B", b"i": ">b", b"I": ">h", b"l": ">i", b"L": ">q"}
+
+
+# Raised for anything that means a replay can't be trusted.
+class CorruptReplay(Exception):
+    pass
+
+
+# Reads a UBJSON integer (type marker followed by the value) at `offset`, returning it and the offset just after it.
+def _read_ubjson_int(data: bytes, offset: int):
+    marker = data[offset:offset + 1]
+    if marker not in _UBJSON_INTS:
+        raise CorruptReplay(f"unexpected UBJSON marker {marker!r}")
+    value_format = _UBJSON_INTS[marker]
+    return struct.unpack_from(value_format, data, offset + 1)[0], offset + 1 + struct.calcsize(value_format)
+
+
+# Reads just the header (and metadata) of one replay and returns a row for the index. Never raises for a bad replay; it gets
+# marked corrupt instead.
+def scan_replay(path: str):
+    row = {"replay": os.path.basename(path), "corrupt": 0, "reason": "", "players": 0, "p1_port": 0, "p2_port": 0,
+           "p1_character": -1, "p2_character": -1, "stage": -1, "last_frame": -1}
+    try:
+        file_size = os.path.getsize(path)
+        with open(path, "rb") as replay_file:
+            header = replay_file.read(_HEADER_BYTES)
+
+            # {U\x03raw[$U#<length>
+            if not header.startswith(b"{U\x03raw[$U#"):
+                raise CorruptReplay("not a .slp file")
+            raw_length, raw_start = _read_ubjson_int(header, 10)
+            if raw_start + raw_length > file_size:
+                raise CorruptReplay("file is truncated")
+
+            # The payload sizes event has to come first, and tells us how long Game Start is.
+            if header[raw_start] != _EVENT_PAYLOADS:
+                raise CorruptReplay("missing event payload sizes")
+            payload_size = header[raw_start + 1]
+            event_sizes = {}
+            for cursor in range(raw_start + 2, raw_start + payload_size, 3):
+                command, size = struct.unpack_from(">BH", header, cursor)
+                event_sizes[command] = size
+            game_start = raw_start + payload_size + 1
+            if header[game_start] != _GAME_START or _GAME_START not in event_sizes:
+                raise CorruptReplay("missing game start")
+            if game_start + event_sizes[_GAME_START] > len(header):
+                raise CorruptReplay("game start is truncated")
+
+            row["stage"] = melee.enums.to_internal_stage(struct.unpack_from(">H", header, game_start + _STAGE_OFFSET)[0]).value
+            ports = []
+            characters = []
+            for slot in range(4):
+                block = game_start + _PLAYER_BLOCK_SIZE * slot
+                if header[block + _PLAYER_TYPE_OFFSET] == _EMPTY_SLOT:
+                    continue
+                character = header[block + _CHARACTER_OFFSET]
+                if character >= len(_EXTERNAL_CHARACTERS):
+                    raise CorruptReplay(f"unknown character {character}")
+                ports.append(slot + 1)
+                characters.append(_EXTERNAL_CHARACTERS[character].value)
+            row["players"] = len(ports)
+            if ports:
+                row["p1_port"], row["p1_character"] = ports[0], characters[0]
+            if len(ports) > 1:
+                row["p2_port"], row["p2_character"] = ports[1], characters[1]
+
+            # The game length isn't in Game Start, but it's in the metadata right after the raw events. Replays that were
+            # still being written when they got copied won't have it, which is fine, it's just unknown.
+            replay_file.seek(raw_start + raw_length)
+            metadata = replay_file.read(_METADATA_BYTES)
+            last_frame = metadata.find(b"U\x09lastFrame")
+            if last_frame != -1:
+                row["last_frame"] = _read_ubjson_int(metadata, last_frame + 11)[0]
+    except (OSError, IndexError, struct.error, ValueError, CorruptReplay) as error:
+        row["corrupt"] = 1
+        row["reason"] = str(error) or type(error).__name__
+    return row
+
+
+# Reads a replay index into a list of dictionaries.
+def load_index(index_path: str):
+    if not os.path.isfile(index_path):
+        return []
+    rows = []
+    with open(index_path, "r", newline="") as index_file:
+        for row in csv.DictReader(index_file):
+            if None in row.values():
+                continue
+            for column in INDEX_COLUMNS:
+                if column not in ("replay", "reason"):
+                    row[column] = int(row[column])
+            rows.append(row)
+    return rows
+
+
+# Scans every replay in input_path that isn't in the index yet and adds it. Replay IDs are handed out in sorted filename order,
+# the same way the data generator numbers them, and never change once they're in the index. Corrupt replays get moved into
+# quarantine_path (if one is given) so that nothing else trips over them. Returns the whole index.
+def build_index(input_path: str, index_path: str, quarantine_path: str = None, worker_count: int = 32):
+    rows = load_index(index_path)
+    known = set(row["replay"] for row in rows)
+    next_id = max((row["replay_id"] for row in rows), default=0) + 1
+    new_replays = [replay for replay in sorted(os.listdir(input_path)) if replay not in known]
+    if not new_replays:
+        return rows
+
+    if quarantine_path is not None:
+        os.makedirs(quarantine_path, exist_ok=True)
+
+    is_new_file = not os.path.isfile(index_path)
+    with open(index_path, "a", newline="") as index_file, ThreadPool(worker_count) as pool:
+        index = csv.DictWriter(index_file, fieldnames=INDEX_COLUMNS)
+        if is_new_file:
+            index.writeheader()
+        # This is almost all waiting on the disk, so threads are plenty. imap keeps the rows in order so IDs come out the same.
+        paths = [os.path.join(input_path, replay) for replay in new_replays]
+        for replay_id, row in enumerate(pool.imap(scan_replay, paths, chunksize=64), start=next_id):
+            row["replay_id"] = replay_id
+            if row["corrupt"] and quarantine_path is not None:
+                shutil.move(os.path.join(input_path, row["replay"]), os.path.join(quarantine_path, row["replay"]))
+            index.writerow(row)
+            rows.append(row)
+    return rows
+
+
+# Picks out the replays worth fully parsing: not corrupt, the right number of players, and at least one of the given characters.
+def select_replays(rows: list, characters: tuple, players: int = 2):
+    wanted = set(character.value for character in characters)
+    return [row for row in rows if not row["corrupt"] and row["players"] == players
+            and (row["p1_character"] in wanted or row["p2_character"] in wanted)]
@@ -0,0 +1,238 @@
+# Writing three tiny .npy files per replay meant the parsed data set ended up as a couple hundred thousand files spread over the
+# stage folders, and the training script had to walk, match up and open every single one of them. This file packs all of the
+# frames into a handful of big, fixed-size shards instead, with an index on the side that says which frames belong to which replay.
+#
+# The layout of a sharded data set looks like this:
+#   dataset.json              - shard size, whether the shards are compact, and the names of the columns in each array
+#   index.csv                 - one row per replay: ID, filename, characters, stage, ports, and where its frames start
+#   shard-00000-x.npy         - gamestate data for global frames 0 through shard_frames-1
+#   shard-00000-y0.npy        - first player's controller data for those same frames
+#   shard-00000-y1.npy        - second player's controller data for those same frames
+#   shard-00000-stocks.npy    - both players' stock counts for those same frames, if the data set has them (see below)
+#   shard-00001-x.npy ...
+#
+# The stock counts aren't part of what the network trains on. SmashOffline.py uses them to work out rewards. Data sets made
+# before they were recorded don't have them, and keep being written without them.
+#
+# Frames are numbered globally, so shard n holds frames n*shard_frames up to (n+1)*shard_frames. A replay can start near the end
+# of one shard and finish in the next. Every shard is created at full size, which means the last one has some unused rows at the
+# end. The index is the only thing that says which rows actually hold data.
+
+import os
+import csv
+import json
+import numpy
+from numpy.lib.format import open_memmap
+from FeatureEncoder import X_FEATURES, Y_FEATURES
+from CompactCodec import X_DTYPE, Y_DTYPE
+
+# Columns of index.csv, in order.
+INDEX_COLUMNS = ("replay_id", "replay", "p1_character", "p2_character", "stage", "p1_port", "p2_port", "start", "frames")
+
+# A little over a million frames (about 5 hours of gameplay) per shard. That works out to ~96MB for an X shard and ~36MB for
+# each Y shard, which is big enough that there are only a few hundred files but small enough to copy around.
+DEFAULT_SHARD_FRAMES = 1 << 20
+
+
+# Gives the path of one of a shard's files, e.g. shard_file(path, 3, "y0").
+def shard_file(path: str, number: int, array: str):
+    return os.path.join(path, f"shard-{number:05d}-{array}.npy")
+
+
+# Reads dataset.json, which is written the first time a ShardWriter is pointed at a directory.
+def load_info(path: str):
+    with open(os.path.join(path, "dataset.json"), "r") as info_file:
+        return json.load(info_file)
+
+
+# Reads index.csv into a list of dictionaries, one per replay, in the order they were written.
+def load_index(path: str):
+    index_path = os.path.join(path, "index.csv")
+    if not os.path.isfile(index_path):
+        return []
+    rows = []
+    with open(index_path, "r", newline="") as index_file:
+        for row in csv.DictReader(index_file):
+            # A crash in the middle of a write can leave a partial row at the end. Its frames will just be overwritten on the
+            # next run.
+            if None in row.values():
+                continue
+            for column in INDEX_COLUMNS:
+                if column != "replay":
+                    row[column] = int(row[column])
+            rows.append(row)
+    return rows
+
+
+# Memory maps every shard in the data set. Returns a list of (x, y0, y1) tuples, one per shard. Nothing is actually read from
+# disk until it gets used.
+def open_shards(path: str, mode: str = "r"):
+    shards = []
+    number = 0
+    while os.path.isfile(shard_file(path, number, "x")):
+        shards.append(tuple(numpy.load(shard_file(path, number, array), mmap_mode=mode) for array in ("x", "y0", "y1")))
+        number += 1
+    return shards
+
+
+# Gets one replay's (x, y0, y1) arrays out of the shards as a list of pieces, one per shard it's in (so almost always just one).
+# Every piece is a view into the memory maps, so nothing gets read from disk until it's used.
+def game_segments(shards: list, row: dict, shard_frames: int):
+    segments = []
+    start = row["start"]
+    end = start + row["frames"]
+    while start < end:
+        number, offset = divmod(start, shard_frames)
+        count = min(shard_frames - offset, end - start)
+        segments.append(tuple(array[offset:offset + count] for array in shards[number]))
+        start += count
+    return segments
+
+
+# Memory maps every shard's stock counts, or returns None if the data set doesn't have them.
+def open_stock_shards(path: str):
+    if not load_info(path).get("stocks", False):
+        return None
+    stock_shards = []
+    number = 0
+    while os.path.isfile(shard_file(path, number, "stocks")):
+        stock_shards.append((numpy.load(shard_file(path, number, "stocks"), mmap_mode="r"),))
+        number += 1
+    return stock_shards
+
+
+# Gets one replay's (x, y0, y1) arrays out of the shards. These are views into the memory maps unless the replay happens to be
+# split across two shards, in which case the two halves have to be stuck together.
+def read_game(shards: list, row: dict, shard_frames: int):
+    segments = game_segments(shards, row, shard_frames)
+    if len(segments) == 1:
+        return segments[0]
+    return tuple(numpy.concatenate(piece, axis=0) for piece in zip(*segments))
+
+
+# Appends replays to a sharded data set. If the directory already has one in it, new replays go on the end of it, so an
+# interrupted run can just keep going. With compact=True the shards hold the records from CompactCodec.py rather than floats, and
+# add() expects to be given records. shard_frames defaults to whatever the existing data set uses, or DEFAULT_SHARD_FRAMES for a
+# new one. With stocks=True add() also takes each frame's stock counts; it defaults to whatever the existing data set does, and
+# to True for a new one.
+class ShardWriter:
+    def __init__(self, path: str, shard_frames: int = None, compact: bool = False, stocks: bool = None):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+        # The shard size and format can't change once a data set has been started, or every existing frame would be wrong. Asking
+        # for a different one is a mistake in the settings, so it stops here rather than mixing formats in the same data set.
+        if os.path.isfile(os.path.join(path, "dataset.json")):
+            info = load_info(path)
+            if shard_frames is not None and shard_frames != info["shard_frames"]:
+                raise ValueError(f"{path} has {info['shard_frames']} frames per shard, not {shard_frames}. Use a new directory "
+                                 f"or the same shard size.")
+            if compact != info.get("compact", False):
+                raise ValueError(f"{path} is {'' if info.get('compact', False) else 'not '}in the compact format. Set compact to "
+                                 f"match, or use a new directory.")
+            if stocks is not None and stocks != info.get("stocks", False):
+                raise ValueError(f"{path} {'has' if info.get('stocks', False) else 'does not have'} stock counts. Set stocks to "
+                                 f"match, or use a new directory.")
+            shard_frames = info["shard_frames"]
+            stocks = info.get("stocks", False)
+        else:
+            if shard_frames is None:
+                shard_frames = DEFAULT_SHARD_FRAMES
+            if stocks is None:
+                stocks = True
+            with open(os.path.join(path, "dataset.json"), "w") as info_file:
+                json.dump({"shard_frames": shard_frames, "compact": compact, "stocks": stocks, "x_features": X_FEATURES,
+                           "y_features": Y_FEATURES}, info_file, indent=4)
+        self.shard_frames = shard_frames
+        self.compact = compact
+        self.stocks = stocks
+
+        # Anything past the last replay in the index is left over from a crash and gets written over.
+        rows = load_index(path)
+        self.replays = set(row["replay"] for row in rows)
+        self.total_frames = rows[-1]["start"] + rows[-1]["frames"] if rows else 0
+
+        # Rewrite the index without any partial row a crash might have left on the end, then keep it open to append to. It's
+        # written to a temporary file first so that a crash right here can't cost us the whole index.
+        index_path = os.path.join(path, "index.csv")
+        with open(index_path + ".tmp", "w", newline="") as index_file:
+            index = csv.DictWriter(index_file, fieldnames=INDEX_COLUMNS)
+            index.writeheader()
+            index.writerows(rows)
+        os.replace(index_path + ".tmp", index_path)
+        self._index_file = open(index_path, "a", newline="")
+        self._index = csv.DictWriter(self._index_file, fieldnames=INDEX_COLUMNS)
+
+        self._shard_number = None
+        self._shard = None
+
+    # Switches over to shard number `number`, creating it if it doesn't exist yet.
+    def _open_shard(self, number: int):
+        self._flush_shard()
+        shard = []
+        for array, columns, record in (("x", X_FEATURES, X_DTYPE), ("y0", Y_FEATURES, Y_DTYPE), ("y1", Y_FEATURES, Y_DTYPE)):
+            filename = shard_file(self.path, number, array)
+            if os.path.isfile(filename):
+                shard.append(open_memmap(filename, mode="r+"))
+                # Compact records from an older version of CompactCodec.py would get new ones written into them wrong.
+                if self.compact and shard[-1].dtype != record:
+                    raise ValueError(f"{filename} was written with an older compact format. Use a new directory.")
+            elif self.compact:
+                shard.append(open_memmap(filename, mode="w+", dtype=record, shape=(self.shard_frames,)))
+            else:
+                shard.append(open_memmap(filename, mode="w+", dtype=numpy.float32, shape=(self.shard_frames, len(columns))))
+        if self.stocks:
+            filename = shard_file(self.path, number, "stocks")
+            if os.path.isfile(filename):
+                shard.append(open_memmap(filename, mode="r+"))
+            else:
+                shard.append(open_memmap(filename, mode="w+", dtype=numpy.uint8, shape=(self.shard_frames, 2)))
+        self._shard_number = number
+        self._shard = shard
+
+    def _flush_shard(self):
+        if self._shard is not None:
+            for array in self._shard:
+                array.flush()
+
+    # Writes one replay's frames into the shards, then records it in the index. The index row only gets written once the frames
+    # are on disk, so the index never points at data that isn't there.
+    def add(self, replay_id: int, replay: str, p1_character: int, p2_character: int, stage: int, controller_ports: list,
+            x: numpy.ndarray, y0: numpy.ndarray, y1: numpy.ndarray, stocks: numpy.ndarray = None):
+        arrays = (x, y0, y1)
+        if self.stocks:
+            if stocks is None:
+                raise ValueError(f"{self.path} has stock counts, so every replay added to it needs them too.")
+            arrays += (stocks,)
+        frames = len(x)
+        written = 0
+        while written < frames:
+            number, offset = divmod(self.total_frames + written, self.shard_frames)
+            if number != self._shard_number:
+                self._open_shard(number)
+            count = min(self.shard_frames - offset, frames - written)
+            for shard_array, array in zip(self._shard, arrays):
+                shard_array[offset:offset + count] = array[written:written + count]
+            written += count
+        self._flush_shard()
+
+        self._index.writerow({
+            "replay_id": replay_id,
+            "replay": replay,
+            "p1_character": p1_character,
+            "p2_character": p2_character,
+            "stage": stage,
+            "p1_port": controller_ports[0],
+            "p2_port": controller_ports[1],
+            "start": self.total_frames,
+            "frames": frames,
+        })
+        self._index_file.flush()
+        self.total_frames += frames
+        self.replays.add(replay)
+
+    def close(self):
+        self._flush_shard()
+        self._shard = None
+        self._shard_number = None
+        self._index_file.close()
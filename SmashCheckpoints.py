@@ -0,0 +1,70 @@
+# SmashTrainer.py saves a checkpoint after every round of learning, and model.save() holds everything up while it writes the
+# whole zip file to disk, emulators included, since they're waiting for their next action. This file splits a save in two:
+# the model gets serialized into memory straight away, which is quick and has to happen before training changes the weights
+# again, and the bytes get written to disk on a background thread while training carries on.
+#
+# Each checkpoint is written to a temporary file next to its final path and then moved into place with os.replace(), so anything
+# watching the directory (like SmashEvaluator.py) only ever sees complete checkpoints. If a write fails, the error comes back
+# out of the next save() or close() rather than disappearing on the background thread.
+
+import io
+import os
+import queue
+import threading
+
+
+class BackgroundSaver:
+    def __init__(self):
+        self._queue = queue.Queue()
+        self._error = None
+        self._thread = threading.Thread(target=self._write_loop, daemon=True)
+        self._thread.start()
+        # How many checkpoints have made it to disk.
+        self.saved = 0
+
+    def _write_loop(self):
+        while True:
+            job = self._queue.get()
+            try:
+                if job is None:
+                    return
+                path, data = job
+                os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+                temporary_path = f"{path}.tmp"
+                with open(temporary_path, "wb") as checkpoint_file:
+                    checkpoint_file.write(data)
+                    checkpoint_file.flush()
+                    os.fsync(checkpoint_file.fileno())
+                os.replace(temporary_path, path)
+                self.saved += 1
+            except Exception as error:
+                self._error = error
+            finally:
+                self._queue.task_done()
+
+    def _raise_error(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    # Serializes the model now and writes it to path (plus ".zip", if it isn't there, like stable_baselines3 does) in the
+    # background.
+    def save(self, model, path: str):
+        self._raise_error()
+        if not path.endswith(".zip"):
+            path = f"{path}.zip"
+        buffer = io.BytesIO()
+        model.save(buffer)
+        self._queue.put((path, buffer.getvalue()))
+
+    # Waits for every checkpoint so far to be written.
+    def wait(self):
+        self._queue.join()
+        self._raise_error()
+
+    # Waits for the last checkpoints and stops the background thread.
+    def close(self):
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+        self._raise_error()
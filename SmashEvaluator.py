@@ -0,0 +1,119 @@
+# Scores the checkpoints SmashTrainer.py saves while it's still training. Run this alongside the trainer: it watches
+# checkpoint_directory, and every time a new checkpoint shows up it plays episodes_per_checkpoint games with it in eval_env_count
+# games at once (each its own worker process and Dolphin, see SmashVecEnv.py), then adds a line to report_path with its average
+# reward and how often it won. Already scored checkpoints are read back from the report on startup and skipped, so it can be
+# stopped and started again whenever. A checkpoint is recognised by its name, size and modification time together, since a new
+# training run saves checkpoints with the same names as the last one did.
+#
+# The agent plays deterministically, always picking its most likely move. A game counts as a win if the agent had more stocks
+# left than the CPU when it ended. The evaluation games use Slippi ports starting at base_slippi_port, which is kept clear of
+# the ones the trainer uses. Set watch to False to score whatever's there and exit.
+
+import os
+import json
+import time
+import numpy
+from SmashVecEnv import make_vec_env, BASE_SLIPPI_PORT
+from SmashTrainer import model_directory, observation_mode, frame_stack, action_repeat
+
+checkpoint_directory = f"{model_directory}/TestModel"
+report_path = f"{model_directory}/evaluation_report.jsonl"
+episodes_per_checkpoint = 20
+eval_env_count = 4
+base_slippi_port = BASE_SLIPPI_PORT + 100
+watch = True
+poll_seconds = 30
+
+
+# Plays `episodes` games with the model in a stable_baselines3 VecEnv and returns the average reward, win rate and so on.
+# Short games finish first, so just taking the first `episodes` to finish would leave out the long ones. Instead every game
+# gets its own share of the episodes up front, like stable_baselines3's evaluate_policy does, and anything a game plays past
+# its share isn't counted.
+def evaluate(model, env, episodes: int):
+    targets = numpy.array([(episodes + index) // env.num_envs for index in range(env.num_envs)])
+    counts = numpy.zeros(env.num_envs, dtype=numpy.int64)
+    observation = env.reset()
+    totals = numpy.zeros(env.num_envs)
+    lengths = numpy.zeros(env.num_envs, dtype=numpy.int64)
+    rewards, wins, episode_lengths = [], [], []
+    while (counts < targets).any():
+        actions, _ = model.predict(observation, deterministic=True)
+        # VecEnvs put terminated and truncated together and reset finished games themselves, so it's four values here, not five.
+        observation, step_rewards, dones, infos = env.step(actions)
+        totals += step_rewards
+        lengths += 1
+        for index in numpy.flatnonzero(dones):
+            info = infos[index]
+            if counts[index] < targets[index]:
+                rewards.append(float(totals[index]))
+                episode_lengths.append(int(lengths[index]))
+                if "agent_stock" in info:
+                    wins.append(info["agent_stock"] > info["opponent_stock"])
+                counts[index] += 1
+            totals[index] = 0
+            lengths[index] = 0
+    return {
+        "episodes": len(rewards),
+        "mean_reward": float(numpy.mean(rewards)),
+        "std_reward": float(numpy.std(rewards)),
+        "win_rate": float(numpy.mean(wins)) if wins else None,
+        "mean_length": float(numpy.mean(episode_lengths)),
+    }
+
+
+# Every checkpoint in the directory, oldest first. Files still being written end in .tmp, so they aren't picked up.
+def find_checkpoints(directory: str):
+    if not os.path.isdir(directory):
+        return []
+    paths = [os.path.join(directory, name) for name in os.listdir(directory) if name.endswith(".zip")]
+    return sorted(paths, key=os.path.getmtime)
+
+
+# What a checkpoint is known by in the report: (name, modification time, size).
+def checkpoint_key(path: str):
+    stat = os.stat(path)
+    return os.path.basename(path), stat.st_mtime, stat.st_size
+
+
+# Every checkpoint in the report, keyed on checkpoint_key(). Entries from before the times and sizes were recorded don't match
+# anything, so those checkpoints get scored again.
+def load_report(path: str):
+    scored = {}
+    if not os.path.isfile(path):
+        return scored
+    with open(path, "r") as report_file:
+        for line in report_file:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            scored[(entry["checkpoint"], entry.get("mtime"), entry.get("size"))] = entry
+    return scored
+
+
+if __name__ == "__main__":
+    from stable_baselines3 import PPO
+    scored = load_report(report_path)
+    env = make_vec_env(eval_env_count, backend="subproc" if eval_env_count > 1 else "dummy", base_slippi_port=base_slippi_port,
+                       observation_mode=observation_mode, frame_stack=frame_stack, action_repeat=action_repeat)
+    try:
+        while True:
+            for path in find_checkpoints(checkpoint_directory):
+                key = checkpoint_key(path)
+                if key in scored:
+                    continue
+                name, mtime, size = key
+                model = PPO.load(path, device="cpu")
+                entry = {"checkpoint": name, "mtime": mtime, "size": size, "timesteps": int(model.num_timesteps),
+                         **evaluate(model, env, episodes_per_checkpoint), "evaluated_at": time.time()}
+                with open(report_path, "a") as report_file:
+                    report_file.write(json.dumps(entry) + "\n")
+                scored[key] = entry
+                win_rate = "n/a" if entry["win_rate"] is None else f"{entry['win_rate']:.0%}"
+                print(f"{name}: mean reward {entry['mean_reward']:.1f} +- {entry['std_reward']:.1f}, win rate {win_rate} "
+                      f"over {entry['episodes']} games")
+            if not watch:
+                break
+            time.sleep(poll_seconds)
+    finally:
+        env.close()
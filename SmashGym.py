@@ -14,10 +14,61 @@ import numpy
 import os
 import itertools
 from Stop import stop
+from FeatureEncoder import POSITION_SCALE, PERCENT_SCALE, ACTION_FRAME_SCALE
 import time
 
+# The observation in "flat" mode: the same things as the Dict observation, but normalized and packed into one float32 vector.
+FLAT_OBSERVATION = (
+    "agent_x", "agent_y",
+    "opponent_x", "opponent_y",
+    "agent_action", "opponent_action",
+    "agent_facing", "opponent_facing",
+    "agent_percent", "opponent_percent",
+    "agent_action_frame", "opponent_action_frame",
+    "agent_off_stage",
+)
+# Actions are divided by 400 so that all 401 of them fit in 0-1. Everything else is scaled the same as the BC network's input.
+FLAT_ACTION_SCALE = 400
+_FLAT_LOW = numpy.array([-1, -1, -1, -1] + [0] * 9, dtype=numpy.float32)
+_FLAT_HIGH = numpy.ones(len(FLAT_OBSERVATION), dtype=numpy.float32)
+
+# Generate list of possible moves from which to select. Each move is one button and one stick position, and the action space
+# is every combination of the two.
+BUTTONS = [melee.Button.BUTTON_B, melee.Button.BUTTON_A, melee.Button.BUTTON_Z, melee.Button.BUTTON_L, None]
+STICK_POSITIONS = [(0.5,0.5), (0,0.5), (0,0), (0.5,0), (1,0), (1,0.5), (1,1), (0.5,1), (0,1),
+                   (0.25,0.5), (0.25,0.25), (0.5,0.25), (0.75,0.25), (0.75,0.5), (0.75,0.75), (0.5,0.75), (0.25,0.75)]
+
+# SmashOffline.py works out the same rewards for whole replays at once, so it uses these too.
+KNOCKOUT_REWARD = 1000
+OFF_STAGE_PENALTY = 10
+
+
+# Makes the melee.Console that CustomGame plays on. This code is only going to work on windows, but it'll get the default install
+# directory for Slippi's Dolphin instance and set it as the path. Every Dolphin that's running at the same time needs its own
+# slippi_port. Pass CustomGame a different function to run somewhere else, or to test it against a stand-in console.
+def dolphin_console(slippi_port: int = 51441):
+    homeDirectory = os.path.expanduser('~'+os.environ.get("USERNAME"))
+    return melee.Console(path=homeDirectory+"\\AppData\\Roaming\\Slippi Launcher\\netplay", slippi_address="127.0.0.1",
+                         slippi_port=slippi_port)
+
+
 class CustomGame(gymnasium.Env):
-    def __init__(self):
+    # console_factory is called with slippi_port every time a new console is needed. agent_port and opponent_port are the
+    # controller ports for our agent and the CPU it plays against.
+    #
+    # soft_reset keeps the same Dolphin running from one episode to the next (see reset()), and menu_timeout_frames is how long
+    # to spend getting back into a game before giving up and restarting it. Dolphin gets launch_attempts tries to make it into a
+    # game from a fresh start before reset() gives up with a RuntimeError.
+    #
+    # observation_mode is either "dict", the original observation space below, or "flat", a single float32 vector (see
+    # FLAT_OBSERVATION) that works with the plain MlpPolicy. In flat mode, frame_stack > 1 puts the last frame_stack frames
+    # one after another in the vector, oldest first.
+    #
+    # action_repeat is how many frames each action is held for. The agent only has to decide every action_repeat frames, and the
+    # reward for a step is the total over all of them. The repeat is cut short if the game ends or the agent loses a stock.
+    def __init__(self, console_factory=dolphin_console, slippi_port: int = 51441, agent_port: int = 1, opponent_port: int = 2,
+                 iso_path: str = "./ssb.iso", soft_reset: bool = True, menu_timeout_frames: int = 60 * 60, launch_attempts: int = 3,
+                 observation_mode: str = "dict", frame_stack: int = 1, action_repeat: int = 1):
         # Defines the Melee game state. This is the minimum amount of observations that I feel it would be possible for an agent
         # to learn to play the game from. Inferences based on these factors should be able to fill in any gaps we've left.
         self.observation_space = spaces.Dict({
@@ -50,62 +101,122 @@ class CustomGame(gymnasium.Env):
             "agent_off_stage": spaces.Discrete(2)
         })
 
+        self.observation_mode = observation_mode
+        self.frame_stack = frame_stack
+        self.action_repeat = action_repeat
+        if observation_mode == "flat":
+            self.observation_space = spaces.Box(low=numpy.tile(_FLAT_LOW, frame_stack), high=numpy.tile(_FLAT_HIGH, frame_stack),
+                                                dtype=numpy.float32)
+            # The stacked frames live in a ring buffer that's written twice, once in each half, so that the last frame_stack
+            # frames are always sitting next to each other in order and the observation can be a view rather than a copy.
+            self._frames = numpy.zeros((2 * frame_stack, len(FLAT_OBSERVATION)), dtype=numpy.float32)
+            self._newest = 0
+
         # Each move consists of one stick position and one button press. Among stick positions and button presses, we also include a "None"
         # button press for no attack and a "0.5,0.5" stick position for centered, no movement.
         self.action_space = spaces.Discrete(85)
 
+        self.console_factory = console_factory
+        self.slippi_port = slippi_port
+        self.agent_port = agent_port
+        self.opponent_port = opponent_port
+        self.iso_path = iso_path
+        self.soft_reset = soft_reset
+        self.menu_timeout_frames = menu_timeout_frames
+        self.launch_attempts = launch_attempts
+        # How long the last reset took in seconds, and how many of each kind there have been.
+        self.last_reset_seconds = 0.0
+        self.soft_resets = 0
+        self.hard_resets = 0
+
         # Hold LibMelee required values.
         self.console: melee.Console = None
         self.controller: melee.Controller = None
         self.opponent_controller: melee.Controller = None
         self.current_state: melee.GameState = None
 
-        # Generate list of possible moves from which to select.
-        buttons = [melee.Button.BUTTON_B, melee.Button.BUTTON_A, melee.Button.BUTTON_Z, melee.Button.BUTTON_L, None]
-        stick_positions = [(0.5,0.5), (0,0.5), (0,0), (0.5,0), (1,0), (1,0.5), (1,1), (0.5,1), (0,1),
-                                (0.25,0.5), (0.25,0.25), (0.5,0.25), (0.75,0.25), (0.75,0.5), (0.75,0.75), (0.5,0.75), (0.25,0.75)]
-        
         # Each number in the action space will translate to one index in this array, which contains all of the possible movement combinations.
-        self.possible_moves = list(itertools.product(buttons, stick_positions))
+        self.possible_moves = list(itertools.product(BUTTONS, STICK_POSITIONS))
         
-    def _get_obs(self, gamestate: melee.GameState):
-        players = gamestate.players
+    # new_episode is set on the first frame of a game, so that a frame stack doesn't start with frames from the last one.
+    def _get_obs(self, gamestate: melee.GameState, new_episode: bool = False):
+        if self.observation_mode == "flat":
+            return self._get_flat_obs(gamestate, new_episode)
+        agent = gamestate.players[self.agent_port]
+        opponent = gamestate.players[self.opponent_port]
 
         # Returns all the game state data in the form of the observation space.
         return {
-            "agent_coords": numpy.array([players[1].x, players[1].y], dtype=numpy.float32),
-            "opponent_coords": numpy.array([players[2].x, players[2].y], dtype=numpy.float32),
-            "agent_action": players[1].action.value,
-            "opponent_action": players[2].action.value,
-            "agent_facing": players[1].facing,
-            "opponent_facing": players[2].facing,
-            "agent_percent": numpy.array([players[1].percent], dtype=numpy.int32),
-            "opponent_percent": numpy.array([players[2].percent], dtype=numpy.int32),
-            "agent_action_frame": numpy.array([players[1].action_frame], dtype=numpy.int32),
-            "opponent_action_frame": numpy.array([players[2].action_frame], dtype=numpy.int32),
-            "agent_off_stage": players[1].off_stage
+            "agent_coords": numpy.array([agent.x, agent.y], dtype=numpy.float32),
+            "opponent_coords": numpy.array([opponent.x, opponent.y], dtype=numpy.float32),
+            "agent_action": agent.action.value,
+            "opponent_action": opponent.action.value,
+            "agent_facing": agent.facing,
+            "opponent_facing": opponent.facing,
+            "agent_percent": numpy.array([agent.percent], dtype=numpy.int32),
+            "opponent_percent": numpy.array([opponent.percent], dtype=numpy.int32),
+            "agent_action_frame": numpy.array([agent.action_frame], dtype=numpy.int32),
+            "opponent_action_frame": numpy.array([opponent.action_frame], dtype=numpy.int32),
+            "agent_off_stage": agent.off_stage
         }
     
+    # Writes the frame into the ring buffer and returns the stacked observation. Nothing gets allocated here. The returned array is
+    # a view into the buffer, so it changes on the next step; stable_baselines3 copies observations as it stores them anyway.
+    def _get_flat_obs(self, gamestate: melee.GameState, new_episode: bool):
+        agent = gamestate.players[self.agent_port]
+        opponent = gamestate.players[self.opponent_port]
+        self._newest = (self._newest + 1) % self.frame_stack
+        row = self._frames[self._newest]
+        # The order here has to match FLAT_OBSERVATION.
+        row[:] = (
+            agent.x/POSITION_SCALE, agent.y/POSITION_SCALE,
+            opponent.x/POSITION_SCALE, opponent.y/POSITION_SCALE,
+            agent.action.value/FLAT_ACTION_SCALE, opponent.action.value/FLAT_ACTION_SCALE,
+            agent.facing, opponent.facing,
+            agent.percent/PERCENT_SCALE, opponent.percent/PERCENT_SCALE,
+            agent.action_frame/ACTION_FRAME_SCALE, opponent.action_frame/ACTION_FRAME_SCALE,
+            agent.off_stage,
+        )
+        if new_episode:
+            # Pretend the first frame has been there the whole time.
+            self._frames[:] = row
+        else:
+            self._frames[self._newest + self.frame_stack] = row
+        start = self._newest + 1
+        return self._frames[start:start + self.frame_stack].reshape(-1)
+
     def step(self, action):
-        # Agent makes one input in the space at each step.
+        # Agent makes one input in the space at each step. It's held for action_repeat frames.
         self._execute_action(action)
 
-        # Game advances one step to evaluate that action.
-        gamestate = self.console.step()
+        reward = 0
+        done = False
+        # The last frame the game was still going, for the stock counts. Once it's over the menus don't have them.
+        last_in_game = self.current_state
+        for frame in range(self.action_repeat):
+            # Game advances one step to evaluate that action.
+            gamestate = self.console.step()
 
-        # If the game is not active, then set the Done value to True.
-        if gamestate.menu_state not in [melee.Menu.IN_GAME, melee.Menu.SUDDEN_DEATH]:
-            done = True
-        else:
-            done = False
+            # If the game is not active, then set the Done value to True.
+            if gamestate.menu_state not in [melee.Menu.IN_GAME, melee.Menu.SUDDEN_DEATH]:
+                done = True
+            else:
+                last_in_game = gamestate
 
-        reward = self._calculate_reward(gamestate)
+            reward += self._calculate_reward(gamestate)
+            # Losing a stock ends the repeat early, so the agent gets to make its next decision as soon as it's back.
+            lost_stock = gamestate.players[self.agent_port].stock < self.current_state.players[self.agent_port].stock
 
-        # We never got far enough into this approach to figure out what to do with this variable.
-        info = {}
-        
-        # Update historical data.
-        self.current_state = gamestate
+            # Update historical data.
+            self.current_state = gamestate
+            if done or lost_stock:
+                break
+
+        # We never got far enough into this approach to figure out what to do with this variable. It does say how many frames the
+        # action was actually held for, though, and how many stocks each player has left, which is how SmashEvaluator.py tells
+        # who won.
+        info = {"frames": frame + 1, "agent_stock": last_in_game.players[self.agent_port].stock,
+                "opponent_stock": last_in_game.players[self.opponent_port].stock}
 
         return self._get_obs(gamestate), reward, done, False, info
     
@@ -115,31 +226,75 @@ class CustomGame(gymnasium.Env):
         selected_move = self.possible_moves[action]
         self.controller.simple_press(selected_move[1][0], selected_move[1][1], selected_move[0])
     
+    # This runs on every single frame, so it sticks to plain arithmetic. SmashOffline.calculate_rewards() is the same thing for
+    # whole arrays of frames, and test_SmashOffline.py checks that the two agree.
     def _calculate_reward(self, gamestate: melee.GameState):
-        KNOCKOUT_REWARD = 1000
-        OFF_STAGE_PENALTY = 10
-        
+        agent = gamestate.players[self.agent_port]
+        opponent = gamestate.players[self.opponent_port]
+        previous_agent = self.current_state.players[self.agent_port]
+        previous_opponent = self.current_state.players[self.opponent_port]
+
         # Reward if action has caused a KO to the opponent
-        reward = KNOCKOUT_REWARD * (self.current_state.players[2].stock - gamestate.players[2].stock)
+        reward = KNOCKOUT_REWARD * (previous_opponent.stock - opponent.stock)
         # Penalize if action has caused a KO to the agent
-        reward -= KNOCKOUT_REWARD * (self.current_state.players[1].stock - gamestate.players[1].stock)
+        reward -= KNOCKOUT_REWARD * (previous_agent.stock - agent.stock)
 
         # If someone just KO'd, then their previous state will have higher percent than their current state (0%).
         # If that's the case, don't reward or penalize based on that.
         if reward == 0:
             # Reward if action has caused damage to opponent
-            reward += gamestate.players[2].percent - self.current_state.players[2].percent
+            reward += opponent.percent - previous_opponent.percent
             # Penalize if action has caused damage to agent
-            reward -= gamestate.players[1].percent - self.current_state.players[1].percent
+            reward -= agent.percent - previous_agent.percent
 
         # Penalize if agent is off the stage
-        if gamestate.players[1].off_stage:
+        if agent.off_stage:
             reward -= OFF_STAGE_PENALTY
 
         return reward
 
     
+    # Starts a new game. If the emulator from the last game is still up and connected, it just steers back through the menus from
+    # the post-game screen into a new match, which takes a few seconds at most. Dolphin only gets restarted the first time, when
+    # soft_reset is off, if the old one died or lost its connection, or if the menus don't get us into a game within
+    # menu_timeout_frames. A fresh Dolphin gets the same amount of time, and is restarted up to launch_attempts times in all. The
+    # info dict says how long the reset took and which kind it was.
     def reset(self, seed=None, options=None):
+        start = time.perf_counter()
+        soft = self.soft_reset and self._console_healthy()
+        gamestate = self._navigate_to_game(self.menu_timeout_frames) if soft else None
+        if gamestate is None:
+            soft = False
+            for attempt in range(self.launch_attempts):
+                self._launch()
+                gamestate = self._navigate_to_game(self.menu_timeout_frames)
+                if gamestate is not None:
+                    break
+            else:
+                raise RuntimeError(f"Couldn't get into a game after starting Dolphin {self.launch_attempts} times. Each time, either "
+                                   f"the connection dropped or menu_timeout_frames ({self.menu_timeout_frames}) frames went by "
+                                   f"in the menus.")
+        self.current_state = gamestate
+
+        self.last_reset_seconds = time.perf_counter() - start
+        if soft:
+            self.soft_resets += 1
+        else:
+            self.hard_resets += 1
+        return (self._get_obs(self.current_state, new_episode=True), {"reset_seconds": self.last_reset_seconds, "soft_reset": soft})
+
+    # Whether the emulator from the last game is still running and connected. A game that's still going doesn't count, since
+    # there's no reliable way to back out of a match from here, so that gets a fresh Dolphin too.
+    def _console_healthy(self):
+        if self.console is None or self.current_state is None or not self.console.connected:
+            return False
+        if self.current_state.menu_state in [melee.Menu.IN_GAME, melee.Menu.SUDDEN_DEATH]:
+            return False
+        process = getattr(self.console, "_process", None)
+        return process is None or process.poll() is None
+
+    # Shuts down the old emulator if there is one, then starts and connects to a new one.
+    def _launch(self):
         # There was some weird stuff going on with the emulator struggling to load, which caused the new instance to fail to connect.
         # This sleep call function made it work, so that's why it's here.
         if self.console:
@@ -147,19 +302,16 @@ class CustomGame(gymnasium.Env):
             stop(self.console)
             time.sleep(1)
 
-        # This code is only going to work on windows, but it'll get the default install directory for Slippi's Dolphin instance and set
-        # it as the path in our melee.Console object.
-        homeDirectory = os.path.expanduser('~'+os.environ.get("USERNAME"))
-        self.console = melee.Console(path=homeDirectory+"\\AppData\\Roaming\\Slippi Launcher\\netplay", slippi_address="127.0.0.1")
+        self.console = self.console_factory(self.slippi_port)
 
         # Agent controller config.
-        self.controller = melee.Controller(console=self.console, port=1)
+        self.controller = melee.Controller(console=self.console, port=self.agent_port)
         # This controller will be used to select an in-game bot to train against.
-        self.opponent_controller = melee.Controller(console=self.console, port=2)
+        self.opponent_controller = melee.Controller(console=self.console, port=self.opponent_port)
 
         # Start the emulator and connect to it. Put the game in the same directory as this file for this to work. The /b flag may or may not
         # be helping with the failing to connect bug, but I don't want to try removing it to see if it's necessary or not so it's staying there.
-        self.console.run("./ssb.iso", environment_vars={"/b": "true"})
+        self.console.run(self.iso_path, environment_vars={"/b": "true"})
         # Again, helps with the failing to connect bug.
         time.sleep(3)
         # Connects agent to the emulator.
@@ -169,25 +321,39 @@ class CustomGame(gymnasium.Env):
         self.controller.connect()
         self.opponent_controller.connect()
 
-        while True:
+    # Steps through the menus until a match starts, and returns its first frame. Works from the post-game screen as well as from a
+    # freshly started emulator. Returns None if the connection drops, or if max_frames go by without getting into a game.
+    def _navigate_to_game(self, max_frames: int = None):
+        frames = 0
+        while max_frames is None or frames < max_frames:
             # Advance one frame.
-            self.current_state = self.console.step()
+            gamestate = self.console.step()
+            frames += 1
+            if gamestate is None:
+                return None
             # We're now in-game, so finish our reset.
-            if self.current_state.menu_state in [melee.Menu.IN_GAME, melee.Menu.SUDDEN_DEATH]:
-                return (self._get_obs(self.current_state), {})
+            if gamestate.menu_state in [melee.Menu.IN_GAME, melee.Menu.SUDDEN_DEATH]:
+                return gamestate
             else:
-                # Navigate the menus before we start our game.
+                # Navigate the menus before we start our game. menu_helper_simple also skips past the post-game screen.
                 melee.MenuHelper.choose_character(melee.Character.FOX,
-                    self.current_state,
+                    gamestate,
                     self.opponent_controller,
                     cpu_level=9,
                     costume=0,
                     swag=False)
-                melee.MenuHelper.menu_helper_simple(self.current_state,
+                melee.MenuHelper.menu_helper_simple(gamestate,
                     self.controller,
                     melee.Character.JIGGLYPUFF,
                     melee.Stage.BATTLEFIELD,
-                    melee.gamestate.port_detector(self.current_state, melee.Character.JIGGLYPUFF, 0),
+                    melee.gamestate.port_detector(gamestate, melee.Character.JIGGLYPUFF, 0),
                     costume=0,
                     autostart=True,
-                    swag=False)
\ No newline at end of file
+                    swag=False)
+        return None
+
+    # Shuts down the emulator. Vectorized environments call this on every worker when they close.
+    def close(self):
+        if self.console:
+            stop(self.console)
+            self.console = None
@@ -0,0 +1,261 @@
+# Every RL experiment used to need a live Dolphin running at real time speed, even though we already had tens of thousands of parsed
+# replays sitting on disk. This file turns the output of BCNetDataGenerator.py into RL transitions, (observation, action, reward,
+# next observation, done, truncated), so that an agent can be pretrained or trained offline without an emulator at all.
+#
+# The transitions are CustomGame steps, with the observation_mode, frame_stack and action_repeat from SmashTrainer.py. Each one
+# starts on a frame the agent would make a decision on and ends action_repeat frames later, or sooner if the agent loses a stock
+# in the meantime, just like CustomGame.step() does.
+#
+#   - Observations are the same as CustomGame's, in either observation mode, with the stacked frames being earlier decisions.
+#   - Actions are whichever of CustomGame's possible_moves is closest to what the player actually did on the decision frame: the
+#     first of B, A, Z and shield (L) they were holding, if any, and the nearest of the 17 stick positions to their main stick.
+#   - Rewards are CustomGame's, worked out for every frame at once by calculate_rewards() below and added up over each step.
+#     They come from how many stocks each player lost and how much their percent changed since the last frame. Stock counts are
+#     saved alongside the parsed data now. Games parsed before that don't have them, so for those a stock counts as lost on the
+#     frame a player goes into one of the dead actions, which won't always line up with what CustomGame would have given.
+#   - done is set on the last transition of each game.
+#
+# Starting the decisions on frame 0 is only one of action_repeat ways a game could have been split into steps, so each of the
+# others gets used as well, starting on frames 1, 2 and so on. Those stop at the agent's first KO, since CustomGame makes its next
+# decision right on that frame, which lines every split up with the one from frame 0 from there on. Their last transition is
+# marked truncated rather than done. On top of that, each game gets used from both players' points of view, since both
+# players' inputs are in there. The transitions are written to .npz files in output_directory, games_per_file games to a file.
+# OfflineGame plays them back as a Gym environment.
+
+import os
+import numpy
+import gymnasium
+from BCDataPipeline import find_replays
+from CompactCodec import as_x_features, as_y_features
+from FeatureEncoder import X_FEATURES, Y_FEATURES, POSITION_SCALE, PERCENT_SCALE, ACTION_SCALE, ACTION_FRAME_SCALE
+from SmashGym import CustomGame, FLAT_OBSERVATION, FLAT_ACTION_SCALE, STICK_POSITIONS, KNOCKOUT_REWARD, OFF_STAGE_PENALTY
+from SmashTrainer import observation_mode, frame_stack, action_repeat
+
+load_directory = "D:\\smashdataset\\parseddata\\"
+output_directory = "D:\\smashdataset\\transitions\\"
+games_per_file = 500
+
+# The X column for each p1 feature, with its p2 counterpart swapped in and vice versa. Indexing X with this gives the same frame
+# from the second player's point of view.
+_SWAP_PLAYERS = [X_FEATURES.index(name.replace("p1_", "p@_").replace("p2_", "p1_").replace("p@_", "p2_")) for name in X_FEATURES]
+_COLUMNS = {name: X_FEATURES.index(name) for name in X_FEATURES}
+# The X column behind each entry of the flat observation.
+_FLAT_COLUMNS = [_COLUMNS[name.replace("agent_", "p1_").replace("opponent_", "p2_")] for name in FLAT_OBSERVATION]
+# Every action ID up to here is one of the dead actions (DEAD_DOWN through DEAD_FLY_SPLATTER_FLAT_ICE).
+_LAST_DEAD_ACTION = 10
+_STICKS = numpy.array(STICK_POSITIONS, dtype=numpy.float32)
+# Y columns for the buttons in possible_moves, in the same order: B, A, Z, L. The last button, None, is for holding none of them.
+_MOVE_BUTTONS = [Y_FEATURES.index(name) for name in ("b", "a", "z", "shield")]
+_MAIN_STICK = [Y_FEATURES.index("main_x"), Y_FEATURES.index("main_y")]
+
+
+# Converts controller data into the index of the closest move in CustomGame's possible_moves.
+def move_indices(y: numpy.ndarray):
+    pressed = y[:, _MOVE_BUTTONS] > 0.5
+    # argmax finds the first button being held. If none are, it's the last button, None.
+    buttons = numpy.where(pressed.any(axis=1), pressed.argmax(axis=1), len(_MOVE_BUTTONS))
+    distances = ((y[:, None, _MAIN_STICK] - _STICKS[None]) ** 2).sum(axis=2)
+    return (buttons * len(_STICKS) + distances.argmin(axis=1)).astype(numpy.int64)
+
+
+# Builds one observation per frame of a game, in the given mode, from X data.
+def observations(x: numpy.ndarray, observation_mode: str = "flat", frame_stack: int = 1):
+    actions = numpy.rint(x[:, [_COLUMNS["p1_action"], _COLUMNS["p2_action"]]] * ACTION_SCALE)
+    if observation_mode == "flat":
+        frames = x[:, _FLAT_COLUMNS].astype(numpy.float32)
+        frames[:, [FLAT_OBSERVATION.index("agent_action"), FLAT_OBSERVATION.index("opponent_action")]] = actions / FLAT_ACTION_SCALE
+        # Frame t's observation is frames t - frame_stack + 1 through t, oldest first, with the first frame of the game standing
+        # in for frames before it started, just like CustomGame does.
+        rows = numpy.maximum(numpy.arange(len(x))[:, None] - numpy.arange(frame_stack - 1, -1, -1)[None], 0)
+        return frames[rows].reshape(len(x), -1)
+
+    def column(name: str, scale: float, dtype):
+        return numpy.rint(x[:, _COLUMNS[name]] * scale).astype(dtype)
+
+    return {
+        "agent_coords": (x[:, [_COLUMNS["p1_x"], _COLUMNS["p1_y"]]] * POSITION_SCALE).astype(numpy.float32),
+        "opponent_coords": (x[:, [_COLUMNS["p2_x"], _COLUMNS["p2_y"]]] * POSITION_SCALE).astype(numpy.float32),
+        "agent_action": actions[:, 0].astype(numpy.int64),
+        "opponent_action": actions[:, 1].astype(numpy.int64),
+        "agent_facing": column("p1_facing", 1, numpy.int64),
+        "opponent_facing": column("p2_facing", 1, numpy.int64),
+        "agent_percent": column("p1_percent", PERCENT_SCALE, numpy.int32)[:, None],
+        "opponent_percent": column("p2_percent", PERCENT_SCALE, numpy.int32)[:, None],
+        "agent_action_frame": column("p1_action_frame", ACTION_FRAME_SCALE, numpy.int32)[:, None],
+        "opponent_action_frame": column("p2_action_frame", ACTION_FRAME_SCALE, numpy.int32)[:, None],
+        "agent_off_stage": column("p1_off_stage", 1, numpy.int64),
+    }
+
+
+# CustomGame._calculate_reward() for whole arrays of frames: each argument has one entry per frame, saying what changed since the
+# frame before it.
+def calculate_rewards(agent_stocks_lost, opponent_stocks_lost, agent_damage, opponent_damage, agent_off_stage):
+    # A KO either way, and no damage counted on that frame, since whoever got KO'd is back at 0%.
+    reward = KNOCKOUT_REWARD * (opponent_stocks_lost - agent_stocks_lost)
+    reward = numpy.where(reward == 0, opponent_damage - agent_damage, reward)
+    return reward - OFF_STAGE_PENALTY * agent_off_stage
+
+
+# How many stocks (p1, p2) lost going into each frame after the first. stocks is each frame's (p1, p2) stock counts, the way
+# BCNetDataGenerator.py saves them.
+def _stocks_lost(x: numpy.ndarray, stocks: numpy.ndarray = None):
+    if stocks is not None:
+        return -numpy.diff(numpy.asarray(stocks, dtype=numpy.int64), axis=0)
+    dead = numpy.rint(x[:, [_COLUMNS["p1_action"], _COLUMNS["p2_action"]]] * ACTION_SCALE) <= _LAST_DEAD_ACTION
+    # A stock is lost going from a frame where the player is alive to one where they're dead.
+    return (dead[1:] & ~dead[:-1]).astype(numpy.int64)
+
+
+# The reward going into every frame of a game after the first, from p1's point of view.
+def game_rewards(x: numpy.ndarray, stocks: numpy.ndarray = None):
+    stocks_lost = _stocks_lost(x, stocks)
+    # Percents are whole numbers, so rounding gets back exactly what the game had. The drop when a player respawns goes in as
+    # is, same as in CustomGame; calculate_rewards() ignores it when there's a KO on that frame anyway.
+    percents = numpy.rint(x[:, [_COLUMNS["p1_percent"], _COLUMNS["p2_percent"]]] * PERCENT_SCALE)
+    damage = numpy.diff(percents, axis=0)
+    return calculate_rewards(stocks_lost[:, 0], stocks_lost[:, 1], damage[:, 0], damage[:, 1],
+                             x[1:, _COLUMNS["p1_off_stage"]]).astype(numpy.float32)
+
+
+# The frames CustomGame would have had p1 make decisions on if the game had started on frame `offset`, followed by the frame the
+# last decision's step ends on. Every step is action_repeat frames long, except that one ends as soon as p1 loses a stock, and
+# the last one ends with the game. With an offset, they stop at p1's first KO (see the top of the file).
+def decision_frames(x: numpy.ndarray, action_repeat: int, offset: int = 0, stocks: numpy.ndarray = None):
+    last = len(x) - 1
+    knockouts = numpy.flatnonzero(_stocks_lost(x, stocks)[:, 0] > 0) + 1
+    knockouts = knockouts[knockouts < last]
+    if offset == 0:
+        edges = numpy.concatenate([[0], knockouts, [last]])
+    else:
+        stop = knockouts[0] if len(knockouts) else last
+        if stop <= offset:
+            return numpy.zeros(0, dtype=numpy.int64)
+        edges = numpy.array([offset, stop])
+    starts = [numpy.arange(start, end, action_repeat) for start, end in zip(edges[:-1], edges[1:])]
+    return numpy.concatenate(starts + [edges[-1:]]).astype(numpy.int64)
+
+
+# Every transition in one game, from p1's point of view, with y being p1's controller data. For p2's point of view, pass
+# x[:, _SWAP_PLAYERS], p2's controller data and stocks[:, ::-1]. Returns a list of (observations, actions, rewards, next
+# observations, dones, truncated), one for each offset the game can be split into steps from.
+def game_transitions(x: numpy.ndarray, y: numpy.ndarray, observation_mode: str = observation_mode,
+                     frame_stack: int = frame_stack, action_repeat: int = action_repeat, stocks: numpy.ndarray = None):
+    rewards = game_rewards(x, stocks)
+    parts = []
+    for offset in range(action_repeat):
+        frames = decision_frames(x, action_repeat, offset, stocks)
+        if len(frames) < 2:
+            continue
+        starts, stop = frames[:-1], frames[-1]
+        steps = observations(x[frames], observation_mode, frame_stack)
+        if observation_mode == "flat":
+            obs, next_obs = steps[:-1], steps[1:]
+        else:
+            obs = {key: value[:-1] for key, value in steps.items()}
+            next_obs = {key: value[1:] for key, value in steps.items()}
+        # rewards[frame] is the reward going into frame + 1, so each step gets rewards[start] up to the next step's start.
+        step_rewards = numpy.add.reduceat(rewards[:stop], starts).astype(numpy.float32)
+        dones = numpy.zeros(len(starts), dtype=bool)
+        truncated = numpy.zeros(len(starts), dtype=bool)
+        (dones if stop == len(x) - 1 else truncated)[-1] = True
+        parts.append((obs, move_indices(y[starts]), step_rewards, next_obs, dones, truncated))
+    return parts
+
+
+# Sticks a list of per-game transitions together and saves them. Dict observations get one array per key, named obs_<key> and
+# next_obs_<key>.
+def save_transitions(path: str, transitions: list):
+    obs, actions, rewards, next_obs, dones, truncated = zip(*transitions)
+    arrays = {"actions": numpy.concatenate(actions), "rewards": numpy.concatenate(rewards), "dones": numpy.concatenate(dones),
+              "truncated": numpy.concatenate(truncated)}
+    for name, values in (("obs", obs), ("next_obs", next_obs)):
+        if isinstance(values[0], dict):
+            for key in values[0]:
+                arrays[f"{name}_{key}"] = numpy.concatenate([value[key] for value in values])
+        else:
+            arrays[name] = numpy.concatenate(values)
+    numpy.savez(path, **arrays)
+
+
+# Loads a file written by save_transitions. Returns (observations, actions, rewards, next observations, dones, truncated).
+# Files from before truncated was saved have nothing truncated.
+def load_transitions(path: str):
+    with numpy.load(path) as saved:
+        arrays = {name: saved[name] for name in saved.files}
+    transitions = []
+    for name in ("obs", "next_obs"):
+        if name in arrays:
+            transitions.append(arrays[name])
+        else:
+            transitions.append({key[len(name) + 1:]: value for key, value in arrays.items() if key.startswith(f"{name}_")})
+    truncated = arrays.get("truncated", numpy.zeros_like(arrays["dones"]))
+    return transitions[0], arrays["actions"], arrays["rewards"], transitions[1], arrays["dones"], truncated
+
+
+# Plays back saved transitions as a Gym environment with the same spaces as CustomGame, one game after another, as fast as the
+# arrays can be indexed. The actions passed to step() don't change anything, since what happened is already decided; the action
+# the player actually took is in info["logged_action"], which is what an offline algorithm should learn from.
+class OfflineGame(gymnasium.Env):
+    def __init__(self, path: str, observation_mode: str = observation_mode, frame_stack: int = frame_stack):
+        spaces = CustomGame(console_factory=None, observation_mode=observation_mode, frame_stack=frame_stack)
+        self.observation_space = spaces.observation_space
+        self.action_space = spaces.action_space
+        self.obs, self.actions, self.rewards, self.next_obs, self.dones, self.truncated = load_transitions(path)
+        # Where each run of transitions ends, whether the game ended there or not.
+        self.ends = self.dones | self.truncated
+        self.position = 0
+
+    def _observation(self, observations, row: int):
+        if isinstance(observations, dict):
+            return {key: value[row] for key, value in observations.items()}
+        return observations[row]
+
+    # Starts the next game, going back to the first one after the last. Resetting partway through a game skips the rest of it.
+    def reset(self, seed=None, options=None):
+        super().reset(seed=seed)
+        if self.position > 0 and not self.ends[self.position - 1]:
+            self.position += int(numpy.argmax(self.ends[self.position:])) + 1
+        if self.position >= len(self.actions):
+            self.position = 0
+        return self._observation(self.obs, self.position), {}
+
+    def step(self, action):
+        row = self.position
+        self.position += 1
+        return (self._observation(self.next_obs, row), float(self.rewards[row]), bool(self.dones[row]), bool(self.truncated[row]),
+                {"logged_action": int(self.actions[row])})
+
+
+if __name__ == "__main__":
+    os.makedirs(output_directory, exist_ok=True)
+    transitions = []
+    file_number = 0
+    games = 0
+    count = 0
+    guessed = 0
+    for game_id, p1_character, p2_character, x, y0, y1, stocks in find_replays(load_directory):
+        x = as_x_features(numpy.asarray(x))
+        if len(x) < 2 * action_repeat or len(x) != len(y0) or len(x) != len(y1):
+            continue
+        if stocks is None:
+            guessed += 1
+        else:
+            stocks = numpy.asarray(stocks)
+        # Once from each player's point of view.
+        parts = game_transitions(x, as_y_features(numpy.asarray(y0)), stocks=stocks)
+        parts += game_transitions(x[:, _SWAP_PLAYERS], as_y_features(numpy.asarray(y1)),
+                                  stocks=None if stocks is None else stocks[:, ::-1])
+        transitions.extend(parts)
+        games += 1
+        count += sum(len(part[1]) for part in parts)
+        if games % games_per_file == 0:
+            save_transitions(os.path.join(output_directory, f"transitions_{file_number}.npz"), transitions)
+            file_number += 1
+            transitions = []
+    if transitions:
+        save_transitions(os.path.join(output_directory, f"transitions_{file_number}.npz"), transitions)
+        file_number += 1
+    print(f"{count} transitions from {games} games written to {file_number} files in {output_directory}.")
+    if guessed:
+        print(f"{guessed} of those games were parsed without stock counts, so their KOs were guessed from the dead actions. "
+              f"Parse them again with BCNetDataGenerator.py to get rewards that match CustomGame's.")
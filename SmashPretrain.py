@@ -0,0 +1,224 @@
+# PPO in SmashTrainer.py starts from a policy that mashes random buttons, and it took millions of frames of real time emulation
+# before it did anything that looked like playing. This file gives it a head start: before any RL happens, the PPO policy is
+# trained to copy what the human players in the replay dataset did, the same idea as the BC network in BCNeuralNetwork.py but
+# with PPO's own network and action space, so RL can pick up straight from there.
+#
+#   - The demonstrations come from the output of BCNetDataGenerator.py. Each frame becomes an observation in whatever mode
+#     SmashTrainer.py uses, and what the player did becomes the closest of CustomGame's possible_moves, exactly as in
+#     SmashOffline.py. Every game is used from both players' points of view.
+#   - The agent only decides every action_repeat frames, so its stacked frames are that far apart. The demonstrations are taken
+#     the same way, every action_repeat-th frame, once for each starting offset so no frames go to waste.
+#   - The actor is fit by maximizing the log probability of the human's move (plus a little entropy, so it isn't completely sure
+#     of itself when RL starts). The critic is fit at the same time to the discounted return that followed each frame, using the
+#     same rewards as CustomGame, so PPO's advantages aren't garbage for the first few updates either.
+#
+# A tenth of the games are held out to report how often the pretrained policy picks the same move as the human. The pretrained
+# model is saved to pretrained_path; set warm_start_path in SmashTrainer.py to it to start training from there.
+#
+# To see whether it's worth it, set compare_steps to True. Both the pretrained model and a fresh one are trained with PPO until
+# their average episode reward over the last reward_window episodes reaches target_reward (or max_timesteps runs out), and the
+# difference in environment steps is what pretraining saved. That needs the emulator, and a lot of it, so it's off by default.
+# Results go to pretrain_report.json.
+
+import os
+import json
+import numpy
+import torch
+from stable_baselines3 import PPO
+from stable_baselines3.common.callbacks import BaseCallback
+from BCDataPipeline import find_replays
+from CompactCodec import as_x_features, as_y_features
+from SmashOffline import _SWAP_PLAYERS, move_indices, observations, game_rewards
+from SmashTrainer import env_count, observation_mode, frame_stack, action_repeat, policy, model_directory
+
+load_directory = "D:\\smashdataset\\parseddata\\"
+pretrained_path = f"{model_directory}/Pretrained"
+report_path = "pretrain_report.json"
+# How many games to pretrain on. None uses all of them, which is a lot of memory in dict mode.
+max_games = 2000
+epochs = 5
+batch_size = 1024
+learning_rate = 3e-4
+# A little entropy keeps some randomness in the policy for PPO to explore with.
+entropy_coefficient = 0.01
+value_coefficient = 0.5
+# Should match PPO's gamma.
+gamma = 0.99
+validation_fraction = 0.1
+# Set to True to measure how many environment steps pretraining saves, which runs PPO twice in the emulator.
+compare_steps = False
+target_reward = 50.0
+reward_window = 20
+max_timesteps = 2_000_000
+
+
+# Discounted return from every decision to the end of the game.
+def discounted_returns(rewards: numpy.ndarray, gamma: float):
+    returns = numpy.empty(len(rewards), dtype=numpy.float32)
+    running = 0.0
+    for index in range(len(rewards) - 1, -1, -1):
+        running = rewards[index] + gamma * running
+        returns[index] = running
+    return returns
+
+
+# The (observations, actions, returns) for one game from p1's point of view, taking every action_repeat-th frame.
+def game_demonstrations(x: numpy.ndarray, y: numpy.ndarray, observation_mode: str, frame_stack: int, action_repeat: int,
+                        stocks: numpy.ndarray = None):
+    parts = []
+    for offset in range(action_repeat):
+        frames = x[offset::action_repeat]
+        if len(frames) < 2:
+            continue
+        # The reward for a decision is everything that happened over the frames it was held for. The last decision can come on
+        # the very last frame, with nothing after it.
+        frame_rewards = game_rewards(x[offset:], None if stocks is None else stocks[offset:])
+        held = numpy.add.reduceat(frame_rewards, numpy.arange(0, len(x) - offset - 1, action_repeat))
+        rewards = numpy.zeros(len(frames), dtype=numpy.float32)
+        rewards[:len(held)] = held
+        # PPO discounts by gamma once per decision, however many frames that is.
+        parts.append((observations(frames, observation_mode, frame_stack), move_indices(y[offset::action_repeat]),
+                      discounted_returns(rewards, gamma)))
+    return parts
+
+
+def _concatenate(values: list):
+    if isinstance(values[0], dict):
+        return {key: numpy.concatenate([value[key] for value in values]) for key in values[0]}
+    return numpy.concatenate(values)
+
+
+# Loads up to max_games games as demonstrations, split by game into training and validation sets. Each set is (observations,
+# actions, returns).
+def load_demonstrations(load_directory: str, max_games: int = None, validation_fraction: float = 0.1, seed: int = 20):
+    random = numpy.random.default_rng(seed)
+    training, validation = [], []
+    games = 0
+    for game_id, p1_character, p2_character, x, y0, y1, stocks in find_replays(load_directory):
+        x = as_x_features(numpy.asarray(x))
+        if len(x) < 2 * action_repeat or len(x) != len(y0) or len(x) != len(y1):
+            continue
+        stocks = None if stocks is None else numpy.asarray(stocks)
+        parts = game_demonstrations(x, as_y_features(numpy.asarray(y0)), observation_mode, frame_stack, action_repeat, stocks)
+        parts += game_demonstrations(x[:, _SWAP_PLAYERS], as_y_features(numpy.asarray(y1)), observation_mode, frame_stack,
+                                     action_repeat, None if stocks is None else stocks[:, ::-1])
+        (validation if random.random() < validation_fraction else training).extend(parts)
+        games += 1
+        if max_games is not None and games >= max_games:
+            break
+    return tuple(tuple(_concatenate(list(values)) for values in zip(*parts)) for parts in (training, validation))
+
+
+def _rows(obs, rows: numpy.ndarray):
+    if isinstance(obs, dict):
+        return {key: value[rows] for key, value in obs.items()}
+    return obs[rows]
+
+
+# Trains the policy's actor to pick the human's moves and its critic to predict the returns, in place. Returns how often the
+# policy's most likely move matched the human's on the validation set after each epoch.
+def pretrain(model: PPO, training: tuple, validation: tuple, epochs: int = epochs, batch_size: int = batch_size,
+             learning_rate: float = learning_rate):
+    obs, actions, returns = training
+    policy_network = model.policy
+    optimizer = torch.optim.Adam(policy_network.parameters(), lr=learning_rate)
+    random = numpy.random.default_rng(0)
+    accuracies = []
+    for epoch in range(epochs):
+        policy_network.set_training_mode(True)
+        order = random.permutation(len(actions))
+        total_loss = 0.0
+        for start in range(0, len(order), batch_size):
+            rows = order[start:start + batch_size]
+            observation_tensor, _ = policy_network.obs_to_tensor(_rows(obs, rows))
+            action_tensor = torch.as_tensor(actions[rows], device=policy_network.device)
+            return_tensor = torch.as_tensor(returns[rows], device=policy_network.device)
+            values, log_probabilities, entropy = policy_network.evaluate_actions(observation_tensor, action_tensor)
+            loss = (-log_probabilities.mean() - entropy_coefficient * entropy.mean()
+                    + value_coefficient * torch.nn.functional.mse_loss(values.flatten(), return_tensor))
+            optimizer.zero_grad()
+            loss.backward()
+            torch.nn.utils.clip_grad_norm_(policy_network.parameters(), model.max_grad_norm)
+            optimizer.step()
+            total_loss += loss.item() * len(rows)
+        accuracies.append(move_accuracy(model, validation))
+        print(f"Epoch {epoch + 1}/{epochs}: loss {total_loss / len(order):.4f}, validation accuracy {accuracies[-1]:.3f}")
+    policy_network.set_training_mode(False)
+    return accuracies
+
+
+# How often the policy's most likely move is the one the human made.
+def move_accuracy(model: PPO, demonstrations: tuple, batch_size: int = 4096):
+    obs, actions, returns = demonstrations
+    if len(actions) == 0:
+        return float("nan")
+    matches = 0
+    for start in range(0, len(actions), batch_size):
+        rows = numpy.arange(start, min(start + batch_size, len(actions)))
+        predicted, _ = model.predict(_rows(obs, rows), deterministic=True)
+        matches += int((predicted == actions[rows]).sum())
+    return matches / len(actions)
+
+
+# Stops training once the average reward over the last `window` finished episodes reaches `target`, and remembers how many
+# environment steps that took. Needs the environment wrapped in a Monitor, which SmashVecEnv.make_game does.
+class TargetRewardCallback(BaseCallback):
+    def __init__(self, target: float, window: int):
+        super().__init__()
+        self.target = target
+        self.window = window
+        self.steps_to_target = None
+
+    def _on_step(self):
+        episodes = self.model.ep_info_buffer
+        if len(episodes) >= self.window:
+            rewards = [episode["r"] for episode in list(episodes)[-self.window:]]
+            if numpy.mean(rewards) >= self.target:
+                self.steps_to_target = self.num_timesteps
+                return False
+        return True
+
+
+# Trains with PPO until the target reward, and returns how many steps it took, or None if it never got there.
+def steps_to_target(model: PPO, target: float = target_reward, window: int = reward_window, timesteps: int = max_timesteps):
+    callback = TargetRewardCallback(target, window)
+    model.learn(total_timesteps=timesteps, callback=callback)
+    return callback.steps_to_target
+
+
+def make_env():
+    from SmashVecEnv import make_vec_env
+    return make_vec_env(env_count, backend="subproc" if env_count > 1 else "dummy", observation_mode=observation_mode,
+                        frame_stack=frame_stack, action_repeat=action_repeat)
+
+
+if __name__ == "__main__":
+    from SmashGym import CustomGame
+    training, validation = load_demonstrations(load_directory, max_games, validation_fraction)
+    print(f"{len(training[1])} training and {len(validation[1])} validation decisions.")
+
+    # Building the model only needs the environment's spaces, so a game that never starts Dolphin does for pretraining.
+    model = PPO(policy, CustomGame(console_factory=None, observation_mode=observation_mode, frame_stack=frame_stack), verbose=1)
+    report = {"untrained_accuracy": move_accuracy(model, validation)}
+    report["validation_accuracy"] = pretrain(model, training, validation)
+    os.makedirs(model_directory, exist_ok=True)
+    model.save(pretrained_path)
+    print(f"Saved the pretrained model to {pretrained_path}.")
+
+    if compare_steps:
+        env = make_env()
+        warm = PPO.load(pretrained_path, env=env)
+        report["warm_start_steps"] = steps_to_target(warm)
+        report["scratch_steps"] = steps_to_target(PPO(policy, env, verbose=1))
+        env.close()
+        report["target_reward"] = target_reward
+        if report["warm_start_steps"] is not None and report["scratch_steps"] is not None:
+            report["steps_saved"] = report["scratch_steps"] - report["warm_start_steps"]
+            print(f"Pretraining saved {report['steps_saved']} environment steps to reach an average reward of {target_reward} "
+                  f"({report['warm_start_steps']} against {report['scratch_steps']}).")
+        else:
+            print(f"Didn't reach an average reward of {target_reward} within {max_timesteps} steps: warm start "
+                  f"{report['warm_start_steps']}, from scratch {report['scratch_steps']}.")
+
+    with open(report_path, "w") as report_file:
+        json.dump(report, report_file, indent=2)
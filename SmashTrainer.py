@@ -9,34 +9,65 @@
 import gymnasium
 from gymnasium.envs.registration import register
 from SmashGym import CustomGame
-from stable_baselines3 import PPO
+from SmashVecEnv import make_vec_env
+from SmashCheckpoints import BackgroundSaver
 import os
 
 # For saving.
 model_directory = "models"
+# How many games to play at once, each in its own Dolphin (see SmashVecEnv.py). With more than one, PPO gets that many
+# transitions every frame instead of one.
+env_count = 1
+# "flat" packs the observation into one normalized vector so the lighter MlpPolicy can be used, optionally with the last few
+# frames stacked together. "dict" is the original observation, which needs MultiInputPolicy.
+observation_mode = "flat"
+frame_stack = 1
+# How many frames to hold each action for. The agent doesn't need 60 decisions a second, and this cuts the number of predictions
+# and the size of the rollout buffer by the same factor.
+action_repeat = 4
+policy = "MlpPolicy" if observation_mode == "flat" else "MultiInputPolicy"
+# A model pretrained on the replay dataset by SmashPretrain.py, to start from instead of a random policy. None starts from scratch.
+warm_start_path = None
 
-if not os.path.exists(model_directory):
-    os.makedirs(model_directory)
+# Everything below only runs when training. The worker processes for the games import this file too, and so do
+# SmashOffline.py, SmashPretrain.py and SmashEvaluator.py for the settings above, so stable_baselines3 is only imported here.
+if __name__ == "__main__":
+    from stable_baselines3 import PPO
 
-# Initialize our environment.
-env = CustomGame()
-env.reset()
+    if not os.path.exists(model_directory):
+        os.makedirs(model_directory)
 
-# Create our model.
-model = PPO("MultiInputPolicy", env, verbose=1)
-# Iterate many times through our space, learn the game. We never got around to adjusting these values because it wasn't
-# until we got this booted up for the first time that we realized how infeasible the concept was.
-for i in range(1,120):
-    model.learn(total_timesteps=100000)
-    model.save(f"{model_directory}/TestModel/{100000*i}")
+    # Initialize our environment.
+    if env_count > 1:
+        env = make_vec_env(env_count, observation_mode=observation_mode, frame_stack=frame_stack,
+                           action_repeat=action_repeat)
+    else:
+        env = CustomGame(observation_mode=observation_mode, frame_stack=frame_stack, action_repeat=action_repeat)
+        env.reset()
 
-episodes = 10
+    # Create our model.
+    if warm_start_path is not None:
+        model = PPO.load(warm_start_path, env=env, verbose=1)
+    else:
+        model = PPO(policy, env, verbose=1)
+    # Iterate many times through our space, learn the game. We never got around to adjusting these values because it wasn't
+    # until we got this booted up for the first time that we realized how infeasible the concept was. Checkpoints get written
+    # in the background (see SmashCheckpoints.py) so the games don't sit waiting on the disk, and the step count carries on from
+    # one round to the next so each checkpoint knows how far into training it is. Run SmashEvaluator.py alongside to score them
+    # as they come in.
+    saver = BackgroundSaver()
+    for i in range(1,120):
+        model.learn(total_timesteps=100000, reset_num_timesteps=False)
+        saver.save(model, f"{model_directory}/TestModel/{100000*i}")
+    saver.close()
 
-# Test out our agent and see how things went. We never actually got this far.
-for ep in range(episodes):
-    obs = env.reset
-    done = False
-    while not done:
-        obs, reward, done, info = env.step(env.action_space.sample())
+    episodes = 10
 
-env.close()
\ No newline at end of file
+    # Test out our agent and see how things went. The model keeps its environment wrapped up as a VecEnv, even with a single
+    # game, so this works the same either way.
+    from SmashEvaluator import evaluate
+    results = evaluate(model, model.get_env(), episodes)
+    print(f"Mean reward {results['mean_reward']:.1f} +- {results['std_reward']:.1f}, win rate {results['win_rate']} over "
+          f"{results['episodes']} games.")
+
+    env.close()
\ No newline at end of file
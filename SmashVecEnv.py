@@ -0,0 +1,46 @@
+# CustomGame drives a single Dolphin at real time speed, so PPO only ever got one transition per frame, and that's a big part of
+# why we gave up on the RL approach. This file runs several CustomGames at once, each in its own worker process with its own
+# Dolphin, and hands them to stable_baselines3 as one vectorized environment. PPO then gets a whole batch of observations every
+# frame, one from each game, and every emulator advances at the same time.
+#
+# stable_baselines3's SubprocVecEnv does the talking to the workers: step_async() sends every worker its action and returns
+# straight away, and step_wait() collects the results, so all the games step side by side and the trainer can get on with
+# something else in between. Setting backend to "dummy" runs every game one after another in this process instead, which is
+# handy for debugging.
+#
+# Every Dolphin that's running at once needs its own slippi_port, so game number i gets base_slippi_port + i. Workers are
+# started with "spawn", so console_factory has to be a function defined at the top level of a module that the workers can
+# import, like dolphin_console in SmashGym.py. Pass a stand-in console's factory to try all of this out without Dolphin.
+
+import functools
+from SmashGym import CustomGame, dolphin_console
+
+# Slippi's default port. Each game after the first gets the next one up.
+BASE_SLIPPI_PORT = 51441
+
+
+# Makes game number `index`. Runs inside the worker process.
+def make_game(index: int, console_factory=dolphin_console, base_slippi_port: int = BASE_SLIPPI_PORT, monitor: bool = True,
+              **game_options):
+    game = CustomGame(console_factory=console_factory, slippi_port=base_slippi_port + index, **game_options)
+    if monitor:
+        # Keeps track of each episode's length and total reward so they show up in PPO's logs.
+        from stable_baselines3.common.monitor import Monitor
+        game = Monitor(game)
+    return game
+
+
+# One function per game that makes it, which is what SubprocVecEnv wants.
+def game_factories(count: int, console_factory=dolphin_console, base_slippi_port: int = BASE_SLIPPI_PORT, **game_options):
+    return [functools.partial(make_game, index, console_factory, base_slippi_port, **game_options) for index in range(count)]
+
+
+# Makes `count` games and puts them together into one stable_baselines3 VecEnv. Anything in game_options goes to CustomGame.
+def make_vec_env(count: int, backend: str = "subproc", console_factory=dolphin_console,
+                 base_slippi_port: int = BASE_SLIPPI_PORT, **game_options):
+    from stable_baselines3.common.vec_env import DummyVecEnv, SubprocVecEnv
+    factories = game_factories(count, console_factory, base_slippi_port, **game_options)
+    if backend == "dummy":
+        return DummyVecEnv(factories)
+    # Each worker gets a clean Python rather than a copy of this one, which doesn't play well with Dolphin or the enet sockets.
+    return SubprocVecEnv(factories, start_method="spawn")
@@ -0,0 +1,27 @@
+# Checks that CompactCodec.py gives back the same X and Y data it was given. Run with `python -m pytest`.
+
+import melee
+import numpy
+from CompactCodec import encode_x, decode_x, encode_y, decode_y, as_x_features
+from FakeConsole import synthetic_gamestates
+from FeatureEncoder import ReplayFeatures, STAGE_SCALE, X_FEATURES
+
+
+def test_round_trip_is_exact():
+    gamestates = synthetic_gamestates(500)
+    stages = list(melee.Stage)
+    features = ReplayFeatures()
+    for frame, gamestate in enumerate(gamestates):
+        # Every stage, so none of them can come back even slightly off.
+        gamestate.stage = stages[frame % len(stages)]
+        features.append(gamestate, [1, 2])
+    x, y0, y1 = features.arrays()
+
+    decoded = as_x_features(encode_x(x))
+    stage = X_FEATURES.index("stage")
+    numpy.testing.assert_array_equal(decoded[:, stage], x[:, stage])
+    numpy.testing.assert_array_equal(decoded[:, stage],
+                                     numpy.float32([gamestate.stage.value / STAGE_SCALE for gamestate in gamestates]))
+    numpy.testing.assert_array_equal(decoded, x)
+    numpy.testing.assert_array_equal(decode_y(encode_y(y0)), y0)
+    numpy.testing.assert_array_equal(decode_y(encode_y(y1)), y1)
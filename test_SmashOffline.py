@@ -0,0 +1,107 @@
+# Checks that SmashOffline.py's rewards and transitions for a parsed game are the same ones CustomGame hands out while it's being
+# played, using FakeConsole.py instead of Dolphin. Run with `python -m pytest`.
+
+import copy
+import melee
+import numpy
+import pytest
+import SmashGym
+from FakeConsole import FakeConsole, FakeController, synthetic_gamestates
+from FeatureEncoder import ReplayFeatures
+from SmashGym import CustomGame
+from SmashOffline import game_rewards, game_transitions
+
+FRAMES = 400
+
+
+# Synthetic frames with percents and stocks that behave like a real game: percent only goes up until a player gets KO'd, then
+# they're down a stock and back at 0%. The second player's percent resets a frame after their stock goes, which is a plain
+# percent drop with no KO on that frame.
+def game_gamestates():
+    gamestates = synthetic_gamestates(FRAMES, seed=3)
+    random = numpy.random.default_rng(3)
+    knockouts = {1: (90, 250), 2: (170, 320)}
+    for port, frames in knockouts.items():
+        percent, stock = 0, 4
+        for frame, gamestate in enumerate(gamestates):
+            player = gamestate.players[port]
+            if frame in frames:
+                stock -= 1
+                if port == 1:
+                    percent = 0
+            elif port == 2 and frame - 1 in frames:
+                percent = 0
+            elif random.random() < 0.2:
+                percent += int(random.integers(1, 20))
+            player.percent = percent
+            player.stock = stock
+    return gamestates
+
+
+@pytest.fixture(autouse=True)
+def no_dolphin(monkeypatch):
+    monkeypatch.setattr(melee, "Controller", FakeController)
+    monkeypatch.setattr(SmashGym.time, "sleep", lambda seconds: None)
+
+
+def test_offline_rewards_match_custom_game():
+    gamestates = game_gamestates()
+    game = CustomGame(console_factory=lambda slippi_port: FakeConsole(None, at_end="none", gamestates=gamestates),
+                      observation_mode="flat")
+    game.reset()
+    # reset() takes the first frame, and every step after that is one more.
+    live = [game.step(0)[1] for frame in range(FRAMES - 1)]
+
+    features = ReplayFeatures()
+    for gamestate in gamestates:
+        features.append(gamestate, [game.agent_port, game.opponent_port])
+    x, y0, y1 = features.arrays()
+    offline = game_rewards(x, features.stock_counts())
+
+    numpy.testing.assert_allclose(offline, live, rtol=1e-5, atol=1e-5)
+    # Both KOs and both stocks lost show up, rather than being guessed at.
+    assert (offline >= SmashGym.KNOCKOUT_REWARD - 1).sum() == 2
+    assert (offline <= -SmashGym.KNOCKOUT_REWARD).sum() == 2
+
+
+def test_offline_transitions_match_custom_game_steps():
+    # The replay ends on the last frame of the game. Live, the console goes on to the results screen after that, which is how
+    # CustomGame knows the game is over; nothing changes on that frame, so it doesn't add anything to the reward.
+    gamestates = game_gamestates()
+    results = copy.deepcopy(gamestates[-1])
+    results.menu_state = melee.Menu.POSTGAME_SCORES
+    for player in results.players.values():
+        player.off_stage = False
+    game = CustomGame(console_factory=lambda slippi_port: FakeConsole(None, at_end="none", gamestates=gamestates + [results]),
+                      observation_mode="flat", frame_stack=2, action_repeat=4)
+    observation, info = game.reset()
+    live_obs, live_next_obs, live_rewards, live_dones, live_frames = [], [], [], [], []
+    done = False
+    while not done:
+        live_obs.append(observation.copy())
+        observation, reward, done, truncated, info = game.step(0)
+        live_next_obs.append(observation.copy())
+        live_rewards.append(reward)
+        live_dones.append(done)
+        live_frames.append(info["frames"])
+
+    features = ReplayFeatures()
+    for gamestate in gamestates:
+        features.append(gamestate, [game.agent_port, game.opponent_port])
+    x, y0, y1 = features.arrays()
+    parts = game_transitions(x, y0, "flat", 2, 4, features.stock_counts())
+    obs, actions, rewards, next_obs, dones, truncated = parts[0]
+
+    # Both of the agent's KOs cut a step short, so the steps aren't all 4 frames.
+    assert sorted(set(live_frames)) != [4]
+    assert len(rewards) == len(live_rewards)
+    numpy.testing.assert_allclose(rewards, live_rewards, rtol=1e-5, atol=1e-5)
+    numpy.testing.assert_allclose(obs, live_obs, rtol=1e-6)
+    numpy.testing.assert_allclose(next_obs, live_next_obs, rtol=1e-6)
+    assert list(dones) == live_dones
+    assert not truncated.any()
+    # The other ways of splitting the game up stop at the agent's first KO, on frame 90.
+    assert len(parts) == 4
+    for offset, part in enumerate(parts[1:], start=1):
+        assert len(part[1]) == len(range(offset, 90, 4))
+        assert part[5][-1] and not part[4].any()
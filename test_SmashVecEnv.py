@@ -0,0 +1,98 @@
+# Runs SmashVecEnv.py's games against FakeConsole.py instead of Dolphin. Run with `python -m pytest`.
+
+import os
+import melee
+import pytest
+import SmashGym
+from FakeConsole import FakeConsole, FakeController, synthetic_gamestates
+from SmashVecEnv import BASE_SLIPPI_PORT, game_factories, make_vec_env
+
+GAMESTATES = synthetic_gamestates(600)
+# Nobody loses a stock, so every action gets held for the full action_repeat.
+for gamestate in GAMESTATES:
+    for player in gamestate.players.values():
+        player.stock = 4
+
+
+# Keeps track of every port a console got made for. A module-level function, like a real console_factory has to be.
+def fake_console(slippi_port: int):
+    console = FakeConsole(None, at_end="loop", gamestates=GAMESTATES)
+    console.slippi_port = slippi_port
+    fake_console.ports.append(slippi_port)
+    return console
+
+
+# The same, for SubprocVecEnv. Its workers are brand new processes that never saw no_dolphin's patches, so the first console a
+# worker makes puts them in place there.
+def worker_fake_console(slippi_port: int):
+    melee.Controller = FakeController
+    SmashGym.time.sleep = lambda seconds: None
+    console = FakeConsole(None, at_end="loop", gamestates=GAMESTATES)
+    console.slippi_port = slippi_port
+    console.pid = os.getpid()
+    return console
+
+
+@pytest.fixture(autouse=True)
+def no_dolphin(monkeypatch):
+    fake_console.ports = []
+    monkeypatch.setattr(melee, "Controller", FakeController)
+    # CustomGame waits for Dolphin to start up, which a fake console doesn't need.
+    monkeypatch.setattr(SmashGym.time, "sleep", lambda seconds: None)
+
+
+def test_game_factories_give_each_game_its_own_port():
+    games = [factory() for factory in game_factories(3, fake_console, monitor=False, action_repeat=2)]
+    assert [game.slippi_port for game in games] == [BASE_SLIPPI_PORT, BASE_SLIPPI_PORT + 1, BASE_SLIPPI_PORT + 2]
+    for game in games:
+        observation, info = game.reset()
+        assert game.observation_space.contains(observation)
+        observation, reward, terminated, truncated, info = game.step(0)
+        assert game.observation_space.contains(observation)
+        assert info["frames"] == 2
+    assert fake_console.ports == [BASE_SLIPPI_PORT, BASE_SLIPPI_PORT + 1, BASE_SLIPPI_PORT + 2]
+
+
+def test_dummy_vec_env_resets_and_steps():
+    pytest.importorskip("stable_baselines3")
+    env = make_vec_env(2, backend="dummy", console_factory=fake_console, base_slippi_port=60000, observation_mode="flat")
+    try:
+        assert env.num_envs == 2
+        assert [game.unwrapped.slippi_port for game in env.envs] == [60000, 60001]
+        observations = env.reset()
+        assert observations.shape == (2,) + env.observation_space.shape
+        assert fake_console.ports == [60000, 60001]
+        observations, rewards, dones, infos = env.step([0, 84])
+        assert observations.shape == (2,) + env.observation_space.shape
+        assert rewards.shape == (2,) and dones.shape == (2,)
+        assert [info["frames"] for info in infos] == [1, 1]
+        # Each game got its own console, and each console moved on by one frame.
+        assert [game.unwrapped.console.slippi_port for game in env.envs] == [60000, 60001]
+        assert [game.unwrapped.console.frames for game in env.envs] == [2, 2]
+    finally:
+        env.close()
+
+
+def test_subproc_vec_env_steps_every_worker_together():
+    pytest.importorskip("stable_baselines3")
+    env = make_vec_env(3, backend="subproc", console_factory=worker_fake_console, base_slippi_port=60010,
+                       observation_mode="flat", action_repeat=2)
+    try:
+        assert env.num_envs == 3
+        assert env.get_attr("slippi_port") == [60010, 60011, 60012]
+        observations = env.reset()
+        assert observations.shape == (3,) + env.observation_space.shape
+        # Every game made its own console, in its own worker process.
+        consoles = env.get_attr("console")
+        assert [console.slippi_port for console in consoles] == [60010, 60011, 60012]
+        assert len(set(console.pid for console in consoles)) == 3
+        assert os.getpid() not in [console.pid for console in consoles]
+        for actions in ([0, 42, 84], [84, 0, 42]):
+            observations, rewards, dones, infos = env.step(actions)
+            assert observations.shape == (3,) + env.observation_space.shape
+            assert rewards.shape == (3,) and dones.shape == (3,)
+            assert not dones.any()
+            assert [info["frames"] for info in infos] == [2, 2, 2]
+        assert [console.frames for console in env.get_attr("console")] == [5, 5, 5]
+    finally:
+        env.close()